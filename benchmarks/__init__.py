@@ -0,0 +1,5 @@
+"""Benchmarks for EMRio.
+
+workload builds seeded synthetic EMR histories and run times the expensive
+parts of EMRio on them. See the Makefile's bench target.
+"""
@@ -0,0 +1,202 @@
+"""Times EMRio's expensive stages on synthetic histories of different sizes.
+
+Run from the root of the repo, e.g.:
+
+    python -m benchmarks.run --sizes 1000,10000 --output bench.json
+
+Results are written as JSON. Pass an older results file to --compare to
+fail (exit status 1) if any stage got slower than --tolerance allows.
+"""
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import pytz
+
+from benchmarks.workload import generate_job_flows
+from benchmarks.workload import instance_types_from_prices
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.graph_jobs import Grapher
+from emrio_lib.job_handler import calculate_demand_hours
+from emrio_lib.job_handler import convert_dates
+from emrio_lib.job_handler import load_job_flows_from_file
+from emrio_lib.job_handler import no_date_filter
+from emrio_lib.optimizer import Optimizer
+from emrio_lib.simulate_jobs import Simulator
+
+# Bump if the meaning of the results changes, so old results aren't compared.
+RESULTS_VERSION = 1
+
+DEFAULT_SIZES = '1000,10000,100000,1000000'
+DEFAULT_PRICES = 'instance_costs/west_coast_1.yaml'
+
+# The optimizer runs many simulations, so by default it is only timed on the
+# smaller histories.
+DEFAULT_OPTIMIZE_MAX_JOBS = 10000
+
+
+def main():
+    option_parser = make_option_parser()
+    options, args = option_parser.parse_args()
+    EC2 = EC2Info(options.instance_costs)
+    instance_types = instance_types_from_prices(options.instance_costs)
+
+    results = []
+    for size in [int(size) for size in options.sizes.split(',')]:
+        sys.stderr.write("Benchmarking %d job flows...\n" % size)
+        job_flows = generate_job_flows(size, instance_types, seed=options.seed)
+        for stage, seconds, cpu_seconds in benchmark_history(
+                job_flows, EC2, optimize=size <= options.optimize_max_jobs):
+            sys.stderr.write("  %-20s %10.3fs\n" % (stage, seconds))
+            results.append({'jobs': size,
+                            'stage': stage,
+                            'seconds': seconds,
+                            'cpu_seconds': cpu_seconds})
+
+    report = {
+        'version': RESULTS_VERSION,
+        'seed': options.seed,
+        'instance_costs': options.instance_costs,
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(baseline, report, options.tolerance)
+        for regression in regressions:
+            sys.stderr.write("REGRESSION: %(stage)s on %(jobs)d job flows "
+                "took %(seconds).3fs, was %(baseline).3fs\n" % regression)
+        if regressions:
+            sys.exit(1)
+
+
+def make_option_parser():
+    option_parser = OptionParser(description='Benchmark EMRio.')
+    option_parser.add_option(
+        '--sizes', dest='sizes', type='string', default=DEFAULT_SIZES,
+        help='Comma separated amounts of job flows to benchmark (default %s)'
+        % DEFAULT_SIZES)
+    option_parser.add_option(
+        '--seed', dest='seed', type='int', default=0,
+        help='Seed for the synthetic histories (default 0)')
+    option_parser.add_option(
+        '--instance-cost', dest='instance_costs', type='string',
+        default=DEFAULT_PRICES, help='Price file to take instance types and'
+        ' costs from (default %s)' % DEFAULT_PRICES)
+    option_parser.add_option(
+        '--optimize-max-jobs', dest='optimize_max_jobs', type='int',
+        default=DEFAULT_OPTIMIZE_MAX_JOBS, help='Only time the optimizer on'
+        ' histories with at most this many job flows (default %d)' %
+        DEFAULT_OPTIMIZE_MAX_JOBS)
+    option_parser.add_option(
+        '-o', '--output', dest='output', type='string', default=None,
+        help='Write the results to this file instead of stdout')
+    option_parser.add_option(
+        '--compare', dest='compare', type='string', default=None,
+        help='Results file from an earlier run to check for regressions')
+    option_parser.add_option(
+        '--tolerance', dest='tolerance', type='float', default=0.25,
+        help='How much slower (as a fraction) a stage can get before it'
+        ' counts as a regression (default 0.25)')
+    return option_parser
+
+
+def benchmark_history(raw_job_flows, EC2, optimize=True):
+    """Times each stage on one history.
+
+    Args:
+        raw_job_flows: Job flows with string dates, as generated by
+            generate_job_flows.
+
+        optimize: Whether to time the optimizer.
+
+    Returns:
+        A list of (stage, wall seconds, cpu seconds) tuples.
+    """
+    timings = []
+
+    def timed(stage, function, *args):
+        start_time = time.time()
+        start_cpu = sum(os.times()[:2])
+        result = function(*args)
+        timings.append((stage, time.time() - start_time,
+                        sum(os.times()[:2]) - start_cpu))
+        return result
+
+    fd, filename = tempfile.mkstemp(suffix='.jsonl')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for job in raw_job_flows:
+                f.write(json.dumps(job) + '\n')
+        job_flows = timed('ingest', ingest, filename)
+    finally:
+        os.remove(filename)
+
+    demand_hours = timed('demand_hours', calculate_demand_hours, job_flows)
+    pool = average_usage_pool(job_flows, demand_hours, EC2)
+    simulator = Simulator(job_flows, pool, EC2)
+    timed('event_timeline', simulator.setup_job_event_timeline)
+    timed('simulate', simulator.run)
+    if optimize:
+        optimizer = Optimizer(job_flows, EC2, demand_hours=demand_hours)
+        timed('optimize', optimizer.run)
+    grapher = Grapher(job_flows, pool, EC2)
+    timed('graph_traces',
+        lambda: grapher.binned_traces(grapher.record_used_instances()))
+    return timings
+
+
+def ingest(filename):
+    """Reads a history file the same way get_job_flows does."""
+    job_flows = load_job_flows_from_file(filename)
+    job_flows = no_date_filter(job_flows)
+    job_flows = convert_dates(job_flows, pytz.utc)
+    return sorted(job_flows, key=lambda job: job.get('startdatetime'))
+
+
+def average_usage_pool(job_flows, demand_hours, EC2):
+    """A pool with as many heavy utilization instances of each type as are
+    used on average, so the simulations have reserved instances to allocate.
+    """
+    begin_time = min(job['startdatetime'] for job in job_flows)
+    end_time = max(job['enddatetime'] for job in job_flows)
+    interval = end_time - begin_time
+    hours = interval.days * 24 + interval.seconds / 3600.0
+    pool = EC2.init_empty_reserve_pool()
+    for instance_type, used_hours in demand_hours.items():
+        pool[EC2.RESERVE_PRIORITIES[0]][instance_type] = int(
+            used_hours / hours)
+    return pool
+
+
+def find_regressions(baseline, report, tolerance):
+    """Returns the stages in report that are more than tolerance slower than
+    in baseline."""
+    if baseline.get('version') != report['version']:
+        return []
+    baseline_seconds = dict(((result['jobs'], result['stage']),
+                            result['seconds'])
+                            for result in baseline['results'])
+    regressions = []
+    for result in report['results']:
+        old_seconds = baseline_seconds.get((result['jobs'], result['stage']))
+        if old_seconds and result['seconds'] > old_seconds * (1 + tolerance):
+            regression = dict(result)
+            regression['baseline'] = old_seconds
+            regressions.append(regression)
+    return regressions
+
+if __name__ == '__main__':
+    main()
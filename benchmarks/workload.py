@@ -0,0 +1,137 @@
+"""Generates synthetic EMR job flow histories for benchmarking.
+
+The histories are a mix of the kinds of job flows a real EMR account runs:
+
+cron: Clusters of the same shape launched on a schedule (hourly or daily) at
+    a fixed minute, running for a similar amount of time each launch.
+
+long running: A few clusters that stay up for days.
+
+ad hoc: Bursts of one-off clusters during working hours, of random shapes
+    and lengths.
+
+Job flows are returned in the same format as a --dump-jobs file, with dates as
+ISO 8601 strings, so they go through the same ingest code as real histories.
+Everything is generated from a seeded random.Random, so the same arguments
+always give the same history.
+"""
+import datetime
+import math
+import random
+
+from emrio_lib.ec2_cost import EC2Info
+
+DEFAULT_START = datetime.datetime(2012, 3, 1)
+DEFAULT_DAYS = 60
+
+# Fraction of job flows of each kind. The rest are ad hoc.
+CRON_FRACTION = 0.6
+LONG_RUNNING_FRACTION = 0.001
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def instance_types_from_prices(filename):
+    """Returns the sorted instance types with finite on demand prices in a
+    price file, e.g. instance_costs/west_coast_1.yaml."""
+    EC2 = EC2Info(filename)
+    on_demand = EC2.COST[EC2.on_demand_class()]
+    return sorted(instance_type for instance_type in on_demand
+                if not math.isinf(on_demand[instance_type]['hourly']))
+
+
+def generate_job_flows(job_count, instance_types, seed=0,
+                        start=DEFAULT_START, days=DEFAULT_DAYS):
+    """Generates a synthetic job flow history.
+
+    Args:
+        job_count: Amount of job flows to generate.
+
+        instance_types: A list of instance types to pick from.
+
+        seed: Seed for the random generator.
+
+        start: datetime the history starts at.
+
+        days: Amount of days the history spans.
+
+    Returns:
+        job_flows: A list of job flow dicts sorted by start time, with
+            string dates.
+    """
+    rng = random.Random(seed)
+    end = start + datetime.timedelta(days=days)
+    job_flows = []
+
+    long_running_count = max(1, int(job_count * LONG_RUNNING_FRACTION))
+    cron_count = int(job_count * CRON_FRACTION)
+    ad_hoc_count = job_count - long_running_count - cron_count
+
+    for _ in xrange(long_running_count):
+        begin = start + datetime.timedelta(
+            seconds=rng.randint(0, days * 24 * 60 * 60 // 2))
+        duration = datetime.timedelta(hours=rng.uniform(48, days * 24 / 2))
+        job_flows.append(_job(rng, begin, min(begin + duration, end),
+            _shape(rng, instance_types, max_count=40)))
+
+    # Each cron schedule launches the same shape hourly or daily until it
+    # has launched its share of the cron job flows.
+    while cron_count > 0:
+        if rng.random() < 0.5:
+            period = datetime.timedelta(hours=1)
+            runtime_hours = rng.uniform(0.1, 0.9)
+        else:
+            period = datetime.timedelta(days=1)
+            runtime_hours = rng.uniform(0.5, 6)
+        shape = _shape(rng, instance_types, max_count=20)
+        launches = min(cron_count, int(days * 24 * 3600 //
+            (period.days * 24 * 3600 + period.seconds)))
+        launch = start + datetime.timedelta(minutes=rng.randint(0, 59),
+            hours=(rng.randint(0, 23) if period.days else 0))
+        for _ in xrange(launches):
+            runtime = datetime.timedelta(
+                hours=runtime_hours * rng.uniform(0.9, 1.1))
+            job_flows.append(_job(rng, launch, launch + runtime, shape))
+            launch += period
+        cron_count -= launches
+
+    # Ad hoc job flows come in bursts, mostly during working hours.
+    while ad_hoc_count > 0:
+        burst_size = min(ad_hoc_count, rng.randint(1, 30))
+        day = start + datetime.timedelta(days=rng.randint(0, days - 1))
+        burst_start = day + datetime.timedelta(
+            hours=min(23.5, max(0, rng.gauss(14, 3))))
+        for _ in xrange(burst_size):
+            begin = burst_start + datetime.timedelta(
+                minutes=rng.expovariate(1 / 20.0))
+            runtime = datetime.timedelta(
+                hours=min(24, max(0.05, rng.lognormvariate(0, 1))))
+            job_flows.append(_job(rng, begin, begin + runtime,
+                _shape(rng, instance_types, max_count=50)))
+        ad_hoc_count -= burst_size
+
+    job_flows.sort(key=lambda job: job['startdatetime'])
+    for job_id, job in enumerate(job_flows):
+        job['jobflowid'] = 'j-%08d' % job_id
+    return job_flows
+
+
+def _shape(rng, instance_types, max_count):
+    """A random set of instance groups: a master and one or two core
+    groups."""
+    groups = [(rng.choice(instance_types), 1)]
+    for _ in xrange(rng.randint(1, 2)):
+        groups.append((rng.choice(instance_types),
+                        rng.randint(1, max_count)))
+    return groups
+
+
+def _job(rng, begin, end, shape):
+    return {
+        'startdatetime': begin.strftime(DATE_FORMAT),
+        'enddatetime': end.strftime(DATE_FORMAT),
+        'instancegroups': [
+            {'instancetype': instance_type,
+             'instancerequestcount': str(count)}
+            for instance_type, count in shape],
+    }
@@ -8,29 +8,93 @@ you will save by doing so.
 If you are looking for instructions to run the program, look at the
 readme in the root EMRio folder.
 """
+import time
+# Recorded before anything else is imported, for --time-imports.
+_IMPORT_START_TIME = time.time()
+
+import atexit
+import datetime
 import json
 import locale
 import logging
+import sys
+from contextlib import contextmanager
 from optparse import OptionParser
 
-import boto
-import pytz
-
+from approximate import approximate_optimize
+from approximate import DEFAULT_FRACTION
+from approximate import DEFAULT_MAX_ERROR
+from aws_client import default_client
+from backtest import backtest
+from backtest import make_windows
+from bootstrap import BLOCK_LENGTHS
+from bootstrap import bootstrap
+from bootstrap import DAY
+from bootstrap import percentile_bands
+from compression import open_history
 from ec2_cost import EC2Info
 from ec2_cost import instance_types_in_pool
+from evaluate import evaluate_pools
+from folding import compare_with_simulation
+from folding import FoldedOptimizer
+from folding import FoldedProfile
+from folding import PERIODS as FOLD_PERIODS
+from graph_jobs import AGGREGATES
+from graph_jobs import DEFAULT_MAX_POINTS
 from graph_jobs import Grapher
+from graph_jobs import MAX
+from import_timer import ImportTimer
+from incremental import incremental_optimize
+from incremental import load_state
+from incremental import save_state
+from job_handler import calculate_demand_hours
+from job_handler import collapse_job_flows
 from job_handler import get_job_flows
 from job_handler import load_job_flows_from_amazon
+from job_handler import load_job_flows_from_file
+from job_index import JobFlowIndex
+from job_store import is_job_flow_store
+from job_store import JobFlowStore
 from optimizer import convert_to_yearly_estimated_hours
 from optimizer import Optimizer
+from optimizer import OptimizerStats
+from partitions import is_partitioned_history
+from partitions import manifest_path
+from partitions import PartitionedHistory
+from partitions import PERIODS as PARTITION_PERIODS
+from profiling import StageProfiler
+from sharded import ShardedSimulator
 from simulate_jobs import Simulator
+from stage_cache import hash_file
+from stage_cache import hash_job_flows
+from stage_cache import pool_items
+from stage_cache import StageCache
+
+# Report output formats.
+TEXT = 'text'
+JSON = 'json'
+
+# Where emrio serve listens by default.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8321
+
+# Heavy dependencies (boto, matplotlib, pytz and yaml) are imported by the
+# functions that use them, so runs that don't need them start quickly.
+EMRIO_IMPORT_SECONDS = time.time() - _IMPORT_START_TIME
 
 
 def main():
     option_parser = make_option_parser()
     options, args = option_parser.parse_args()
-    timezone = pytz.timezone(options.timezone)
-    EC2 = EC2Info(options.instance_costs)
+    if options.evaluate and not args:
+        option_parser.error('--evaluate needs at least one pool file')
+    if options.approximate and options.optimized_file:
+        option_parser.error("--approximate can't be used with -o, which"
+            " already gives the pool")
+    if options.time_imports:
+        import_timer = ImportTimer(EMRIO_IMPORT_SECONDS)
+        import_timer.install()
+        atexit.register(import_timer.report, sys.stderr)
 
     if options.verbose:
         logging.basicConfig(level=logging.DEBUG)
@@ -39,27 +103,180 @@ def main():
 
     if options.dump:
         logging.info("Dumping job flow history into %s", options.dump)
-        write_job_flow_history(options.dump)
+        write_job_flow_history(options.dump,
+                            source_filename=options.file_inputs,
+                            partition=options.partition)
+        return
+
+    import pytz
+    timezone = pytz.timezone(options.timezone)
+
+    if args and args[0] == 'serve':
+        from server import serve
+        serve(options, timezone)
         return
 
-    job_flows = get_job_flows(options, timezone)
-    logging.info('Finding optimal instance pool (this may take a minute or '
-        'two)...')
-    pool = get_best_instance_pool(job_flows,
-                                options.optimized_file,
-                                options.save,
-                                EC2)
-    optimal_logged_hours, demand_logged_hours = simulate_job_flows(job_flows,
-                                                                    pool,
-                                                                    EC2)
-    output_statistics(optimal_logged_hours, pool, demand_logged_hours, EC2)
+    EC2 = EC2Info(options.instance_costs)
+
+    stage_cache = None
+    if options.cache_dir:
+        stage_cache = StageCache(options.cache_dir,
+                                int(options.cache_max_mb * 1024 * 1024))
+    profiler = StageProfiler(enabled=options.profile,
+                            profile_dir=options.profile_dir)
+
+    job_flows, demand_hours, history_key = load_history(options, timezone,
+                                                        stage_cache, profiler)
+    if not job_flows:
+        logging.error("There are no job flows in the history to work with")
+        return
+    if options.evaluate:
+        with profiler.stage('evaluate'):
+            compare_pools(args, job_flows, demand_hours, EC2,
+                        output_format=options.output_format,
+                        output_file=options.output_file)
+        if profiler.enabled:
+            profiler.report(sys.stderr)
+        return
 
-    Grapher(job_flows, pool, EC2).show(total_usage=options.total_usage,
-                                        instance_usage=options.instance_usage)
+    if options.backtest:
+        days = lambda count: count and datetime.timedelta(count)
+        windows = make_windows(job_flows, days(options.train_days),
+                            days(options.test_days), days(options.step_days))
+        if not windows:
+            logging.error("The job flows don't span a train and a test"
+                " window")
+            return
+        with profiler.stage('backtest'):
+            results = backtest(job_flows, windows, EC2,
+                            processes=options.backtest_processes)
+        output_backtest(results, EC2, output_format=options.output_format,
+                        output_file=options.output_file)
+        if profiler.enabled:
+            profiler.report(sys.stderr)
+        return
+
+    if options.bootstrap:
+        with profiler.stage('bootstrap'):
+            results = bootstrap(job_flows, EC2, options.bootstrap,
+                                block=options.bootstrap_block,
+                                seed=options.seed,
+                                processes=options.bootstrap_processes,
+                                pre_existing_pool=(
+                                    get_owned_reserved_instances(EC2)))
+        output_bootstrap(percentile_bands(results, EC2), EC2,
+                        output_format=options.output_format,
+                        output_file=options.output_file)
+        if profiler.enabled:
+            profiler.report(sys.stderr)
+        return
+
+    # Only optimizing looks times up in the history, for the simulation, the
+    # fold comparison and the graphs.
+    job_flows_index = JobFlowIndex(job_flows)
+    optimize_key_parts = None
+    if stage_cache:
+        optimize_key_parts = [history_key, hash_file(options.instance_costs),
+                            options.fold]
+    folded_profile = None
+    if options.fold:
+        with profiler.stage('fold'):
+            folded_profile = FoldedProfile(job_flows,
+                                        FOLD_PERIODS[options.fold])
+    optimizer_stats = OptimizerStats()
+    approximation = None
+    if options.approximate:
+        with profiler.stage('approximate'):
+            approximation = approximate_optimize(job_flows, EC2,
+                demand_hours=demand_hours, fraction=options.sample_fraction,
+                seed=options.seed, max_error=options.max_error,
+                pre_existing_pool=get_owned_reserved_instances(EC2))
+        if not approximation['separated']:
+            logging.info("The sample can't pick a pool, optimizing exactly")
+
+    if approximation and approximation['separated']:
+        pool = approximation['pool']
+        optimal_logged_hours = approximation['logged_hours']
+        demand_logged_hours = approximation['demand_logged_hours']
+        if options.save:
+            write_optimal_instances(options.save, pool)
+    else:
+        logging.info('Finding optimal instance pool (this may take a minute'
+            ' or two)...')
+        with profiler.stage('optimize'):
+            pool = get_best_instance_pool(job_flows,
+                                        options.optimized_file,
+                                        options.save,
+                                        EC2,
+                                        demand_hours=demand_hours,
+                                        stage_cache=stage_cache,
+                                        cache_key_parts=optimize_key_parts,
+                                        optimizer_stats=optimizer_stats,
+                                        state_filename=options.state,
+                                        prices_key=hash_file(
+                                            options.instance_costs),
+                                        folded_profile=folded_profile)
+        # 0 means every core.
+        simulate_processes = options.simulate_processes or None
+        with profiler.stage('simulate'):
+            optimal_logged_hours, demand_logged_hours = simulate_job_flows(
+                job_flows, pool, EC2, demand_hours=demand_hours,
+                stage_cache=stage_cache, history_key=history_key,
+                prices_key=hash_file(options.instance_costs),
+                processes=simulate_processes,
+                job_flows_index=job_flows_index)
+    fold_comparison = None
+    if folded_profile:
+        fold_comparison = compare_with_simulation(folded_profile, pool, EC2,
+            optimal_logged_hours, demand_logged_hours,
+            job_flows_index.interval())
+    with profiler.stage('report'):
+        instrumentation = {
+            'stages': profiler.stages,
+            'optimizer': optimizer_stats.as_dict(),
+        }
+        output_statistics(optimal_logged_hours, pool, demand_logged_hours,
+                        EC2,
+                        output_format=options.output_format,
+                        output_file=options.output_file,
+                        instrumentation=instrumentation,
+                        fold_comparison=fold_comparison,
+                        approximation=approximation_summary(approximation))
+
+    with profiler.stage('graph'):
+        make_graphs(options, job_flows, pool, EC2,
+                    job_flows_index=job_flows_index)
+
+    if profiler.enabled:
+        profiler.report(sys.stderr)
+
+
+def make_graphs(options, job_flows, pool, EC2, job_flows_index=None):
+    """Shows or saves the graphs asked for in the options."""
+    bin_seconds = None
+    if options.graph_bin_minutes:
+        bin_seconds = options.graph_bin_minutes * 60
+    grapher = Grapher(job_flows, pool, EC2,
+                    bin_seconds=bin_seconds,
+                    max_points=options.graph_max_points,
+                    aggregate=options.graph_aggregate,
+                    job_flows_index=job_flows_index)
+    if options.graph_dir:
+        # Without a display, render every graph unless told otherwise.
+        render_all = not (options.total_usage or options.instance_usage)
+        grapher.save(options.graph_dir,
+                    total_usage=options.total_usage or render_all,
+                    instance_usage=options.instance_usage or render_all,
+                    image_format=options.graph_format,
+                    processes=options.graph_processes)
+    else:
+        grapher.show(total_usage=options.total_usage,
+                    instance_usage=options.instance_usage)
 
 
 def make_option_parser():
-    description = 'Print a giant report on EMR usage.'
+    description = ('Print a giant report on EMR usage. Run "emrio serve" to'
+        ' answer what-if queries over HTTP instead.')
     option_parser = OptionParser(description=description)
     option_parser.add_option(
         '-v', '--verbose', dest='verbose', default=False, action='store_true',
@@ -67,6 +284,34 @@ def make_option_parser():
     option_parser.add_option(
         '-q', '--quiet', dest='quiet', default=False, action='store_true',
         help="Don't log status messages; just print the report.")
+    option_parser.add_option(
+        '--time-imports', dest='time_imports', default=False,
+        action='store_true', help='Print how long importing EMRio and each'
+        ' of its dependencies took to stderr when done')
+    option_parser.add_option(
+        '--host', dest='host', type='string', default=DEFAULT_HOST,
+        help='Address for emrio serve to listen on (default %s)' %
+        DEFAULT_HOST)
+    option_parser.add_option(
+        '--port', dest='port', type='int', default=DEFAULT_PORT,
+        help='Port for emrio serve to listen on (default %d)' % DEFAULT_PORT)
+    option_parser.add_option(
+        '--output-format', dest='output_format', type='choice',
+        choices=[TEXT, JSON], default=TEXT, help='Print the report as a'
+        ' text table (text, the default) or a single JSON document (json)'
+        ' with the pools, yearly hours, costs and timing data')
+    option_parser.add_option(
+        '--output-file', dest='output_file', type='string', default=None,
+        help='Write the report to this file instead of stdout')
+    option_parser.add_option(
+        '--profile', dest='profile', default=False, action='store_true',
+        help='Print the wall time and CPU time of every stage, the peak'
+        ' memory so far and how much the stage raised it to stderr when'
+        ' done')
+    option_parser.add_option(
+        '--profile-dir', dest='profile_dir', type='string', default=None,
+        help='Run cProfile over every stage and dump the stats into this'
+        ' directory as STAGE.pstats (implies --profile)')
     option_parser.add_option(
         '-c', '--conf-path', dest='conf_path', default=None,
         help='Path to alternate mrjob.conf file to read from')
@@ -90,7 +335,10 @@ def make_option_parser():
     option_parser.add_option(
         '--file', dest='file_inputs', type='string', default=None,
         help="Input a file that has job flows JSON encoded. The format is 1 "
-        "job per line or comma separated jobs.")
+        "job per line or comma separated jobs, and may be gzip, bz2, xz or"
+        " zstd compressed. Can also be a job flow store or partitioned"
+        " history made by --dump-jobs, which only read the --min-day to"
+        " --max-day range.")
     option_parser.add_option(
         '-o', '--optimized', dest='optimized_file', type='string',
         default=None, help=("Uses a previously saved optimized pool instead of"
@@ -99,6 +347,92 @@ def make_option_parser():
         '--cache', dest='save', type='string', default=None,
         help='Save the optimized results so you dont calculate them multiple'
         ' times')
+    option_parser.add_option(
+        '--state', dest='state', type='string', default=None,
+        help='Keep the optimizer state in this file between runs. Only'
+        ' instance types whose job flows were added or expired since the last'
+        ' run are simulated again, starting from the last optimal pool. The'
+        ' others reuse their simulated hours, rescaled if the job flows span'
+        ' a different interval')
+    option_parser.add_option(
+        '--cache-dir', dest='cache_dir', type='string', default=None,
+        help='Keep the results of every stage (loading the history,'
+        ' optimizing and simulating) in this directory and reuse them when'
+        ' their inputs have not changed')
+    option_parser.add_option(
+        '--cache-max-mb', dest='cache_max_mb', type='float', default=1024,
+        help='Size limit of --cache-dir in megabytes. The least recently'
+        ' used results are deleted first (default 1024)')
+    option_parser.add_option(
+        '--evaluate', dest='evaluate', action='store_true', default=False,
+        help='Instead of optimizing, score the pools in the files given as'
+        ' arguments (saved with --cache) against the job flows and print a'
+        ' table comparing their costs. Skips graphs and Amazon calls')
+    option_parser.add_option(
+        '--backtest', dest='backtest', action='store_true', default=False,
+        help='Instead of a single report, slide train and test windows over'
+        ' the job flows, optimize on each train window and print how much'
+        ' that pool saves on the test window after it')
+    option_parser.add_option(
+        '--train-days', dest='train_days', type='float', default=56,
+        help='Length of the --backtest train windows (default 56)')
+    option_parser.add_option(
+        '--test-days', dest='test_days', type='float', default=14,
+        help='Length of the --backtest test windows (default 14)')
+    option_parser.add_option(
+        '--step-days', dest='step_days', type='float', default=None,
+        help='Days to slide the --backtest windows by (default --test-days)')
+    option_parser.add_option(
+        '--backtest-processes', dest='backtest_processes', type='int',
+        default=None, help='Number of processes to simulate --backtest test'
+        ' windows in. The optimizations run in order, so the results are the'
+        ' same for any number (default: number of cores)')
+    option_parser.add_option(
+        '--bootstrap', dest='bootstrap', type='int', default=0,
+        help='Instead of a single report, optimize this many resamples of'
+        ' the job flows (made of random days or weeks of the history) and'
+        ' print percentile bands for the reserved counts and savings')
+    option_parser.add_option(
+        '--bootstrap-block', dest='bootstrap_block', type='choice',
+        choices=sorted(BLOCK_LENGTHS), default=DAY, help='Resample the'
+        ' history a day or a week at a time (default day)')
+    option_parser.add_option(
+        '--bootstrap-processes', dest='bootstrap_processes', type='int',
+        default=None, help='Number of processes to optimize --bootstrap'
+        ' resamples with (default: number of cores)')
+    option_parser.add_option(
+        '--seed', dest='seed', type='int', default=0,
+        help='Random seed for --bootstrap and --approximate (default 0)')
+    option_parser.add_option(
+        '--fold', dest='fold', type='choice', choices=sorted(FOLD_PERIODS),
+        default=None, help='Optimize on the history folded onto a week or a'
+        ' day (the instances billed in each hour, for every week or day)'
+        ' instead of simulating every job flow. The report shows how far the'
+        ' folded savings are from the full simulation, and the reserved and'
+        ' on demand instances used in each hour of an average week or day')
+    option_parser.add_option(
+        '--approximate', dest='approximate', action='store_true',
+        default=False, help='Optimize on a sample of the days of the'
+        ' history and report 95% intervals for the cost and savings. Falls'
+        ' back to the exact optimizer if a similar pool could save more by'
+        ' over --max-error')
+    option_parser.add_option(
+        '--sample-fraction', dest='sample_fraction', type='float',
+        default=DEFAULT_FRACTION, help='Fraction of the days to sample for'
+        ' --approximate (default %.1f)' % DEFAULT_FRACTION)
+    option_parser.add_option(
+        '--max-error', dest='max_error', type='float',
+        default=DEFAULT_MAX_ERROR, help='Fraction of the savings --approximate'
+        ' may be off by when picking a pool (default %.2f)' %
+        DEFAULT_MAX_ERROR)
+    option_parser.add_option(
+        '--load-processes', dest='load_processes', type='int',
+        default=None, help='Number of processes to parse a one job per line'
+        ' --file in (defaults to the number of cores)')
+    option_parser.add_option(
+        '--simulate-processes', dest='simulate_processes', type='int',
+        default=1, help='Simulate the optimal pool in this many processes,'
+        ' a window of time in each (0 for the number of cores, default 1)')
     option_parser.add_option(
         '-g', '--graph_instance_usage', dest='instance_usage',
         action='store_true', default=False, help='Load a graph'
@@ -107,10 +441,45 @@ def make_option_parser():
         '--total_usage', dest='total_usage', action='store_true',
         default=False, help='Load a graph of total hourly usage for each'
         ' instance type')
+    option_parser.add_option(
+        '--graph-bin-minutes', dest='graph_bin_minutes', type='float',
+        default=None, help='Bucket graphs into bins this many minutes wide.'
+        ' By default the bin size is picked from --graph-max-points')
+    option_parser.add_option(
+        '--graph-max-points', dest='graph_max_points', type='int',
+        default=DEFAULT_MAX_POINTS, help='Most points to graph for each'
+        ' instance type when --graph-bin-minutes is not set (default %d)' %
+        DEFAULT_MAX_POINTS)
+    option_parser.add_option(
+        '--graph-aggregate', dest='graph_aggregate', type='choice',
+        choices=list(AGGREGATES), default=MAX, help='How to combine the'
+        ' points in a graph bin: max or mean (default max)')
+    option_parser.add_option(
+        '--graph-dir', dest='graph_dir', type='string', default=None,
+        help='Render graphs to image files in this directory instead of'
+        ' showing them, along with an index.json listing them. Renders all'
+        ' graphs unless -g or --total_usage is given')
+    option_parser.add_option(
+        '--graph-format', dest='graph_format', type='string', default='png',
+        help='Image format for --graph-dir, e.g. png or svg (default png)')
+    option_parser.add_option(
+        '--graph-processes', dest='graph_processes', type='int',
+        default=None, help='Number of processes to render --graph-dir'
+        ' images with (default: number of cores)')
     option_parser.add_option(
         '-d', '--dump-jobs', dest='dump', type='string', default=None,
         help="dumps a job history into the file specified. Won't run the"
-        " optimizer.")
+        " optimizer. Files named *.db, *.sqlite or *.sqlite3 (or existing"
+        " SQLite files) are job flow stores, which the job flows are"
+        " upserted into and which --file can read. Files named *.gz, *.bz2,"
+        " *.xz or *.zst are compressed. With --file, copies that history"
+        " instead of fetching it from Amazon.")
+    option_parser.add_option(
+        '--partition', dest='partition', type='choice',
+        choices=PARTITION_PERIODS, default=None, help="With --dump-jobs,"
+        " write the history into a directory of files for each day or week"
+        " the job flows started on. --file reads only the files in the"
+        " --min-day to --max-day range.")
     option_parser.add_option(
         '-t', '--timezone', dest='timezone', type='string',
         default="US/Alaska", help="This option specifies a different timezone"
@@ -124,7 +493,73 @@ def make_option_parser():
     return option_parser
 
 
-def get_best_instance_pool(job_flows, optimized_filename, save_filename, EC2):
+def load_history(options, timezone, stage_cache=None, profiler=None):
+    """Loads and filters the job flow history and calculates its on demand
+    hours, reusing the results from the stage cache when the history and
+    filters haven't changed.
+
+    Histories fetched from Amazon can't be checked for changes without
+    fetching them, so only histories read from a file are cached.
+
+    Args:
+        profiler: A StageProfiler to record the loading stages with.
+
+    Returns:
+        (job_flows, demand_hours, history_key): history_key identifies the
+            history in the stage cache. It is None without a stage cache.
+    """
+    load = lambda: with_demand_hours(get_job_flows(options, timezone,
+                                                profiler=profiler))
+    if stage_cache is None:
+        job_flows, demand_hours = load()
+        return job_flows, demand_hours, None
+
+    if options.file_inputs:
+        history_file = options.file_inputs
+        if is_partitioned_history(history_file):
+            # The manifest has a digest of every partition.
+            history_file = manifest_path(history_file)
+        history_key = stage_cache.key('history',
+                                    hash_file(history_file),
+                                    options.min_days,
+                                    options.max_days,
+                                    options.timezone)
+        job_flows, demand_hours = cached_stage(stage_cache, history_key, load)
+    else:
+        job_flows, demand_hours = load()
+        history_key = stage_cache.key('history', hash_job_flows(job_flows))
+    return job_flows, demand_hours, history_key
+
+
+def with_demand_hours(job_flows):
+    return job_flows, calculate_demand_hours(job_flows)
+
+
+def cached_stage(stage_cache, key, compute):
+    """Returns the value stored in the stage cache under key, or computes
+    it, stores it and returns it.
+
+    Args:
+        stage_cache: A StageCache, or None to always compute.
+
+        compute: A function with no arguments that computes the value.
+    """
+    if stage_cache is None:
+        return compute()
+    value = stage_cache.get(key)
+    if value is None:
+        value = compute()
+        stage_cache.put(key, value)
+    else:
+        logging.debug("Reusing cached stage %s", key)
+    return value
+
+
+def get_best_instance_pool(job_flows, optimized_filename, save_filename, EC2,
+                        demand_hours=None, stage_cache=None,
+                        cache_key_parts=None, optimizer_stats=None,
+                        state_filename=None, prices_key=None,
+                        folded_profile=None):
     """Returns the best instance flow based on the job_flows passed in or
     a file passed in by the user.
 
@@ -137,6 +572,28 @@ def get_best_instance_pool(job_flows, optimized_filename, save_filename, EC2):
 
         job_flows: A list of jobs flow dictionary objects.
 
+        demand_hours: The job flows' on demand hours from
+            calculate_demand_hours, if they have already been calculated.
+
+        stage_cache: A StageCache to reuse optimized pools from. Not used
+            with state_filename.
+
+        cache_key_parts: A list of keys for everything other than the owned
+            instances the optimized pool depends on, e.g. the history and
+            prices. Needed when stage_cache is given.
+
+        optimizer_stats: An OptimizerStats to count the optimizer's work in.
+
+        state_filename: A file to keep the optimizer's state in between
+            runs, so only the instance types whose job flows changed are
+            re-optimized (see incremental.incremental_optimize).
+
+        prices_key: Identifies the prices, so state_filename is only reused
+            with the same prices. Needed when state_filename is given.
+
+        folded_profile: A FoldedProfile of the job flows to optimize on
+            instead of simulating them. Not used with state_filename.
+
     Returns:
         pool of best optimal instances.
     """
@@ -145,14 +602,47 @@ def get_best_instance_pool(job_flows, optimized_filename, save_filename, EC2):
     else:
 
         owned_reserved_instances = get_owned_reserved_instances(EC2)
-        pool = Optimizer(job_flows, EC2).run(
-                pre_existing_pool=owned_reserved_instances)
+        if state_filename:
+            optimize = lambda: optimize_incrementally(job_flows, EC2,
+                state_filename, [prices_key,
+                                pool_items(owned_reserved_instances)],
+                owned_reserved_instances, optimizer_stats)
+        elif folded_profile:
+            optimize = lambda: FoldedOptimizer(job_flows, folded_profile,
+                                            EC2, demand_hours=demand_hours,
+                                            stats=optimizer_stats).run(
+                    pre_existing_pool=owned_reserved_instances)
+        else:
+            optimize = lambda: Optimizer(collapse_job_flows(job_flows), EC2,
+                                        demand_hours=demand_hours,
+                                        stats=optimizer_stats).run(
+                    pre_existing_pool=owned_reserved_instances)
+        key = None
+        if state_filename:
+            # The state has to move forward with every run, and it already
+            # skips the instance types whose job flows haven't changed.
+            stage_cache = None
+        elif stage_cache:
+            key = stage_cache.key('optimize', cache_key_parts,
+                                pool_items(owned_reserved_instances))
+        pool = cached_stage(stage_cache, key, optimize)
 
     if save_filename:
         write_optimal_instances(save_filename, pool)
     return pool
 
 
+def optimize_incrementally(job_flows, EC2, state_filename, key,
+                        owned_reserved_instances, optimizer_stats):
+    """Optimizes from the state in state_filename and saves the new state
+    there."""
+    state = load_state(state_filename)
+    pool, state = incremental_optimize(job_flows, EC2, state=state, key=key,
+        pre_existing_pool=owned_reserved_instances, stats=optimizer_stats)
+    save_state(state_filename, state)
+    return pool
+
+
 def write_optimal_instances(filename, pool):
     """Save optimal pool results.
 
@@ -181,14 +671,36 @@ def read_optimal_instances(filename):
         return pool
 
 
-def write_job_flow_history(filename):
+def write_job_flow_history(filename, source_filename=None, partition=None):
     """This will write out all the job flows to a file.
 
+    If filename is a job flow store (see job_store.is_job_flow_store), the
+    job flows are upserted into it instead. So are partitioned histories
+    (see partitions.PartitionedHistory). Compressed files are read and
+    written compressed, see compression.open_history.
+
     Args:
         filename: file to write or append job json objects to.
 
+        source_filename: A history file (or store, or partitioned history)
+            to copy the job flows from instead of fetching them from Amazon.
+
+        partition: DAY or WEEK to write a partitioned history into the
+            filename directory.
     """
-    job_flows = load_job_flows_from_amazon(None, None)
+    if source_filename:
+        if is_partitioned_history(source_filename):
+            job_flows = PartitionedHistory(source_filename).query()
+        elif is_job_flow_store(source_filename):
+            source = JobFlowStore(source_filename)
+            try:
+                job_flows = source.query()
+            finally:
+                source.close()
+        else:
+            job_flows = load_job_flows_from_file(source_filename)
+    else:
+        job_flows = load_job_flows_from_amazon(None, None)
     json_ready_job_flows = {}
 
     # Job flow dicts have a lot of boto objects that need to be removed first.
@@ -207,23 +719,66 @@ def write_job_flow_history(filename):
             json_job['instancegroups'].append(json_instance)
         json_ready_job_flows[json_job['jobflowid']] = json_job
 
+    if partition or is_partitioned_history(filename):
+        history = PartitionedHistory(filename, period=partition)
+        count = history.upsert(json_ready_job_flows.values())
+        logging.info("Upserted %d job flows, %d in %d partitions", count,
+            len(history), len(history.partitions))
+        return
+
+    if is_job_flow_store(filename):
+        store = JobFlowStore(filename)
+        try:
+            count = store.upsert(json_ready_job_flows.values())
+            logging.info("Upserted %d job flows, %d in the store", count,
+                len(store))
+        finally:
+            store.close()
+        return
+
     # Error will be thrown if there is no file, so we catch and continue.
     try:
-        with open(filename, 'r+') as f:
+        with open_history(filename) as f:
             for line in f:
                 json_job = json.loads(line)
                 json_ready_job_flows[json_job['jobflowid']] = json_job
     except IOError:
         pass
 
-    with open(filename, 'w') as f:
+    # An existing file keeps its compression, a new one is compressed
+    # according to its extension.
+    with open_history(filename, 'w') as f:
         for json_job in json_ready_job_flows.values():
             f.write(str(json.JSONEncoder().encode(json_job)) + '\n')
 
 
-def simulate_job_flows(job_flows, pool, EC2):
-    """Simulates the job flows using the pool, and will also simulate pure
-    on-demand hours with no pool and return both.
+def simulate_job_flows(job_flows, pool, EC2, demand_hours=None,
+                    stage_cache=None, history_key=None, prices_key=None,
+                    processes=1, job_flows_index=None):
+    """Simulates the job flows using the pool, and also works out the pure
+    on-demand hours with no pool and returns both.
+
+    The on-demand hours don't need a simulation, see
+    calculate_demand_hours.
+
+    Args:
+        demand_hours: The job flows' on demand hours from
+            calculate_demand_hours. Calculated here if None.
+
+        stage_cache: A StageCache to reuse the simulated hours from.
+
+        history_key: The job flows' key in the stage cache, from
+            load_history. Needed when stage_cache is given.
+
+        prices_key: Identifies the prices, which give the instance types and
+            the order reserved instances are used in. Needed when
+            stage_cache is given.
+
+        processes: Number of processes to simulate time shards of the job
+            flows in, see ShardedSimulator. None uses every core.
+
+        job_flows_index: A JobFlowIndex of the job flows, to take their
+            interval from. Built here if None.
 
     Returns:
         optimal_logged_hours: The amount of hours that each reserved instance
@@ -232,22 +787,165 @@ def simulate_job_flows(job_flows, pool, EC2):
         demand_logged_hours: The amount of hours used per instance on just
             purely on demand instances, no reserved instances. Use this as a
             control group.
+
+    Raises:
+        ValueError: If there are no job flows, since their hours can't be
+            scaled to a year.
     """
-    job_flows_begin_time = min(job.get('startdatetime') for job in job_flows)
-    job_flows_end_time = max(job.get('enddatetime') for job in job_flows)
-    interval_job_flows = job_flows_end_time - job_flows_begin_time
+    if job_flows_index is None:
+        job_flows_index = JobFlowIndex(job_flows)
+    if not len(job_flows_index):
+        raise ValueError("There are no job flows to simulate")
+    interval_job_flows = job_flows_index.interval()
 
-    EMPTY_INSTANCE_POOL = EC2.init_empty_reserve_pool()
-    optimal_simulator = Simulator(job_flows, pool, EC2)
-    demand_simulator = Simulator(job_flows, EMPTY_INSTANCE_POOL, EC2)
-    optimal_logged_hours = optimal_simulator.run()
-    demand_logged_hours = demand_simulator.run()
+    if demand_hours is None:
+        demand_hours = calculate_demand_hours(job_flows)
+    # Identical job flows running at the same time log the same hours when
+    # simulated as one.
+    simulated_job_flows = collapse_job_flows(job_flows)
+    if processes == 1:
+        optimal_simulator = Simulator(simulated_job_flows, pool, EC2)
+    else:
+        optimal_simulator = ShardedSimulator(simulated_job_flows, pool, EC2,
+                                            processes=processes)
+    # The hours used depend on the prices too, since the simulator hands out
+    # reserved instances in the order of their reserve_priorities.
+    key = None
+    if stage_cache:
+        key = stage_cache.key('simulate', history_key, prices_key,
+                            pool_items(pool))
+    optimal_logged_hours = cached_stage(stage_cache, key,
+                                        optimal_simulator.run)
+    demand_logged_hours = EC2.demand_logged_hours(demand_hours)
 
     convert_to_yearly_estimated_hours(demand_logged_hours, interval_job_flows)
     convert_to_yearly_estimated_hours(optimal_logged_hours, interval_job_flows)
     return optimal_logged_hours, demand_logged_hours
 
 
+def compare_pools(pool_filenames, job_flows, demand_hours, EC2,
+                output_format=TEXT, output_file=None):
+    """Scores the pools saved in pool_filenames and prints how much each of
+    them costs and saves.
+
+    Args:
+        output_format: TEXT for a table or JSON for a list of rows.
+
+        output_file: File name to write the comparison to instead of stdout.
+    """
+    pools = [read_optimal_instances(filename) for filename in pool_filenames]
+    results = evaluate_pools(job_flows, pools, EC2, demand_hours=demand_hours)
+
+    rows = []
+    for filename, pool, (log, demand_log) in zip(pool_filenames, pools,
+                                                results):
+        cost, upfront_cost = EC2.calculate_cost(log, pool)
+        demand_cost, _ = EC2.calculate_cost(demand_log,
+                                            EC2.init_empty_reserve_pool())
+        rows.append({
+            'pool': filename,
+            'cost': cost,
+            'upfront': upfront_cost,
+            'on_demand': demand_cost,
+            'saved': demand_cost - cost,
+        })
+
+    with output_to(output_file) as out:
+        if output_format == JSON:
+            json.dump(rows, out, indent=2, sort_keys=True)
+            out.write('\n')
+        else:
+            print_pool_comparison(rows, out)
+
+
+def print_pool_comparison(rows, out):
+    """Prints the rows from compare_pools as a table, most money saved
+    first."""
+    name_width = max([len(row['pool']) for row in rows] + [len('Pool')])
+    print >> out, "%-*s %15s %15s %15s" % (name_width, 'Pool', 'Hourly Cost',
+        'Upfront Cost', 'Money Saved')
+    for row in sorted(rows, key=lambda row: row['saved'], reverse=True):
+        print >> out, "%-*s %15s %15s %15s" % (name_width, row['pool'],
+            '$' + intWithCommas(int(row['cost'])),
+            '$' + intWithCommas(int(row['upfront'])),
+            '$' + intWithCommas(int(row['saved'])))
+    print >> out
+    print >> out, "Cost for all On-Demand: $%s" % intWithCommas(
+        int(rows[0]['on_demand']))
+
+
+def output_bootstrap(bands, EC2, output_format=TEXT, output_file=None):
+    """Prints the percentile bands from bootstrap.percentile_bands.
+
+    Args:
+        output_format: TEXT for a table or JSON.
+
+        output_file: File name to write to instead of stdout.
+    """
+    with output_to(output_file) as out:
+        if output_format == JSON:
+            json.dump(bands, out, indent=2, sort_keys=True)
+            out.write('\n')
+        else:
+            print_bootstrap(bands, EC2, out)
+
+
+def print_bootstrap(bands, EC2, out):
+    """Prints bootstrap percentile bands as a human readable table."""
+    headers = ['P%g' % p for p in bands['percentiles']]
+    row_format = "%20s" + " %12s" * len(headers)
+    print >> out, row_format % tuple([''] + headers)
+    for utilization_class in EC2.RESERVE_PRIORITIES:
+        print >> out, "%-20s" % (utilization_class)
+        counts = bands['pools'][utilization_class]
+        for machine in sorted(counts):
+            print >> out, row_format % tuple([machine] +
+                ['%.1f' % count for count in counts[machine]])
+    print >> out
+    print >> out, row_format % tuple(['Money Saved'] +
+        ['$' + intWithCommas(int(saved)) for saved in bands['saved']])
+
+
+def output_backtest(results, EC2, output_format=TEXT, output_file=None):
+    """Prints the per window results from backtest.backtest.
+
+    Args:
+        output_format: TEXT for a table or JSON.
+
+        output_file: File name to write to instead of stdout.
+    """
+    with output_to(output_file) as out:
+        if output_format == JSON:
+            rows = []
+            for result in results:
+                row = dict(result, pool=plain_dict(result['pool']))
+                for key in ('train_start', 'test_start', 'test_end'):
+                    row[key] = result[key].isoformat()
+                rows.append(row)
+            json.dump(rows, out, indent=2, sort_keys=True)
+            out.write('\n')
+        else:
+            print_backtest(results, out)
+
+
+def print_backtest(results, out):
+    """Prints backtest results as a human readable table."""
+    row_format = "%-12s %-12s %-12s %9s %13s %13s %13s"
+    print >> out, row_format % ('Train Start', 'Test Start', 'Test End',
+        'Reserved', 'Upfront Cost', 'On-Demand', 'Money Saved')
+    for result in results:
+        reserved = sum(sum(counts.values())
+                    for counts in result['pool'].values())
+        print >> out, row_format % (
+            result['train_start'].strftime('%Y/%m/%d'),
+            result['test_start'].strftime('%Y/%m/%d'),
+            result['test_end'].strftime('%Y/%m/%d'),
+            reserved,
+            '$' + intWithCommas(int(result['upfront'])),
+            '$' + intWithCommas(int(result['on_demand'])),
+            '$' + intWithCommas(int(result['saved'])))
+
+
 def get_owned_reserved_instances(EC2):
     """Pulls the currently owned reserved instances from Amazon AWS
 
@@ -262,9 +960,9 @@ def get_owned_reserved_instances(EC2):
     """
     boto_logger = logging.getLogger('boto')
     boto_logger.disabled = True
-    ec2_conn = boto.connect_ec2()
-    boto_reserved_instances = ec2_conn.get_all_reserved_instances()
-    ec2_conn.close()
+    # The run's client keeps its connection and the reserved instances, so
+    # asking again doesn't go back to Amazon.
+    boto_reserved_instances = default_client().reserved_instances()
     purchased_reserved_instances = EC2.init_empty_reserve_pool()
     for reserved_instance in boto_reserved_instances:
         utilization_class = reserved_instance.offering_type
@@ -313,45 +1011,199 @@ def intWithCommas(x):
     return "%d%s" % (x, result)
 
 
-def output_statistics(log, pool, demand_log, EC2):
-    """Once everything is calculated, output here"""
+def approximation_summary(approximation):
+    """Returns the parts of an approximate_optimize result that go in the
+    report, or None if there was no approximation."""
+    if approximation is None:
+        return None
+    summary = dict((key, approximation[key]) for key in (
+        'cost', 'cost_interval', 'saved', 'saved_interval', 'sampled_days',
+        'days'))
+    summary['exact_fallback'] = not approximation['separated']
+    return summary
+
+
+@contextmanager
+def output_to(output_file):
+    """Context manager that gives the file named output_file, opened for
+    writing and closed afterwards, or stdout if it is None."""
+    if not output_file:
+        yield sys.stdout
+        return
+    with open(output_file, 'w') as out:
+        yield out
+
+
+def output_statistics(log, pool, demand_log, EC2, output_format=TEXT,
+                    output_file=None, instrumentation=None,
+                    fold_comparison=None, approximation=None):
+    """Once everything is calculated, output here
+
+    Args:
+        output_format: TEXT for the human readable table or JSON for a
+            single JSON document.
+
+        output_file: File name to write the report to instead of stdout.
+
+        instrumentation: A dict of timing and stats data to include in JSON
+            reports.
+
+        fold_comparison: The pool's folded savings compared with the
+            simulation, from folding.compare_with_simulation.
+
+        approximation: The --approximate estimate, from
+            approximation_summary.
+    """
+    report = build_report(log, pool, demand_log, EC2,
+                        instrumentation=instrumentation,
+                        fold_comparison=fold_comparison,
+                        approximation=approximation)
+    with output_to(output_file) as out:
+        if output_format == JSON:
+            json.dump(report, out, indent=2, sort_keys=True)
+            out.write('\n')
+        else:
+            print_report(report, EC2, out)
+
+
+def build_report(log, pool, demand_log, EC2, owned_reserved_instances=None,
+                instrumentation=None, fold_comparison=None,
+                approximation=None):
+    """Puts everything the report shows into a dict that can be JSON encoded.
+
+    Args:
+        log: The yearly hours used with the pool.
+
+        pool: The optimal pool.
+
+        demand_log: The yearly hours used with no reserved instances.
+
+        owned_reserved_instances: The pool already owned. Fetched from
+            Amazon if None.
+
+        instrumentation: Optional dict of timing and stats data to include.
+
+        fold_comparison: Optional dict from folding.compare_with_simulation
+            to include.
+
+        approximation: Optional dict from approximation_summary to include.
+
+    Returns:
+        report: A dict with the pools (optimal, owned and to purchase) and
+            the yearly hours and costs with and without the pool.
+    """
     EMPTY_INSTANCE_POOL = EC2.init_empty_reserve_pool()
     optimized_cost, optimized_upfront_cost = EC2.calculate_cost(log, pool)
     demand_cost, _ = EC2.calculate_cost(demand_log, EMPTY_INSTANCE_POOL)
 
-    owned_reserved_instances = get_owned_reserved_instances(EC2)
+    if owned_reserved_instances is None:
+        owned_reserved_instances = get_owned_reserved_instances(EC2)
     buy_instances = calculate_instances_to_buy(owned_reserved_instances, pool,
         EC2)
 
     all_instances = instance_types_in_pool(pool)
-    all_instances.union(instance_types_in_pool(owned_reserved_instances))
+    all_instances |= instance_types_in_pool(owned_reserved_instances)
+
+    pools = {'optimal': {}, 'owned': {}, 'to_purchase': {}}
+    for utilization_class in EC2.RESERVE_PRIORITIES:
+        for name, current_pool in (('optimal', pool),
+                                ('owned', owned_reserved_instances),
+                                ('to_purchase', buy_instances)):
+            pools[name][utilization_class] = dict(
+                (machine, current_pool[utilization_class].get(machine, 0))
+                for machine in all_instances)
+
+    report = {
+        'pools': pools,
+        'yearly_hours': {
+            'optimized': plain_dict(log),
+            'on_demand': plain_dict(demand_log),
+        },
+        'cost': {
+            'optimized': optimized_cost,
+            'optimized_upfront': optimized_upfront_cost,
+            'on_demand': demand_cost,
+            'saved': demand_cost - optimized_cost,
+        },
+    }
+    if instrumentation is not None:
+        report['instrumentation'] = instrumentation
+    if fold_comparison is not None:
+        report['fold'] = fold_comparison
+    if approximation is not None:
+        report['approximate'] = approximation
+    return report
+
 
-    print "%20s %15s %15s %15s" % ('', 'Optimal', 'Owned', 'To Purchase')
+def plain_dict(pool):
+    """Copies a pool or logged hours into plain dicts."""
+    return dict((utilization_class, dict(pool[utilization_class]))
+                for utilization_class in pool)
+
+
+def print_report(report, EC2, out):
+    """Prints a report from build_report as a human readable table."""
+    pools = report['pools']
+    print >> out, "%20s %15s %15s %15s" % ('', 'Optimal', 'Owned',
+        'To Purchase')
     for utilization_class in EC2.RESERVE_PRIORITIES:
-        print "%-20s" % (utilization_class)
-        for machine in all_instances:
-            print "%20s %15d %15d %15d" % (machine,
-                pool[utilization_class][machine],
-                owned_reserved_instances[utilization_class][machine],
-                buy_instances[utilization_class][machine])
-
-    print
-    print " Hours Used By Instance type **************"
+        print >> out, "%-20s" % (utilization_class)
+        for machine in pools['optimal'][utilization_class]:
+            print >> out, "%20s %15d %15d %15d" % (machine,
+                pools['optimal'][utilization_class][machine],
+                pools['owned'][utilization_class][machine],
+                pools['to_purchase'][utilization_class][machine])
+
+    demand_log = report['yearly_hours']['on_demand']
+    print >> out
+    print >> out, " Hours Used By Instance type **************"
     for utilization_class in demand_log:
         for machine in demand_log[utilization_class]:
-            print "\t%s: %s" % (machine,
+            print >> out, "\t%s: %s" % (machine,
                     intWithCommas(int(demand_log[utilization_class][machine])))
 
-    optimized_cost_fmt = intWithCommas(int(optimized_cost))
-    optimized_upfront_cost_fmt = intWithCommas(int(optimized_upfront_cost))
-    demand_cost_fmt = intWithCommas(int(demand_cost))
-    difference_cost = intWithCommas(int(demand_cost - optimized_cost))
-    print
-    print "Cost difference:"
-    print "Hourly cost for all instance: $%s" % optimized_cost_fmt
-    print "Upfront Cost for all instances: $%s" % optimized_upfront_cost_fmt
-    print "Cost for all On-Demand: $%s" % demand_cost_fmt
-    print "Money Saved: $%s" % difference_cost
+    cost = report['cost']
+    optimized_cost_fmt = intWithCommas(int(cost['optimized']))
+    optimized_upfront_cost_fmt = intWithCommas(int(cost['optimized_upfront']))
+    demand_cost_fmt = intWithCommas(int(cost['on_demand']))
+    difference_cost = intWithCommas(int(cost['saved']))
+    print >> out
+    print >> out, "Cost difference:"
+    print >> out, "Hourly cost for all instance: $%s" % optimized_cost_fmt
+    print >> out, "Upfront Cost for all instances: $%s" % (
+        optimized_upfront_cost_fmt)
+    print >> out, "Cost for all On-Demand: $%s" % demand_cost_fmt
+    print >> out, "Money Saved: $%s" % difference_cost
+
+    fold = report.get('fold')
+    if fold:
+        print >> out
+        print >> out, "Folded onto %d hours (%d periods):" % (
+            fold['period_hours'], fold['periods'])
+        print >> out, "Estimated Money Saved: $%s" % intWithCommas(
+            int(fold['folded_saved']))
+        if fold['error'] is not None:
+            print >> out, "Error versus simulation: %+.1f%%" % (
+                100 * fold['error'])
+        print >> out, "%20s %15s %15s" % ('Average Use', 'Reserved',
+            'On Demand')
+        for slot in fold['slots']:
+            print >> out, "%20s %15.1f %15.1f" % (slot['time'],
+                slot['reserved'], slot['on_demand'])
+
+    approximation = report.get('approximate')
+    if approximation:
+        print >> out
+        if approximation['exact_fallback']:
+            print >> out, ("Sampled %d of %d days, but the sample couldn't"
+                " pick a pool, so it was optimized exactly" % (
+                approximation['sampled_days'], approximation['days']))
+        else:
+            low, high = approximation['saved_interval']
+            print >> out, "Approximated from %d of %d days" % (
+                approximation['sampled_days'], approximation['days'])
+            print >> out, "Money Saved 95%% interval: $%s to $%s" % (
+                intWithCommas(int(low)), intWithCommas(int(high)))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,278 @@
+"""Quick approximate optimization on a sample of the job flow history.
+
+The history is cut into days by the jobs' start times and a fraction of the
+days is sampled from each day of the week (the strata), so the sample has
+the same mix of weekdays and weekends as the history. Whole days are sampled
+rather than single jobs so jobs that run at the same time still compete for
+the pool. The optimizer runs on the sampled days as if they were the whole
+history, with the interval shrunk in proportion.
+
+Each sampled day is also simulated on its own, which gives a stratified
+estimate of the pool's yearly hours and cost along with a confidence
+interval. The pool is compared with its neighbours (one reserved instance
+more or less of any instance type and utilization class) on the same days.
+If a neighbour could save more than the pool by more than the error we're
+willing to accept, the sample isn't good enough to pick a pool and the exact
+optimizer should be used instead.
+
+Jobs running past the end of a sampled day don't compete with the next
+day's jobs, which biases the estimate slightly towards using fewer reserved
+instances.
+"""
+import copy
+import datetime
+import logging
+import math
+import random
+from collections import defaultdict
+
+from job_handler import calculate_demand_hours
+from optimizer import convert_to_yearly_estimated_hours
+from optimizer import Optimizer
+from simulate_jobs import Simulator
+
+DAY = datetime.timedelta(1)
+DEFAULT_FRACTION = 0.1
+DEFAULT_MAX_ERROR = 0.02
+# Two sided 95% confidence.
+DEFAULT_Z = 1.96
+
+
+class StratifiedSample(object):
+    """Days sampled from each day of the week of a job flow history."""
+
+    def __init__(self, job_flows, fraction, rng, EC2):
+        """
+        Args:
+            fraction: The fraction of days to sample from each stratum. At
+                least two days are sampled from every stratum (if it has
+                them), so each stratum's variance can be estimated.
+
+            rng: A random.Random to pick the days with.
+        """
+        self.start = min(job.get('startdatetime') for job in job_flows)
+        end = max(job.get('enddatetime') for job in job_flows)
+        self.interval = end - self.start
+
+        jobs_by_day = defaultdict(list)
+        for job in job_flows:
+            offset = job['startdatetime'] - self.start
+            jobs_by_day[offset.days].append(job)
+        self.days = max(jobs_by_day) + 1
+
+        strata = defaultdict(list)
+        for day in range(self.days):
+            strata[day % 7].append(day)
+
+        # Stratum to (days in the stratum, sampled days).
+        self.strata = {}
+        # (stratum, jobs, sorted event timeline) for each sampled day.
+        self.units = []
+        for stratum, days in sorted(strata.items()):
+            count = min(len(days), max(2, int(round(fraction * len(days)))))
+            sampled = sorted(rng.sample(days, count))
+            self.strata[stratum] = (len(days), sampled)
+            for day in sampled:
+                jobs = jobs_by_day.get(day, [])
+                timeline = Simulator(jobs, None,
+                                    EC2).sorted_job_event_timeline()
+                self.units.append((stratum, jobs, timeline))
+
+        self.job_flows = [job for _, jobs, _ in self.units for job in jobs]
+        self.job_event_timeline = sorted(
+            (event for _, _, timeline in self.units for event in timeline),
+            key=lambda event: event[:2])
+        sampled_days = sum(len(sampled) for _, sampled in
+                        self.strata.values())
+        self.sampled_days = sampled_days
+        # The sample stands for the whole history, so its hours are
+        # extrapolated over a proportionally shorter interval.
+        self.sample_interval = self.interval * sampled_days / self.days
+
+    def yearly_factor(self):
+        """Returns what to multiply the history's hours by to get a year's
+        worth of them."""
+        return 365.0 / (self.interval.total_seconds() / (24 * 60 * 60))
+
+    def day_logged_hours(self, pool, EC2):
+        """Returns the logged hours of each sampled day, simulated on its own
+        with the pool."""
+        return [Simulator(jobs, pool, EC2, job_event_timeline=timeline).run()
+                for _, jobs, timeline in self.units]
+
+    def hourly_costs(self, pool, EC2, day_logged_hours=None):
+        """Returns the hourly cost (no upfront cost) of each sampled day,
+        simulated on its own with the pool.
+
+        Args:
+            day_logged_hours: The days' hours from day_logged_hours, if they
+                were already simulated.
+        """
+        if day_logged_hours is None:
+            day_logged_hours = self.day_logged_hours(pool, EC2)
+        empty_pool = EC2.init_empty_reserve_pool()
+        return [EC2.calculate_cost(logged_hours, empty_pool)[0]
+                for logged_hours in day_logged_hours]
+
+    def estimate_yearly_hours(self, day_logged_hours, EC2):
+        """Estimates a year's logged hours from the sampled days' hours, the
+        same way estimate_total estimates the hourly cost, so the hours cost
+        what the estimate does."""
+        logged_hours = EC2.init_empty_all_instance_types()
+        factor = self.yearly_factor()
+        for utilization_class in logged_hours:
+            instance_types = set()
+            for day in day_logged_hours:
+                instance_types.update(day[utilization_class])
+            for instance_type in instance_types:
+                total, _ = self.estimate_total(
+                    [day[utilization_class].get(instance_type, 0)
+                    for day in day_logged_hours])
+                logged_hours[utilization_class][instance_type] = (
+                    factor * total)
+        return logged_hours
+
+    def estimate_total(self, values):
+        """Estimates the total of values over every day of the history from
+        the sampled days' values.
+
+        Args:
+            values: A value for each sampled day, in the order of units.
+
+        Returns:
+            (total, variance): The stratified estimate of the total and the
+                estimate's variance.
+        """
+        by_stratum = defaultdict(list)
+        for (stratum, _, _), value in zip(self.units, values):
+            by_stratum[stratum].append(value)
+
+        total = 0.0
+        variance = 0.0
+        for stratum, stratum_values in by_stratum.items():
+            days, _ = self.strata[stratum]
+            n = len(stratum_values)
+            mean = sum(stratum_values) / float(n)
+            total += days * mean
+            if n > 1:
+                sample_variance = sum((value - mean) ** 2 for value in
+                                    stratum_values) / (n - 1)
+                variance += (days ** 2 * (1 - float(n) / days) *
+                            sample_variance / n)
+        return total, variance
+
+
+def approximate_optimize(job_flows, EC2, demand_hours=None,
+                        fraction=DEFAULT_FRACTION, seed=0,
+                        pre_existing_pool=None, max_error=DEFAULT_MAX_ERROR,
+                        z=DEFAULT_Z):
+    """Optimizes on a stratified sample of the job flows' days.
+
+    Args:
+        demand_hours: The job flows' on demand hours from
+            calculate_demand_hours. Calculated here if None.
+
+        fraction: The fraction of days to sample.
+
+        seed: Seed for the random.Random the days are sampled with.
+
+        pre_existing_pool: Instances that are already owned. Neighbouring
+            pools never have fewer than these.
+
+        max_error: How much more a neighbouring pool may possibly save, as
+            a fraction of the pool's savings, before the pool isn't
+            separated from it.
+
+        z: The normal quantile for the confidence intervals.
+
+    Returns:
+        A dict with:
+            pool: The optimal pool for the sample.
+            logged_hours: The pool's yearly hours, estimated from the
+                sampled days like the cost, so they cost what it does.
+            demand_logged_hours: The yearly on demand hours (exact).
+            cost, saved: The estimated yearly cost and savings.
+            cost_interval, saved_interval: Their confidence intervals.
+            separated: Whether, within the confidence interval, no
+                neighbouring pool costs less than the pool by more than
+                max_error of its savings.
+            sampled_days, days: The size of the sample and of the history.
+    """
+    if demand_hours is None:
+        demand_hours = calculate_demand_hours(job_flows)
+    if pre_existing_pool is None:
+        pre_existing_pool = EC2.init_empty_reserve_pool()
+    sample = StratifiedSample(job_flows, fraction, random.Random(seed), EC2)
+    logging.info("Sampled %d of %d days", sample.sampled_days, sample.days)
+
+    pool = Optimizer(sample.job_flows, EC2,
+                    job_flows_interval=sample.sample_interval,
+                    demand_hours=calculate_demand_hours(sample.job_flows),
+                    job_event_timeline=sample.job_event_timeline).run(
+                        pre_existing_pool=copy.deepcopy(pre_existing_pool))
+
+    demand_logged_hours = EC2.demand_logged_hours(demand_hours)
+    convert_to_yearly_estimated_hours(demand_logged_hours, sample.interval)
+    demand_cost, _ = EC2.calculate_cost(demand_logged_hours,
+                                        EC2.init_empty_reserve_pool())
+
+    factor = sample.yearly_factor()
+    day_logged_hours = sample.day_logged_hours(pool, EC2)
+    # The reported hours, cost and savings all come from the same estimate
+    # as their interval.
+    logged_hours = sample.estimate_yearly_hours(day_logged_hours, EC2)
+    hourly_costs = sample.hourly_costs(pool, EC2, day_logged_hours)
+    hourly_total, variance = sample.estimate_total(hourly_costs)
+    _, upfront_cost = EC2.calculate_cost({}, pool)
+    cost = upfront_cost + factor * hourly_total
+    margin = z * factor * math.sqrt(variance)
+
+    saved = demand_cost - cost
+    tolerance = max_error * abs(saved)
+    separated = True
+    for neighbour in neighbouring_pools(pool, pre_existing_pool, EC2):
+        differences = [neighbour_cost - pool_cost for neighbour_cost,
+                    pool_cost in zip(sample.hourly_costs(neighbour, EC2),
+                                    hourly_costs)]
+        difference, difference_variance = sample.estimate_total(differences)
+        _, neighbour_upfront_cost = EC2.calculate_cost({}, neighbour)
+        difference = (factor * difference +
+                    neighbour_upfront_cost - upfront_cost)
+        if (difference - z * factor * math.sqrt(difference_variance) <
+                -tolerance):
+            logging.info("The sample can't tell the pool from %s",
+                neighbour)
+            separated = False
+            break
+
+    return {
+        'pool': pool,
+        'logged_hours': logged_hours,
+        'demand_logged_hours': demand_logged_hours,
+        'cost': cost,
+        'cost_interval': [cost - margin, cost + margin],
+        'saved': saved,
+        'saved_interval': [saved - margin, saved + margin],
+        'separated': separated,
+        'sampled_days': sample.sampled_days,
+        'days': sample.days,
+    }
+
+
+def neighbouring_pools(pool, floor, EC2):
+    """Yields the pools with one reserved instance more or less than pool,
+    for each instance type and utilization class. Pools below floor are
+    skipped."""
+    instance_types = set()
+    for utilization_class in EC2.RESERVE_PRIORITIES:
+        instance_types.update(pool[utilization_class])
+    for instance_type in sorted(instance_types):
+        for utilization_class in EC2.RESERVE_PRIORITIES:
+            count = pool[utilization_class].get(instance_type, 0)
+            minimum = floor.get(utilization_class, {}).get(instance_type, 0)
+            for change in (1, -1):
+                if count + change < minimum:
+                    continue
+                neighbour = copy.deepcopy(pool)
+                neighbour[utilization_class][instance_type] = count + change
+                yield neighbour
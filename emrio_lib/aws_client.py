@@ -0,0 +1,282 @@
+"""Talks to EMR and EC2, reusing connections and retrying throttled calls.
+
+The EMR API returns at most 500 job flows per call, so the history is
+fetched by creation time, newest first. Instead of paging back through the
+whole history one call at a time, it is cut into windows of two weeks, and
+several windows are paged through at once in a thread pool that lives as
+long as the client. Each thread keeps its own EMR and EC2 connections (boto
+connections aren't safe to share between threads), so the connections are
+reused by every call made from the thread.
+
+Calls that are throttled or fail on Amazon's side are retried after an
+exponentially growing, jittered delay. All the retries of a client come out
+of one retry budget, so a struggling API is given up on rather than hammered
+by every thread in turn.
+
+Connections are made by factories, so the client can run against fake
+connections in tests.
+"""
+import datetime
+import logging
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from jsonl_reader import parse_time
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_WINDOW = datetime.timedelta(weeks=2)
+DEFAULT_RETRIES = 16
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30
+# Error codes Amazon uses to ask us to slow down.
+THROTTLING_ERROR_CODES = ('Throttling', 'ThrottlingException',
+                        'RequestLimitExceeded', 'ServiceUnavailable')
+
+_default_client = None
+
+
+class RetryBudget(object):
+    """The number of retries left, shared by every thread of a client."""
+
+    def __init__(self, retries=DEFAULT_RETRIES):
+        self.retries = retries
+        self._lock = threading.Lock()
+
+    def spend(self):
+        """Takes a retry out of the budget. Returns False if it's empty."""
+        with self._lock:
+            if self.retries <= 0:
+                return False
+            self.retries -= 1
+            return True
+
+
+class AWSClient(object):
+
+    def __init__(self, emr_connect=None, ec2_connect=None,
+                concurrency=DEFAULT_CONCURRENCY, window=DEFAULT_WINDOW,
+                retry_budget=None, base_delay=DEFAULT_BASE_DELAY,
+                max_delay=DEFAULT_MAX_DELAY, sleep=time.sleep):
+        """
+        Args:
+            emr_connect, ec2_connect: Functions that make a new EMR or EC2
+                connection. Default to boto's.
+
+            concurrency: Number of windows of job flows fetched at once.
+
+            window: timedelta of job flow creation times fetched by one
+                thread.
+
+            retry_budget: A RetryBudget to take retries from. A new one with
+                DEFAULT_RETRIES is made if None.
+
+            base_delay, max_delay: Seconds to wait before the first retry of
+                a call, and at most before any retry.
+
+            sleep: Function to wait with.
+        """
+        self.emr_connect = emr_connect or _connect_emr
+        self.ec2_connect = ec2_connect or _connect_ec2
+        self.concurrency = concurrency
+        self.window = window
+        self.retry_budget = retry_budget
+        if retry_budget is None:
+            self.retry_budget = RetryBudget()
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.connections_made = 0
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._reserved_instances = None
+        self._pool = None
+
+    def emr(self):
+        """Returns this thread's EMR connection."""
+        return self._connection('emr', self.emr_connect)
+
+    def ec2(self):
+        """Returns this thread's EC2 connection."""
+        return self._connection('ec2', self.ec2_connect)
+
+    def call(self, function, *args, **kwargs):
+        """Calls function, retrying it with exponential backoff while it is
+        throttled or fails on Amazon's side and the retry budget lasts."""
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception, ex:
+                if not is_retryable_error(ex) or not self.retry_budget.spend():
+                    raise
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            # Jitter, so throttled threads don't all come back at once.
+            delay *= random.uniform(0.5, 1)
+            logging.debug("Retrying a throttled call in %.1fs", delay)
+            self.sleep(delay)
+            attempt += 1
+
+    def describe_job_flows(self, created_after=None, now=None):
+        """Returns all the job flows EMR has, newest first.
+
+        Args:
+            created_after: Only fetch job flows created after this datetime.
+                Without it, windows are fetched until EMR says they are
+                older than the job flows it keeps.
+
+            now: The current UTC time. Defaults to the current time.
+
+        Returns:
+            A list of boto job flow objects.
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        end = now + datetime.timedelta(days=1)
+        job_flows = []
+        ids_seen = set()
+        if self._pool is None:
+            self._pool = ThreadPool(self.concurrency)
+        while end is not None:
+            windows = []
+            while end is not None and len(windows) < self.concurrency:
+                start = end - self.window
+                if created_after is not None and start <= created_after:
+                    windows.append((created_after, end))
+                    end = None
+                else:
+                    windows.append((start, end))
+                    end = start
+            exhausted = False
+            for window_job_flows, window_exhausted in self._pool.map(
+                    self._describe_window, windows):
+                for job_flow in window_job_flows:
+                    if job_flow.jobflowid not in ids_seen:
+                        ids_seen.add(job_flow.jobflowid)
+                        job_flows.append(job_flow)
+                exhausted = exhausted or window_exhausted
+            if exhausted:
+                break
+        return job_flows
+
+    def reserved_instances(self):
+        """Returns the boto reserved instances the account owns. They are
+        only fetched once per client."""
+        if self._reserved_instances is None:
+            self._reserved_instances = self.call(
+                self.ec2().get_all_reserved_instances)
+        return self._reserved_instances
+
+    def close(self):
+        """Closes the thread pool and every connection the client made."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def _describe_window(self, window):
+        start, end = window
+        describe = lambda **kwargs: self.call(self.emr().describe_jobflows,
+                                            **kwargs)
+        return paginate_job_flows(describe, created_after=start,
+                                created_before=end)
+
+    def _connection(self, service, connect):
+        connection = getattr(self._local, service, None)
+        if connection is None:
+            connection = self.call(connect)
+            setattr(self._local, service, connection)
+            with self._lock:
+                self._connections.append(connection)
+                self.connections_made += 1
+        return connection
+
+
+def paginate_job_flows(describe, states=None, jobflow_ids=None,
+                    created_after=None, created_before=None):
+    """Calls describe (like EmrConnection.describe_jobflows) until it has
+    returned every job flow created in the window, paging back from
+    created_before.
+
+    Returns:
+        (job_flows, exhausted): The boto job flows, newest first, and
+            whether EMR said the window goes back further than the job flows
+            it keeps.
+    """
+    all_job_flows = []
+    ids_seen = set()
+
+    if not (states or jobflow_ids or created_after or created_before):
+        created_before = (
+            datetime.datetime.utcnow() + datetime.timedelta(days=1))
+
+    boto_logger = logging.getLogger('boto')
+    boto_logger.disabled = True
+    while True:
+        if created_before and created_after and created_before < created_after:
+            return all_job_flows, False
+        try:
+            results = describe(
+                states=states, jobflow_ids=jobflow_ids,
+                created_after=created_after, created_before=created_before)
+        except Exception, ex:
+            if 'ValidationError' in (getattr(ex, 'body', None) or ''):
+                return all_job_flows, True
+            raise
+
+        # don't count the same job flow twice
+        job_flows = [jf for jf in results if jf.jobflowid not in ids_seen]
+        all_job_flows.extend(job_flows)
+        ids_seen.update(jf.jobflowid for jf in job_flows)
+
+        if job_flows:
+            # set created_before to be just after the start time of
+            # the first job returned, to deal with job flows started
+            # in the same second
+            min_create_time = min(parse_time(jf.creationdatetime, None)
+                                    for jf in job_flows)
+            created_before = min_create_time + datetime.timedelta(seconds=1)
+            # if someone managed to start 501 job flows in the same second,
+            # they are still screwed (the EMR API only returns up to 500),
+            # but this seems unlikely. :)
+        else:
+            if not created_before:
+                created_before = datetime.datetime.utcnow()
+            created_before -= datetime.timedelta(weeks=2)
+
+
+def is_retryable_error(ex):
+    """Returns whether ex is a boto server error worth retrying: Amazon
+    throttled the call or failed on its side."""
+    status = getattr(ex, 'status', None)
+    if status is None:
+        return False
+    return (getattr(ex, 'error_code', None) in THROTTLING_ERROR_CODES or
+            status >= 500)
+
+
+def default_client():
+    """Returns the client shared by a run, so its connections and reserved
+    instances are reused."""
+    global _default_client
+    if _default_client is None:
+        _default_client = AWSClient()
+    return _default_client
+
+
+def _connect_emr():
+    from boto.emr.connection import EmrConnection
+    return EmrConnection()
+
+
+def _connect_ec2():
+    import boto
+    return boto.connect_ec2()
@@ -0,0 +1,156 @@
+"""Backtesting: how well would a pool chosen from past job flows have done
+on the job flows that came after?
+
+Train and test windows slide over the history. The pool optimized on each
+train window is simulated on the test window right after it. Each
+optimization is warm started from the previous window's pool, since
+neighbouring windows mostly share their job flows. A warm start can settle
+on a different pool than a cold start, so the optimizations run one after
+another in window order, and only the test window simulations run in
+parallel. That way the results don't depend on the number of processes.
+
+The job flows are sorted once, so each window's jobs are found with a binary
+search, and each window's event timeline is filtered out of one timeline
+sorted for the whole history.
+"""
+import bisect
+import logging
+import multiprocessing
+
+from job_handler import calculate_demand_hours
+from optimizer import convert_to_yearly_estimated_hours
+from optimizer import Optimizer
+from simulate_jobs import Simulator
+
+# Set in each worker process by _init_worker.
+_worker_history = None
+_worker_EC2 = None
+
+
+class IndexedHistory(object):
+    """Job flows sorted by start time along with their sorted event
+    timeline."""
+
+    def __init__(self, job_flows, EC2):
+        self.job_flows = sorted(job_flows,
+                                key=lambda job: job.get('startdatetime'))
+        self.starts = [job.get('startdatetime') for job in self.job_flows]
+        self.job_event_timeline = Simulator(
+            self.job_flows, None, EC2).sorted_job_event_timeline()
+
+    def window(self, start, end):
+        """Returns the job flows that start in [start, end) and their sorted
+        event timeline."""
+        job_flows = self.job_flows[bisect.bisect_left(self.starts, start):
+                                bisect.bisect_left(self.starts, end)]
+        job_ids = set(id(job) for job in job_flows)
+        job_event_timeline = [event for event in self.job_event_timeline
+                            if id(event[2]) in job_ids]
+        return job_flows, job_event_timeline
+
+
+def make_windows(job_flows, train_length, test_length, step=None):
+    """Slides train and test windows over the job flows, starting from the
+    first job flow.
+
+    Args:
+        train_length, test_length: timedeltas the windows span.
+
+        step: timedelta to move the windows by. Defaults to test_length, so
+            the test windows don't overlap.
+
+    Returns:
+        A list of (train_start, test_start, test_end) for every test window
+            that ends by the time the last job flow starts.
+    """
+    if step is None:
+        step = test_length
+    first_start = min(job.get('startdatetime') for job in job_flows)
+    last_start = max(job.get('startdatetime') for job in job_flows)
+    windows = []
+    train_start = first_start
+    while train_start + train_length + test_length <= last_start:
+        test_start = train_start + train_length
+        windows.append((train_start, test_start, test_start + test_length))
+        train_start += step
+    return windows
+
+
+def backtest(job_flows, windows, EC2, processes=None):
+    """Optimizes on each train window and evaluates on its test window.
+
+    Args:
+        windows: A list of windows from make_windows.
+
+        processes: Number of processes to simulate test windows in.
+            Defaults to the number of cores.
+
+    Returns:
+        A list with a dict for each window with its dates, the optimal
+            train pool and its yearly cost, upfront cost, on demand cost and
+            savings on the test window. Windows without job flows to train
+            or test on are left out.
+    """
+    history = IndexedHistory(job_flows, EC2)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    tested_windows = []
+    previous_pool = None
+    for train_start, test_start, test_end in windows:
+        train_jobs, train_timeline = history.window(train_start, test_start)
+        if not train_jobs or not history.window(test_start, test_end)[0]:
+            logging.info("Skipping window at %s, no job flows", test_start)
+            continue
+        pool = Optimizer(train_jobs, EC2,
+                        job_flows_interval=test_start - train_start,
+                        demand_hours=calculate_demand_hours(train_jobs),
+                        job_event_timeline=train_timeline).run(
+                            initial_pool=previous_pool)
+        previous_pool = pool
+        tested_windows.append((train_start, test_start, test_end, pool))
+    logging.info("Testing %d windows in %d processes", len(tested_windows),
+        processes)
+
+    if processes == 1 or len(tested_windows) <= 1:
+        _init_worker(history, EC2)
+        return map(evaluate_window, tested_windows)
+    pool = multiprocessing.Pool(processes, _init_worker, (history, EC2))
+    try:
+        return pool.map(evaluate_window, tested_windows)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _init_worker(history, EC2):
+    global _worker_history, _worker_EC2
+    _worker_history = history
+    _worker_EC2 = EC2
+
+
+def evaluate_window(tested_window):
+    """Simulates a window's train pool on its test window in a worker."""
+    history, EC2 = _worker_history, _worker_EC2
+    train_start, test_start, test_end, pool = tested_window
+    test_jobs, test_timeline = history.window(test_start, test_end)
+    interval = test_end - test_start
+    logged_hours = Simulator(test_jobs, pool, EC2,
+                            job_event_timeline=test_timeline).run()
+    demand_logged_hours = EC2.demand_logged_hours(
+        calculate_demand_hours(test_jobs))
+    convert_to_yearly_estimated_hours(logged_hours, interval)
+    convert_to_yearly_estimated_hours(demand_logged_hours, interval)
+    cost, upfront_cost = EC2.calculate_cost(logged_hours, pool)
+    demand_cost, _ = EC2.calculate_cost(demand_logged_hours,
+                                        EC2.init_empty_reserve_pool())
+    return {
+        'train_start': train_start,
+        'test_start': test_start,
+        'test_end': test_end,
+        'pool': pool,
+        'cost': cost,
+        'upfront': upfront_cost,
+        'on_demand': demand_cost,
+        'saved': demand_cost - cost,
+    }
@@ -0,0 +1,221 @@
+"""Bootstrapping the job flow history to see how much the recommended pool
+and its savings could change.
+
+The history is cut into blocks of a day or a week. Each resample picks as
+many blocks as the history has, at random with replacement, lays them end to
+end from the start of the history and re-optimizes. The spread of the pools
+and savings over all the resamples gives percentile bands for them.
+
+Blocks keep their jobs' sorted event timeline and on demand hours, so a
+resample only has to shift and merge timelines instead of building them, and
+the optimizer reuses the merged timeline for every simulation it runs.
+"""
+import copy
+import datetime
+import logging
+import multiprocessing
+import random
+from collections import defaultdict
+
+from job_handler import calculate_demand_hours
+from optimizer import convert_to_yearly_estimated_hours
+from optimizer import Optimizer
+from simulate_jobs import Simulator
+
+DAY = 'day'
+WEEK = 'week'
+BLOCK_LENGTHS = {
+    DAY: datetime.timedelta(1),
+    WEEK: datetime.timedelta(7),
+}
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+# Set in each worker process by _init_worker.
+_worker_blocks = None
+_worker_EC2 = None
+_worker_pre_existing_pool = None
+
+
+class HistoryBlocks(object):
+    """A job flow history cut into blocks by the jobs' start times."""
+
+    def __init__(self, job_flows, block_length, EC2):
+        self.start = min(job.get('startdatetime') for job in job_flows)
+        end = max(job.get('enddatetime') for job in job_flows)
+        # Resamples are extrapolated to a year over the original interval.
+        self.interval = end - self.start
+        self.block_length = block_length
+
+        last_start = max(job.get('startdatetime') for job in job_flows)
+        self.blocks = [[] for i in range(self._block_index(last_start) + 1)]
+        for job in job_flows:
+            self.blocks[self._block_index(job['startdatetime'])].append(job)
+
+        # Each block's events as (offset from the block start, event type,
+        # index of the job in the block), sorted.
+        self.timelines = []
+        self.demand_hours = []
+        for i, block in enumerate(self.blocks):
+            block_start = self.start + i * block_length
+            timeline = Simulator(block, None, EC2).sorted_job_event_timeline()
+            index = dict((id(job), j) for j, job in enumerate(block))
+            self.timelines.append([(time - block_start, event_type,
+                                    index[id(job)])
+                                for time, event_type, job in timeline])
+            self.demand_hours.append(calculate_demand_hours(block))
+
+    def resample(self, rng):
+        """Makes a resampled history.
+
+        Args:
+            rng: A random.Random to pick the blocks with.
+
+        Returns:
+            (job_flows, job_event_timeline, demand_hours): The resample's jobs
+                (copies with shifted times and ids unique to the resample), its
+                sorted event timeline and its on demand hours.
+        """
+        job_flows = []
+        job_event_timeline = []
+        demand_hours = defaultdict(int)
+        for position in range(len(self.blocks)):
+            block_index = rng.randrange(len(self.blocks))
+            shift = (position - block_index) * self.block_length
+            block_start = self.start + position * self.block_length
+            copies = [dict(job,
+                        jobflowid='%s-%d' % (job.get('jobflowid'), position),
+                        startdatetime=job['startdatetime'] + shift,
+                        enddatetime=job['enddatetime'] + shift)
+                    for job in self.blocks[block_index]]
+            job_flows.extend(copies)
+            job_event_timeline.extend((block_start + offset, event_type,
+                                    copies[j])
+                                    for offset, event_type, j in
+                                    self.timelines[block_index])
+            for instance_type, hours in (
+                    self.demand_hours[block_index].items()):
+                demand_hours[instance_type] += hours
+        # The blocks are already sorted runs, which sort() merges quickly.
+        job_event_timeline.sort()
+        return job_flows, job_event_timeline, demand_hours
+
+    def _block_index(self, time):
+        offset = time - self.start
+        return int(offset.total_seconds() //
+                self.block_length.total_seconds())
+
+
+def bootstrap(job_flows, EC2, resamples, block=DAY, seed=0, processes=None,
+            pre_existing_pool=None):
+    """Optimizes resamples of the job flows.
+
+    Args:
+        resamples: The amount of resamples to optimize.
+
+        block: DAY or WEEK, the length of the blocks to resample.
+
+        seed: Resample i is made with random.Random(seed + i), so the results
+            don't depend on the amount of processes.
+
+        processes: Number of processes to optimize with. Defaults to the
+            number of cores.
+
+        pre_existing_pool: Instances that are already owned, which every
+            resample's pool keeps, like in the report.
+
+    Returns:
+        A list of (pool, yearly savings) for each resample.
+    """
+    blocks = HistoryBlocks(job_flows, BLOCK_LENGTHS[block], EC2)
+    logging.info("Bootstrapping %d resamples of %d %s blocks", resamples,
+        len(blocks.blocks), block)
+    seeds = [seed + i for i in range(resamples)]
+    if processes == 1 or resamples <= 1:
+        _init_worker(blocks, EC2, pre_existing_pool)
+        return map(optimize_resample, seeds)
+
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (blocks, EC2, pre_existing_pool))
+    try:
+        return pool.map(optimize_resample, seeds)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _init_worker(blocks, EC2, pre_existing_pool):
+    global _worker_blocks, _worker_EC2, _worker_pre_existing_pool
+    _worker_blocks = blocks
+    _worker_EC2 = EC2
+    _worker_pre_existing_pool = pre_existing_pool
+
+
+def optimize_resample(seed):
+    """Makes and optimizes one resample in a worker.
+
+    Returns:
+        (pool, savings): The optimal pool for the resample and how much it
+            saves a year over on demand.
+    """
+    blocks, EC2 = _worker_blocks, _worker_EC2
+    job_flows, job_event_timeline, demand_hours = blocks.resample(
+        random.Random(seed))
+    pool = Optimizer(job_flows, EC2,
+                    job_flows_interval=blocks.interval,
+                    demand_hours=demand_hours,
+                    job_event_timeline=job_event_timeline).run(
+        # The optimizer fills in the pool it is given.
+        pre_existing_pool=copy.deepcopy(_worker_pre_existing_pool))
+
+    logged_hours = Simulator(job_flows, pool, EC2,
+                            job_event_timeline=job_event_timeline).run()
+    demand_logged_hours = EC2.demand_logged_hours(demand_hours)
+    convert_to_yearly_estimated_hours(logged_hours, blocks.interval)
+    convert_to_yearly_estimated_hours(demand_logged_hours, blocks.interval)
+    cost, _ = EC2.calculate_cost(logged_hours, pool)
+    demand_cost, _ = EC2.calculate_cost(demand_logged_hours,
+                                        EC2.init_empty_reserve_pool())
+    return pool, demand_cost - cost
+
+
+def percentile_bands(results, EC2, percentiles=DEFAULT_PERCENTILES):
+    """Summarizes the bootstrap results.
+
+    Args:
+        results: The list of (pool, savings) from bootstrap.
+
+    Returns:
+        bands: A dict with 'pools', the percentiles of each reserved count
+            structured like a pool but with a list for each instance type,
+            and 'saved', the percentiles of the savings.
+    """
+    instance_types = set()
+    for pool, _ in results:
+        for utilization_class in EC2.RESERVE_PRIORITIES:
+            instance_types.update(pool.get(utilization_class, {}))
+
+    pools = {}
+    for utilization_class in EC2.RESERVE_PRIORITIES:
+        pools[utilization_class] = {}
+        for instance_type in instance_types:
+            counts = sorted(pool.get(utilization_class, {}).get(
+                instance_type, 0) for pool, _ in results)
+            pools[utilization_class][instance_type] = [
+                percentile(counts, p) for p in percentiles]
+    savings = sorted(saved for _, saved in results)
+    return {
+        'percentiles': list(percentiles),
+        'pools': pools,
+        'saved': [percentile(savings, p) for p in percentiles],
+    }
+
+
+def percentile(sorted_values, p):
+    """Returns the p-th percentile of sorted_values, interpolating linearly
+    between the closest ranks."""
+    position = (len(sorted_values) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return (sorted_values[lower] * (1 - fraction) +
+            sorted_values[upper] * fraction)
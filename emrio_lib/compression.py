@@ -0,0 +1,100 @@
+"""Reading and writing compressed job flow history files.
+
+Histories can be compressed with gzip, bz2, xz or zstd. The compression of
+an existing file is told from its first bytes, so a compressed file doesn't
+need a particular name. A file that doesn't exist yet is compressed
+according to its extension.
+
+gzip and bz2 are always available. xz needs the lzma module (or
+backports.lzma on Python 2) and zstd needs the zstandard package. All of
+them are read and written as streams, in blocks, so a compressed history
+doesn't have to be decompressed to a temporary file first.
+"""
+import bz2
+import gzip
+import io
+
+GZIP = 'gzip'
+BZ2 = 'bz2'
+XZ = 'xz'
+ZSTD = 'zstd'
+
+# Compression to the extension files are named with and the bytes they
+# start with.
+EXTENSIONS = {
+    GZIP: '.gz',
+    BZ2: '.bz2',
+    XZ: '.xz',
+    ZSTD: '.zst',
+}
+MAGIC_BYTES = {
+    GZIP: b'\x1f\x8b',
+    BZ2: b'BZh',
+    XZ: b'\xfd7zXZ\x00',
+    ZSTD: b'\x28\xb5\x2f\xfd',
+}
+
+
+def compression_of(filename):
+    """Returns the compression (GZIP, BZ2, XZ or ZSTD) of filename, or None
+    if it isn't compressed.
+
+    Existing files are recognized by their first bytes, empty or missing
+    files by their extension.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            header = f.read(max(len(magic) for magic in MAGIC_BYTES.values()))
+    except IOError:
+        header = b''
+    if header:
+        for compression, magic in MAGIC_BYTES.items():
+            if header.startswith(magic):
+                return compression
+        return None
+    for compression, extension in EXTENSIONS.items():
+        if filename.endswith(extension):
+            return compression
+    return None
+
+
+def open_history(filename, mode='r'):
+    """Opens a history file for reading ('r') or writing ('w') lines,
+    compressing or decompressing it as it is read or written.
+
+    Raises:
+        IOError: If the file can't be opened, like open.
+        ValueError: If the module for the file's compression isn't
+            installed.
+    """
+    compression = compression_of(filename)
+    if compression is None:
+        return open(filename, mode)
+    binary_mode = mode + 'b'
+    if compression == GZIP:
+        return gzip.open(filename, binary_mode)
+    if compression == BZ2:
+        return bz2.BZ2File(filename, binary_mode)
+    if compression == XZ:
+        return _lzma_module().open(filename, binary_mode)
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Reading or writing %s needs the zstandard package"
+            % filename)
+    if mode == 'r':
+        # The decompression reader can't read lines by itself.
+        return io.BufferedReader(zstandard.open(filename, binary_mode))
+    return zstandard.open(filename, binary_mode)
+
+
+def _lzma_module():
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise ValueError("xz compressed histories need the lzma module"
+                " (backports.lzma on Python 2)")
+    return lzma
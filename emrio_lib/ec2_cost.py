@@ -20,7 +20,6 @@ logged_hours: are pools that count the amount of hours that instances run for,
 
 import copy
 import math
-import yaml
 from collections import defaultdict
 
 
@@ -38,9 +37,12 @@ class EC2Info(object):
             cost configurations. To see an example of a cost config,
             look in tests/test.yaml
         """
+        import yaml
+        # The C loader is much faster when PyYAML was built with libyaml.
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
         try:
             with open(filename) as f:
-                datamap = yaml.load(f)
+                datamap = yaml.load(f, Loader=loader)
             self.COST = datamap['cost']
             self.RESERVE_PRIORITIES = datamap['reserve_priorities']
         except IOError:
@@ -120,6 +122,30 @@ class EC2Info(object):
             empty_logged_hours[utilization_class] = defaultdict(int)
         return empty_logged_hours
 
+    def on_demand_class(self):
+        """Returns the utilization class instances are billed under when
+        there are no reserved instances available for them. This is the first
+        non-reserved class in ALL_UTILIZATION_PRIORITIES.
+        """
+        return self.ALL_UTILIZATION_PRIORITIES[len(self.RESERVE_PRIORITIES)]
+
+    def demand_logged_hours(self, demand_hours):
+        """Builds logged_hours for hours that all ran on demand.
+
+        Args:
+            demand_hours: A dict of instance type to hours used, like the
+                one returned by job_handler.calculate_demand_hours.
+
+        Returns:
+            logged_hours: Same as a Simulator's logged hours with an empty
+                pool.
+        """
+        logged_hours = self.init_empty_all_instance_types()
+        on_demand = self.on_demand_class()
+        for instance_type, hours in demand_hours.items():
+            logged_hours[on_demand][instance_type] = hours
+        return logged_hours
+
     def init_reserve_counts(self, pool, instance_name):
         """initializes counts for reserve utilization classes.
 
@@ -0,0 +1,97 @@
+"""Scores reserved instance pools against a job flow history without
+optimizing.
+
+Reserved instances of one type never change the hours billed for another, so
+jobs that don't use any of a pool's reserved instance types are billed the
+same as on demand. Those are worked out with calculate_demand_hours and only
+the rest of the jobs are simulated. Pools that reserve the same instance types
+share one event timeline, so scoring many proposals for the same few instance
+types builds the timeline once.
+"""
+from job_handler import calculate_demand_hours
+from optimizer import convert_to_yearly_estimated_hours
+from simulate_jobs import Simulator
+
+
+def evaluate_pools(job_flows, pools, EC2, demand_hours=None):
+    """Works out the yearly hours each pool would be billed for.
+
+    Args:
+        pools: A list of pools to score.
+
+        demand_hours: The job flows' on demand hours from
+            calculate_demand_hours. Calculated here if None.
+
+    Returns:
+        A list with (logged_hours, demand_logged_hours) for each pool, like
+            EMRio.simulate_job_flows returns.
+    """
+    job_flows_begin_time = min(job.get('startdatetime') for job in job_flows)
+    job_flows_end_time = max(job.get('enddatetime') for job in job_flows)
+    interval_job_flows = job_flows_end_time - job_flows_begin_time
+
+    if demand_hours is None:
+        demand_hours = calculate_demand_hours(job_flows)
+    demand_logged_hours = EC2.demand_logged_hours(demand_hours)
+    convert_to_yearly_estimated_hours(demand_logged_hours, interval_job_flows)
+
+    # Reserved instance types -> (simulated jobs, their timeline and the
+    # on demand hours of all the other jobs).
+    splits = {}
+    results = []
+    for pool in pools:
+        instance_types = reserved_instance_types(pool)
+        if instance_types not in splits:
+            splits[instance_types] = split_job_flows(job_flows,
+                instance_types, EC2)
+        simulated_jobs, timeline, other_hours = splits[instance_types]
+
+        logged_hours = EC2.demand_logged_hours(other_hours)
+        if simulated_jobs:
+            simulator = Simulator(simulated_jobs, pool, EC2,
+                                job_event_timeline=timeline)
+            add_logged_hours(logged_hours, simulator.run())
+        convert_to_yearly_estimated_hours(logged_hours, interval_job_flows)
+        results.append((logged_hours, demand_logged_hours))
+    return results
+
+
+def split_job_flows(job_flows, instance_types, EC2):
+    """Splits the job flows into the ones that use any of instance_types,
+    which need simulating, and the rest.
+
+    Returns:
+        (simulated_jobs, timeline, other_hours): timeline is the simulated
+            jobs' sorted event timeline and other_hours the on demand hours of
+            the rest of the jobs.
+    """
+    simulated_jobs = []
+    other_jobs = []
+    for job in job_flows:
+        if any(instance.get('instancetype') in instance_types
+                for instance in job.get('instancegroups', [])):
+            simulated_jobs.append(job)
+        else:
+            other_jobs.append(job)
+    timeline = Simulator(simulated_jobs, None, EC2).sorted_job_event_timeline()
+    return simulated_jobs, timeline, calculate_demand_hours(other_jobs)
+
+
+def reserved_instance_types(pool):
+    """Returns the frozenset of instance types the pool has any reserved
+    instances of."""
+    return frozenset(instance_type
+                    for utilization_class in pool
+                    for instance_type, count in pool[utilization_class].items()
+                    if count)
+
+
+def add_logged_hours(logged_hours, other_logged_hours):
+    """Adds other_logged_hours to logged_hours.
+
+    Mutates:
+        logged_hours: Has the hours of other_logged_hours added.
+    """
+    for utilization_class, hours_used in other_logged_hours.items():
+        for instance_type, hours in hours_used.items():
+            logged_hours[utilization_class][instance_type] += hours
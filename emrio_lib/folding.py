@@ -0,0 +1,216 @@
+"""Folding the job flow history onto a representative week or day.
+
+Yearly hours are extrapolated linearly from the history, so which calendar
+week a job flow ran in doesn't matter much, but simulating every one of them
+takes time. Folding counts the instances billed in each hour of the week
+(or day) for every week of the history, and keeps how many weeks had each
+count. A pool's hours are then worked out from those counts instead of
+simulating: in every hour, reserved instances are used in priority order
+up to the count and the rest runs on demand. The counts are kept for each
+hour of the period, so the report can show how many reserved and on demand
+instances an average week (or day) uses in each of its hours. The pool and
+its cost don't depend on the period, only that breakdown does.
+
+This is an approximation. Job flows that bill in the same hour are counted
+as if they ran at the same time, even if one ended before the other
+started, so the folded hours can need more instances than the simulator
+would. compare_with_simulation gives the error of a folded estimate.
+"""
+import datetime
+from collections import defaultdict
+
+from job_handler import billed_hours
+from optimizer import convert_to_yearly_estimated_hours
+from optimizer import Optimizer
+
+DAY = 'day'
+WEEK = 'week'
+PERIODS = {
+    DAY: datetime.timedelta(1),
+    WEEK: datetime.timedelta(7),
+}
+HOUR = datetime.timedelta(0, 3600)
+
+
+class FoldedProfile(object):
+    """The instances billed in each hour of a period, for every period of
+    a job flow history."""
+
+    def __init__(self, job_flows, period):
+        """
+        Args:
+            period: The timedelta to fold the history onto, e.g. a week.
+                Should be a whole amount of hours.
+        """
+        self.start = min(job.get('startdatetime') for job in job_flows)
+        self.period = period
+        self.slots_per_period = int(period.total_seconds() // 3600)
+
+        # Instance type to {(period, slot): instances billed}.
+        billed = defaultdict(lambda: defaultdict(int))
+        last_hour = 0
+        for job in job_flows:
+            first_hour = int((job['startdatetime'] - self.start)
+                            .total_seconds() // 3600)
+            hours = billed_hours(job)
+            last_hour = max(last_hour, first_hour + hours - 1)
+            for instance in job.get('instancegroups', []):
+                counts = billed[instance.get('instancetype')]
+                count = int(instance.get('instancerequestcount', 0))
+                for hour in range(first_hour, first_hour + hours):
+                    counts[hour] += count
+        self.periods = last_hour // self.slots_per_period + 1
+
+        # Instance type to a list with a dict for each slot of the period,
+        # of instances billed to the number of periods that billed that many.
+        # Periods that billed none aren't included.
+        self.slots = {}
+        for instance_type, counts in billed.items():
+            slots = [defaultdict(int) for i in range(self.slots_per_period)]
+            for hour, count in counts.items():
+                if count:
+                    slots[hour % self.slots_per_period][count] += 1
+            self.slots[instance_type] = [dict(slot) for slot in slots]
+
+        # Which slot a count was in doesn't change its hours, so the hours
+        # are worked out from all the slots' counts at once.
+        self.histograms = {}
+        for instance_type, slots in self.slots.items():
+            histogram = defaultdict(int)
+            for slot in slots:
+                for count, periods in slot.items():
+                    histogram[count] += periods
+            self.histograms[instance_type] = sorted(histogram.items())
+
+    def logged_hours(self, pool, EC2):
+        """Works out the hours the pool would log over the whole history.
+
+        Returns:
+            logged_hours: Structured like Simulator.run's.
+        """
+        logged_hours = EC2.init_empty_all_instance_types()
+        for instance_type, histogram in self.histograms.items():
+            hours = defaultdict(int)
+            use_pool(histogram, pool, instance_type, EC2, hours)
+            for utilization_class, used_hours in hours.items():
+                if used_hours:
+                    logged_hours[utilization_class][instance_type] = (
+                        used_hours)
+        return logged_hours
+
+    def slot_usage(self, pool, EC2):
+        """Works out how many instances of every type the pool would use in
+        each slot of an average period.
+
+        Returns:
+            A list with a dict for each slot with its start time (the
+                weekday and time for periods longer than a day) and the
+                average reserved and on demand instances used in it.
+        """
+        on_demand = EC2.on_demand_class()
+        time_format = '%H:%M'
+        if self.slots_per_period > 24:
+            time_format = '%a %H:%M'
+        usage = []
+        for slot in range(self.slots_per_period):
+            hours = defaultdict(int)
+            for instance_type, slots in self.slots.items():
+                use_pool(sorted(slots[slot].items()), pool, instance_type,
+                        EC2, hours)
+            on_demand_hours = hours.pop(on_demand, 0)
+            usage.append({
+                'time': (self.start + slot * HOUR).strftime(time_format),
+                'reserved': sum(hours.values()) / float(self.periods),
+                'on_demand': on_demand_hours / float(self.periods),
+            })
+        return usage
+
+
+def use_pool(histogram, pool, instance_type, EC2, hours):
+    """Adds the hours a pool's instances of instance_type log for a histogram
+    of instances billed to hours, a dict of utilization class to hours.
+
+    Args:
+        histogram: A list of (instances billed, hours billed that many).
+    """
+    reserved = [(utilization_class,
+                pool.get(utilization_class, {}).get(instance_type, 0))
+                for utilization_class in EC2.RESERVE_PRIORITIES]
+    on_demand = EC2.on_demand_class()
+    for count, periods in histogram:
+        left = count
+        for utilization_class, reserved_count in reserved:
+            used = min(left, reserved_count)
+            hours[utilization_class] += used * periods
+            left -= used
+        hours[on_demand] += left * periods
+
+
+class FoldedSimulator(object):
+    """Has the same run interface as Simulator, but works out the hours from
+    a FoldedProfile."""
+
+    def __init__(self, profile, pool, EC2):
+        self.profile = profile
+        self.pool = pool
+        self.EC2 = EC2
+
+    def run(self):
+        return self.profile.logged_hours(self.pool, self.EC2)
+
+
+class FoldedOptimizer(Optimizer):
+    """An Optimizer that costs pools with a FoldedProfile instead of
+    simulating the job flows."""
+
+    def __init__(self, job_flows, profile, EC2, job_flows_interval=None,
+                demand_hours=None, stats=None):
+        # No event timeline is needed, since nothing is simulated.
+        Optimizer.__init__(self, job_flows, EC2,
+                        job_flows_interval=job_flows_interval,
+                        demand_hours=demand_hours, stats=stats,
+                        job_event_timeline=[])
+        self.profile = profile
+
+    def _simulator(self, pool):
+        return FoldedSimulator(self.profile, pool, self.EC2)
+
+
+def compare_with_simulation(profile, pool, EC2, logged_hours,
+                            demand_logged_hours, interval):
+    """Compares the folded estimate of a pool's savings with the savings of
+    the full simulation.
+
+    Args:
+        logged_hours, demand_logged_hours: The yearly hours of the full
+            simulation with the pool and on demand.
+
+        interval: The timedelta the job flows span.
+
+    Returns:
+        A dict with the period folded onto, the yearly savings estimated
+            from the folded profile and from the simulation, the error of
+            the estimate as a fraction of the simulated savings and the
+            pool's use in each slot of the period (see
+            FoldedProfile.slot_usage).
+    """
+    folded_hours = profile.logged_hours(pool, EC2)
+    convert_to_yearly_estimated_hours(folded_hours, interval)
+    folded_cost, _ = EC2.calculate_cost(folded_hours, pool)
+    cost, _ = EC2.calculate_cost(logged_hours, pool)
+    demand_cost, _ = EC2.calculate_cost(demand_logged_hours,
+                                        EC2.init_empty_reserve_pool())
+
+    folded_saved = demand_cost - folded_cost
+    saved = demand_cost - cost
+    error = None
+    if saved:
+        error = (folded_saved - saved) / abs(saved)
+    return {
+        'period_hours': profile.slots_per_period,
+        'periods': profile.periods,
+        'folded_saved': folded_saved,
+        'saved': saved,
+        'error': error,
+        'slots': profile.slot_usage(pool, EC2),
+    }
@@ -3,16 +3,41 @@
 This tool uses an observer to pull information from a simulation of jobs.
 Once it has that information, it will use hours recorded and matplotlib to make
 graphs from the job flows.
+
+Long histories have far more events than there are pixels to draw them on, so
+the recorded traces are bucketed into time bins before plotting. That keeps
+the amount of work matplotlib has to do roughly constant no matter how long
+the history is.
 """
 import copy
+import datetime
+import json
 import logging
+import multiprocessing
+import os
+
+from job_index import JobFlowIndex
+from simulate_jobs import Simulator, SimulationRecorder
+
+# Ways to combine the points that fall into the same time bin.
+MAX = 'max'
+MEAN = 'mean'
+AGGREGATES = (MAX, MEAN)
+
+# Names of the graphs, used for file names when saving them.
+TOTAL_USAGE = 'total_usage'
+INSTANCE_USAGE = 'instance_usage'
 
-from ec2_cost import instance_types_in_pool
-from simulate_jobs import Simulator, SimulationObserver
+INDEX_FILENAME = 'index.json'
+
+# If no bin size is given, pick one so each graph has at most this many points.
+DEFAULT_MAX_POINTS = 2000
 
 
 class Grapher(object):
-    def __init__(self, job_flows, pool, EC2):
+    def __init__(self, job_flows, pool, EC2, bin_seconds=None,
+                max_points=DEFAULT_MAX_POINTS, aggregate=MAX,
+                job_flows_index=None):
         """Grapher will set up graphs to be shown based
         on the job flow and pools given.
 
@@ -25,11 +50,29 @@ class Grapher(object):
 
             EC2: An EC2Info object to output costs and run simulations.
 
+            bin_seconds: Width of the time bins traces are bucketed into
+                before graphing. If None, it is picked from max_points.
+
+            max_points: Upper bound on the points graphed per instance type
+                when bin_seconds is None.
+
+            aggregate: MAX or MEAN, how the points in a bin are combined.
+
+            job_flows_index: A JobFlowIndex of the job flows, to take the
+                graphs' time limits from. Built here if None.
         """
+        if aggregate not in AGGREGATES:
+            raise ValueError("Unknown aggregate: %s" % aggregate)
         self.pool = pool
         self.job_flows = job_flows
         self.EC2 = EC2
         self.colors = self.EC2.color_scheme()
+        self.bin_seconds = bin_seconds
+        self.max_points = max_points
+        self.aggregate = aggregate
+        if job_flows_index is None:
+            job_flows_index = JobFlowIndex(job_flows)
+        self.job_flows_index = job_flows_index
 
     def show(self, total_usage=False, instance_usage=False):
         """This will make and show the graphs for the grapher class.
@@ -54,109 +97,287 @@ class Grapher(object):
             self.plt = plt
             self.mdates = mdates
         if total_usage:
-            self._total_hours_graph()
-            self.graph_over_time(self.total_hours_over_time,
-                self.total_hours)
+            self.graph_over_time(self.record_log_data())
         elif instance_usage:
-            self._instance_usage_graph()
-            self.graph_over_time(self.used_instances_over_time,
-                self.instance_hours)
+            self.graph_over_time(self.record_used_instances())
         if self.plt:
             self.plt.show()
 
-    def _total_hours_graph(self):
-        """Graph the total hours used by reserved / on demand
-        instances over a period of time"""
-        logged_hours_over_time, hours = self.record_log_data()
-        self.total_hours_over_time = logged_hours_over_time
-        self.total_hours = hours
-
-    def _instance_usage_graph(self):
-        """This will graph the instances used and the type of
-        instance used over time.
-        """
-        used_instances, hours = self.record_used_instances()
-        self.used_instances_over_time = used_instances
-        self.instance_hours = hours
-
     def record_used_instances(self):
         """Stores information regarding what instances were in the
         'used_pool' during the job simulation at all points of the
         simulation.
+
+        Returns:
+            A SimulationRecorder with the used pool over time.
         """
-        used_instances_over_time = self.EC2.init_empty_all_instance_types()
-        event_times = {}
         instance_simulator = Simulator(self.job_flows, self.pool, self.EC2)
-        observer = SimulationObserver(event_times, used_instances_over_time)
-        instance_simulator.attach_pool_use_observer(observer)
+        recorder = SimulationRecorder(self.EC2)
+        instance_simulator.attach_pool_use_observer(recorder)
         instance_simulator.run()
-        return used_instances_over_time, event_times
+        return recorder
 
     def record_log_data(self):
         """This will set up the record information to graph total hours
         logged in a simulation over time.
+
+        Returns:
+            A SimulationRecorder with the logged hours over time.
         """
-        logged_hours_per_hour = self.EC2.init_empty_all_instance_types()
-        event_times = {}
         log_simulator = Simulator(self.job_flows, self.pool, self.EC2)
-        observer = SimulationObserver(event_times, logged_hours_per_hour)
-        log_simulator.attach_log_hours_observer(observer)
+        recorder = SimulationRecorder(self.EC2)
+        log_simulator.attach_log_hours_observer(recorder)
         log_simulator.run()
+        return recorder
+
+    def binned_traces(self, recorder):
+        """Buckets everything a recorder recorded into time bins.
 
-        return  logged_hours_per_hour, event_times
+        Returns:
+            traces: A dict of instance type to a (times, columns) tuple.
+                times is a list of bin start times in seconds since the
+                epoch and columns is a dict of utilization class to the
+                binned values.
+        """
+        utilization_classes = self.EC2.ALL_UTILIZATION_PRIORITIES
+        traces = {}
+        for instance_type in recorder.recorded_instance_types():
+            times = recorder.event_times(instance_type)
+            columns = [recorder.column(instance_type, utilization_class)
+                        for utilization_class in utilization_classes]
+            bin_seconds = self.bin_seconds
+            if bin_seconds is None:
+                bin_seconds = choose_bin_seconds(times, self.max_points)
+            if bin_seconds:
+                times, columns = downsample(times, columns, bin_seconds,
+                                            self.aggregate)
+            traces[instance_type] = (list(times),
+                                    dict(zip(utilization_classes, columns)))
+        return traces
 
-    def graph_over_time(self, info_over_time,
-                hours_line,
+    def graph_over_time(self, recorder,
                 xlabel='Time job ran (in hours)',
                 ylabel='Instances run'):
         """Given some sort of data that changes over time, graph the
         data usage using this"""
+        begin_time, end_time = self.graph_time_limits()
+        traces = self.binned_traces(recorder)
+        for instance_type in traces:
+            times, info_over_time = traces[instance_type]
+            draw_graph(self.plt, self.mdates, instance_type, times,
+                info_over_time, self.EC2.ALL_UTILIZATION_PRIORITIES,
+                self.colors, begin_time, end_time, xlabel, ylabel)
 
-        begin_time = min(job.get('startdatetime') for job in self.job_flows)
-        end_time = max(job.get('enddatetime') for job in self.job_flows)
+    def graph_time_limits(self):
+        """Returns the (begin, end) times for the x axis of the graphs."""
+        begin_time = self.job_flows_index.begin_time
+        end_time = self.job_flows_index.end_time
 
         # If end time is during the day, round to the next day so graph looks
         # pretty.
         if end_time.hour != 0:
             end_time = end_time.replace(hour=0, day=(end_time.day + 1))
+        return begin_time, end_time
+
+    def save(self, directory, total_usage=False, instance_usage=False,
+            image_format='png', processes=None):
+        """Renders the graphs to image files instead of showing them, so no
+        display is needed. Each figure is drawn in a separate process with
+        matplotlib's Agg backend.
+
+        An index.json file listing every image is written to the directory
+        next to the images.
+
+        Args:
+            directory: Directory to write the images and index to. It is
+                created if it doesn't exist.
+
+            total_usage: Render the total hours used graphs.
+
+            instance_usage: Render the instance usage graphs.
+
+            image_format: Any format matplotlib can save to, e.g. png or svg.
+
+            processes: Number of processes to render with. Defaults to the
+                number of cores.
+
+        Returns:
+            index: A list of dicts with the instance type, graph name and
+                path of every image rendered.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        begin_time, end_time = self.graph_time_limits()
+
+        graphs = []
+        if total_usage:
+            graphs.append((TOTAL_USAGE, self.record_log_data(),
+                'Hours logged'))
+        if instance_usage:
+            graphs.append((INSTANCE_USAGE, self.record_used_instances(),
+                'Instances run'))
+
+        index = []
+        render_args = []
+        for graph_name, recorder, ylabel in graphs:
+            traces = self.binned_traces(recorder)
+            for instance_type in sorted(traces):
+                times, info_over_time = traces[instance_type]
+                path = os.path.join(directory, '%s_%s.%s' % (
+                    graph_name, instance_type, image_format))
+                index.append({'instance_type': instance_type,
+                            'graph': graph_name,
+                            'path': path})
+                render_args.append((path, instance_type, times,
+                    info_over_time, self.EC2.ALL_UTILIZATION_PRIORITIES,
+                    self.colors, begin_time, end_time,
+                    'Time job ran (in hours)', ylabel))
+
+        logging.info("Rendering %d graphs into %s", len(render_args),
+            directory)
+        if processes == 1 or len(render_args) <= 1:
+            map(render_graph_file, render_args)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                pool.map(render_graph_file, render_args)
+            finally:
+                pool.close()
+                pool.join()
+
+        with open(os.path.join(directory, INDEX_FILENAME), 'w') as f:
+            json.dump(index, f, indent=2)
+        return index
+
+
+def draw_graph(plt, mdates, instance_type, times, info_over_time,
+            utilization_classes, colors, begin_time, end_time, xlabel, ylabel):
+    """Draws one instance type's stacked usage graph on a new figure.
+
+    Args:
+        times: Times in seconds since the epoch.
+
+        info_over_time: A dict of utilization class to the stacked values
+            at each of the times.
+
+    Returns:
+        fig: The matplotlib figure drawn on.
+    """
+    # Locators / Formatters to pretty up the graph.
+    hours = mdates.HourLocator(byhour=None, interval=1)
+    days = mdates.DayLocator(bymonthday=None, interval=1)
+    formatter = mdates.DateFormatter("%m/%d ")
+
+    fig = plt.figure()
+    fig.suptitle(instance_type)
+    ax = fig.add_subplot(111)
+    date_list = mdates.date2num(
+        [datetime.datetime.utcfromtimestamp(time) for time in times])
+
+    all_utilization_classes = copy.deepcopy(utilization_classes)
+
+    # Reverse so demand is graphed first, it should be the largest.
+    all_utilization_classes.reverse()
+
+    for utilization_class in all_utilization_classes:
+        ax.plot(date_list,
+            info_over_time[utilization_class],
+            color='#000000')
+        ax.plot(date_list[0],
+            info_over_time[utilization_class][0],
+            color=colors[utilization_class],
+            label=utilization_class)
+        ax.fill_between(date_list,
+            info_over_time[utilization_class],
+            color=colors[utilization_class],
+            alpha=1.0)
+
+    ax.xaxis.set_major_locator(days)
+    ax.xaxis.set_major_formatter(formatter)
+    ax.xaxis.set_minor_locator(hours)
+
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_xlim(begin_time, end_time)
+    ax.grid(True)
+    ax.legend()
+    plt.setp(ax.get_xticklabels(), rotation='vertical')
+    return fig
+
+
+def render_graph_file(args):
+    """Draws a graph with the Agg backend and saves it. Takes a single
+    tuple of the path followed by draw_graph's arguments (minus plt and
+    mdates) so it can be used with multiprocessing.Pool.map.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+
+    path = args[0]
+    fig = draw_graph(plt, mdates, *args[1:])
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+    return path
+
+
+def choose_bin_seconds(times, max_points):
+    """Picks the smallest whole number of seconds that buckets times into
+    at most max_points bins. Returns None if times already fits.
+    """
+    if len(times) <= max_points:
+        return None
+    span = times[-1] - times[0]
+    # Bins start at the first time, so the last time lands in bin
+    # span // bin_seconds which has to be less than max_points.
+    return int(span // max(max_points - 1, 1)) + 1
+
+
+def downsample(times, columns, bin_seconds, aggregate=MAX):
+    """Buckets a trace into bins of bin_seconds, starting at the first time.
+
+    Since the columns recorded by the simulator are stacked totals, taking
+    the max or mean of every column in a bin keeps them stacked.
+
+    Args:
+        times: A sorted sequence of times in seconds since the epoch.
+
+        columns: A list of sequences of values, each the same length as
+            times.
+
+        bin_seconds: Width of each bin in seconds.
+
+        aggregate: MAX or MEAN.
+
+    Returns:
+        (bin_times, bin_columns): The start time of every bin that has at
+            least one point, and a list with one list of binned values for
+            each column.
+    """
+    bin_times = []
+    bin_columns = [[] for _ in columns]
+    if not len(times):
+        return bin_times, bin_columns
 
-        for instance_type in instance_types_in_pool(info_over_time):
-            # Locators / Formatters to pretty up the graph.
-            hours = self.mdates.HourLocator(byhour=None, interval=1)
-            days = self.mdates.DayLocator(bymonthday=None, interval=1)
-            formatter = self.mdates.DateFormatter("%m/%d ")
-
-            fig = self.plt.figure()
-            fig.suptitle(instance_type)
-            ax = fig.add_subplot(111)
-            date_list = self.mdates.date2num(hours_line[instance_type])
-
-            all_utilization_classes = copy.deepcopy(
-                            self.EC2.ALL_UTILIZATION_PRIORITIES)
-
-            # Reverse so demand is graphed first, it should be the largest.
-            all_utilization_classes.reverse()
-
-            for utilization_class in all_utilization_classes:
-                ax.plot(date_list,
-                    info_over_time[utilization_class][instance_type],
-                    color='#000000')
-                ax.plot(date_list[0],
-                    info_over_time[utilization_class][instance_type][0],
-                    color=self.colors[utilization_class],
-                    label=utilization_class)
-                ax.fill_between(date_list,
-                    info_over_time[utilization_class][instance_type],
-                    color=self.colors[utilization_class],
-                    alpha=1.0)
-
-            ax.xaxis.set_major_locator(days)
-            ax.xaxis.set_major_formatter(formatter)
-            ax.xaxis.set_minor_locator(hours)
-
-            ax.set_xlabel(xlabel)
-            ax.set_ylabel(ylabel)
-            ax.set_xlim(begin_time, end_time)
-            ax.grid(True)
-            ax.legend()
-            self.plt.xticks(rotation='vertical')
+    origin = times[0]
+    bin_start = 0
+    current_bin = None
+    for row in xrange(len(times) + 1):
+        if row < len(times):
+            row_bin = int((times[row] - origin) // bin_seconds)
+            if row_bin == current_bin:
+                continue
+        # Close the bin [bin_start, row).
+        if current_bin is not None:
+            bin_times.append(origin + current_bin * bin_seconds)
+            for column, binned in zip(columns, bin_columns):
+                values = column[bin_start:row]
+                if aggregate == MAX:
+                    binned.append(max(values))
+                else:
+                    binned.append(sum(values) / float(len(values)))
+        if row < len(times):
+            current_bin = row_bin
+            bin_start = row
+    return bin_times, bin_columns
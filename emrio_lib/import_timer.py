@@ -0,0 +1,60 @@
+"""Times the imports EMRio does while it runs.
+
+EMRio imports its heavy dependencies (boto, matplotlib, pytz and yaml) inside
+the functions that need them. ImportTimer wraps the builtin __import__ so the
+time spent in each of those imports can be reported, along with how long it
+took to import EMRio itself.
+"""
+import __builtin__
+import sys
+import time
+
+
+class ImportTimer(object):
+
+    def __init__(self, emrio_import_seconds=0.0):
+        """
+        Args:
+            emrio_import_seconds: How long importing the EMRio modules took,
+                reported as the first line.
+        """
+        self.emrio_import_seconds = emrio_import_seconds
+        self.import_times = []
+        self._original_import = None
+        self._depth = 0
+
+    def install(self):
+        """Starts timing imports."""
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def uninstall(self):
+        """Stops timing imports."""
+        if self._original_import is not None:
+            __builtin__.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, *args, **kwargs):
+        # Only time the outermost import of a module that isn't loaded yet,
+        # nested imports are counted in the module that triggered them.
+        if self._depth or name in sys.modules:
+            return self._original_import(name, *args, **kwargs)
+        self._depth += 1
+        start_time = time.time()
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            self._depth -= 1
+            self.import_times.append((name, time.time() - start_time))
+
+    def report(self, out):
+        """Writes the import times, slowest first, to a file object."""
+        self.uninstall()
+        total = self.emrio_import_seconds + sum(
+            seconds for _, seconds in self.import_times)
+        out.write("Import times:\n")
+        out.write("%-30s %8.3fs\n" % ('emrio', self.emrio_import_seconds))
+        for name, seconds in sorted(self.import_times,
+                                    key=lambda item: -item[1]):
+            out.write("%-30s %8.3fs\n" % (name, seconds))
+        out.write("%-30s %8.3fs\n" % ('total', total))
@@ -0,0 +1,242 @@
+"""Re-optimizing a sliding window of job flows from the last run's state.
+
+A daily run over the last two months of job flows only sees a day of new
+jobs and a day of expired ones, so most of the previous run's work still
+holds. The state kept between runs has the optimal pool and, for each
+instance type, the on demand hours of every job flow that used it and the
+hours it logged with every count of reserved instances simulated. Reserved
+instances of one type don't change the hours of any other type, so:
+
+- Instance types whose job flows didn't change keep their previous counts
+  without simulating, as long as the interval and prices are the same.
+- If only the interval changed, their logged hours are rescaled to the new
+  interval instead of simulated again, and they are re-optimized from their
+  previous counts. Only counts that weren't simulated before are simulated.
+- Instance types that had job flows added or expired are simulated again,
+  using only the job flows that use them, warm started from their previous
+  counts. In a sliding window that is every instance type with job flows
+  at either end of the window.
+
+Only the hours of job flows that are new since the last run are calculated.
+The state is saved as JSON, so loading it never runs code from the file.
+"""
+import copy
+import datetime
+import json
+import logging
+import os
+import tempfile
+from collections import defaultdict
+
+from ec2_cost import fill_instance_types
+from job_handler import calculate_demand_hours
+from optimizer import Optimizer
+
+# Bump this when OptimizerState changes, so old state files are ignored.
+STATE_VERSION = 3
+
+
+class OptimizerState(object):
+    """What incremental_optimize remembers between runs."""
+
+    def __init__(self, key, interval, pool, job_hours, logged_hours):
+        """
+        Args:
+            key: Everything else the pool depends on, like the prices and
+                owned instances. The state is only reused with the same key.
+
+            interval: The timedelta the job flows spanned.
+
+            pool: The optimal pool.
+
+            job_hours: A dict of instance type to a dict of job flow id to
+                the on demand hours the job flow used of that type.
+
+            logged_hours: The hours_cache the Optimizer filled in, with the
+                hours each instance type logged with the counts simulated.
+        """
+        self.version = STATE_VERSION
+        self.key = key
+        self.interval = interval
+        self.pool = pool
+        self.job_hours = job_hours
+        self.logged_hours = logged_hours
+
+    def as_dict(self):
+        """Returns the state as a dict that can be JSON encoded."""
+        return {
+            'version': self.version,
+            'key': self.key,
+            'interval': [self.interval.days, self.interval.seconds,
+                        self.interval.microseconds],
+            'pool': self.pool,
+            'job_hours': self.job_hours,
+            # JSON keys can't be tuples of counts.
+            'logged_hours': dict(
+                (instance_type, [[list(counts), hours]
+                                for counts, hours in hours_by_counts.items()])
+                for instance_type, hours_by_counts in
+                self.logged_hours.items()),
+        }
+
+
+def load_state(filename):
+    """Returns the OptimizerState saved in filename, or None if there is
+    no usable one."""
+    try:
+        with open(filename, 'rb') as f:
+            data = json.load(f)
+    except IOError:
+        return None
+    except ValueError:
+        logging.warning("Ignoring unreadable optimizer state %s", filename)
+        return None
+    if not isinstance(data, dict) or data.get('version') != STATE_VERSION:
+        logging.info("Ignoring optimizer state from another version")
+        return None
+    logged_hours = dict(
+        (instance_type, dict((tuple(counts), hours)
+                            for counts, hours in hours_by_counts))
+        for instance_type, hours_by_counts in data['logged_hours'].items())
+    return OptimizerState(data['key'], datetime.timedelta(*data['interval']),
+                        data['pool'], data['job_hours'], logged_hours)
+
+
+def save_state(filename, state):
+    """Saves an OptimizerState, replacing filename atomically."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        json.dump(state.as_dict(), f)
+    os.rename(temp_path, filename)
+
+
+def update_job_hours(previous_job_hours, job_flows):
+    """Applies the added and expired job flows to the previous per instance
+    type job hours.
+
+    Returns:
+        (job_hours, changed_types): The job hours of job_flows and the set of
+            instance types that had job flows added or expired.
+    """
+    current_ids = set(job['jobflowid'] for job in job_flows)
+    known_ids = set()
+    job_hours = {}
+    changed_types = set()
+    for instance_type, hours in previous_job_hours.items():
+        known_ids.update(hours)
+        kept = dict((job_id, job_hours_used)
+                    for job_id, job_hours_used in hours.items()
+                    if job_id in current_ids)
+        if len(kept) != len(hours):
+            changed_types.add(instance_type)
+        if kept:
+            job_hours[instance_type] = kept
+
+    for job in job_flows:
+        if job['jobflowid'] in known_ids:
+            continue
+        for instance_type, hours in calculate_demand_hours([job]).items():
+            job_hours.setdefault(instance_type, {})[job['jobflowid']] = hours
+            changed_types.add(instance_type)
+    return job_hours, changed_types
+
+
+def incremental_optimize(job_flows, EC2, state=None, key=None,
+                        pre_existing_pool=None, stats=None):
+    """Finds the optimal pool for job_flows, reusing a previous run's state.
+
+    Args:
+        state: The OptimizerState from the last run, or None to start over.
+
+        key: JSON serializable parts for everything other than the job flows
+            the pool depends on (prices, owned instances).
+
+        pre_existing_pool: Instances that are already owned, see
+            Optimizer.run.
+
+        stats: An OptimizerStats to count the optimizer's work in.
+
+    Returns:
+        (pool, state): The optimal pool and the state to pass to the next
+            run.
+    """
+    min_time = min(job.get('startdatetime') for job in job_flows)
+    max_time = max(job.get('enddatetime') for job in job_flows)
+    interval = max_time - min_time
+
+    previous_job_hours = {}
+    previous_pool = None
+    if state is not None:
+        previous_job_hours = state.job_hours
+        previous_pool = state.pool
+    job_hours, changed_types = update_job_hours(previous_job_hours,
+                                                job_flows)
+    logged_hours = {}
+    if state is None or state.key != key:
+        changed_types = set(job_hours)
+    else:
+        # The hours job flows log don't depend on the interval, only their
+        # yearly hours do, so they're kept for the job flows that didn't
+        # change.
+        logged_hours = dict(
+            (instance_type, hours) for instance_type, hours in
+            state.logged_hours.items()
+            if instance_type in job_hours and
+            instance_type not in changed_types)
+    optimized_types = set(changed_types)
+    if state is not None and state.interval != interval:
+        optimized_types = set(job_hours)
+
+    if pre_existing_pool is None:
+        pool = EC2.init_empty_reserve_pool()
+    else:
+        pool = pre_existing_pool
+    fill_instance_types(job_flows, pool)
+    floor = copy.deepcopy(pool)
+
+    jobs_by_type = defaultdict(list)
+    for job in job_flows:
+        for instance in job.get('instancegroups', []):
+            instance_type = instance.get('instancetype')
+            if instance_type in optimized_types and (
+                    not jobs_by_type[instance_type] or
+                    jobs_by_type[instance_type][-1] is not job):
+                jobs_by_type[instance_type].append(job)
+
+    for instance_type in sorted(job_hours):
+        previous_counts = {}
+        if previous_pool is not None:
+            previous_counts = dict(
+                (utilization_class, previous_pool.get(
+                    utilization_class, {}).get(instance_type, 0))
+                for utilization_class in EC2.RESERVE_PRIORITIES)
+        if instance_type not in optimized_types:
+            logging.debug("Job flows using %s haven't changed, keeping its"
+                " reserved instances", instance_type)
+            for utilization_class, count in previous_counts.items():
+                pool[utilization_class][instance_type] = max(
+                    count, pool[utilization_class][instance_type])
+            continue
+
+        demand_hours = {instance_type: sum(job_hours[instance_type].values())}
+        optimizer = Optimizer(jobs_by_type[instance_type], EC2,
+                            job_flows_interval=interval,
+                            demand_hours=demand_hours,
+                            stats=stats, hours_cache=logged_hours)
+        if not optimizer.could_save_money(instance_type):
+            optimizer.stats.skipped_instance_types.append(instance_type)
+            continue
+        if any(previous_counts.values()):
+            logging.debug("Re-optimizing %s from its previous pool",
+                instance_type)
+            for utilization_class, count in previous_counts.items():
+                pool[utilization_class][instance_type] = max(
+                    count, pool[utilization_class][instance_type])
+            optimizer.optimize_reserve_pool(instance_type, pool, floor=floor)
+        else:
+            logging.debug("Optimizing %s", instance_type)
+            optimizer.optimize_reserve_pool(instance_type, pool)
+
+    return pool, OptimizerState(key, interval, copy.deepcopy(pool),
+                                job_hours, logged_hours)
@@ -9,43 +9,208 @@ input from the user.
 import datetime
 import json
 import logging
-
-import boto.exception
-from boto.emr.connection import EmrConnection
-
-
-def get_job_flows(options, timezone):
+from collections import defaultdict
+from collections import OrderedDict
+
+from aws_client import default_client
+from aws_client import paginate_job_flows
+from compression import open_history
+from job_index import JobFlowIndex
+from job_store import is_job_flow_store
+from job_store import JobFlowStore
+from jsonl_reader import read_job_flows
+from partitions import is_partitioned_history
+from partitions import PartitionedHistory
+from profiling import StageProfiler
+from simulate_jobs import END
+from simulate_jobs import LOG
+from simulate_jobs import START
+
+
+def get_job_flows(options, timezone, profiler=None):
     """Get job flows data from amazon's cluster or read job flows from
     a file.
 
     Args:
         options: An OptionParser object that has args stored in it.
 
+        profiler: A StageProfiler to record the fetch, parse and filter
+            stages with.
+
     Returns:
         job_flows: A list of dicts of jobs that have run over a period of time.
     """
+    if profiler is None:
+        profiler = StageProfiler()
+
     job_flows = []
-    if(options.file_inputs):
-        job_flows = load_job_flows_from_file(options.file_inputs)
-    else:
-        logging.info('Getting job flows from Amazon, this may take some'
-            'time...')
-        job_flows = load_job_flows_from_amazon(options.conf_path,
-            options.max_days_ago)
-
-    job_flows = no_date_filter(job_flows)
-    job_flows = convert_dates(job_flows, timezone)
-    job_flows = range_date_filter(job_flows,
-                                options.min_days,
-                                options.max_days,
-                                timezone)
-
-    # sort job flows before running simulations.
-    by_startdatetime = lambda j: j.get('startdatetime')
-    job_flows = sorted(job_flows, key=by_startdatetime)
+    # Job flows read by read_job_flows already have their dates converted.
+    converted = False
+    with profiler.stage('fetch'):
+        if (options.file_inputs and
+                is_partitioned_history(options.file_inputs)):
+            # Only the partitions in the date range are read.
+            job_flows = PartitionedHistory(options.file_inputs).query(
+                options.min_days, options.max_days)
+        elif options.file_inputs and is_job_flow_store(options.file_inputs):
+            # The store only reads the job flows in the date range.
+            store = JobFlowStore(options.file_inputs)
+            try:
+                job_flows = store.query(options.min_days, options.max_days)
+            finally:
+                store.close()
+        elif(options.file_inputs):
+            try:
+                job_flows = read_job_flows(options.file_inputs, timezone,
+                    processes=options.load_processes,
+                    offsets_dir=options.cache_dir)
+                converted = True
+            except ValueError:
+                # Not the one job per line format.
+                job_flows = load_job_flows_from_file(options.file_inputs)
+        else:
+            logging.info('Getting job flows from Amazon, this may take some'
+                'time...')
+            job_flows = load_job_flows_from_amazon(options.conf_path,
+                options.max_days_ago)
+
+    if not converted:
+        with profiler.stage('parse'):
+            job_flows = no_date_filter(job_flows)
+            job_flows = convert_dates(job_flows, timezone)
+
+    with profiler.stage('filter'):
+        # Also sorts the job flows by start time before simulating.
+        job_flows = range_date_filter(job_flows,
+                                    options.min_days,
+                                    options.max_days,
+                                    timezone)
     return job_flows
 
 
+def calculate_demand_hours(job_flows):
+    """Calculates the hours each instance type is billed for if everything
+    runs on demand, without simulating.
+
+    With no reserved instances there is nothing to allocate, so each job is
+    billed for every hour (or part of an hour) it runs, times the amount of
+    instances it uses. This gives the same hours as running a Simulator with
+    an empty pool, but in a single pass over the jobs. The hours don't
+    depend on prices, so they can be reused with any EC2Info.
+
+    Returns:
+        demand_hours: A dict of instance type to the amount of hours used.
+    """
+    demand_hours = defaultdict(int)
+    for job in job_flows:
+        hours = billed_hours(job)
+        for instance in job.get('instancegroups', []):
+            instance_type = instance.get('instancetype')
+            demand_hours[instance_type] += hours * int(
+                instance.get('instancerequestcount', 0))
+    return demand_hours
+
+
+def billed_hours(job):
+    """Returns how many hours the simulator bills a job for.
+
+    The simulator bills the first hour when the job starts and another one
+    for every full hour that passes before the job ends.
+    """
+    duration = job['enddatetime'] - job['startdatetime']
+    seconds = duration.days * 24 * 60 * 60 + duration.seconds
+    if duration.microseconds:
+        return seconds // 3600 + 1
+    return max(seconds - 1, 0) // 3600 + 1
+
+
+def job_shape(job):
+    """Returns a job's instance groups as a sorted tuple of (instance type,
+    instance count), with the groups of each instance type added together.
+    """
+    counts = defaultdict(int)
+    for instance in job.get('instancegroups', []):
+        counts[instance.get('instancetype')] += int(
+            instance.get('instancerequestcount', 0))
+    return tuple(sorted(counts.items()))
+
+
+def collapse_job_flows(job_flows):
+    """Collapses job flows with the same shape that start and end at the
+    same times into one job flow using all of their instances.
+
+    Scheduled job flows often launch several identical clusters at once.
+    Simulating them as one job flow gives the same logged hours as
+    simulating them one by one, as long as no other job flow using one of
+    their instance types has an event at the same time as them (the
+    simulator could otherwise handle it in between them). Groups with such a
+    tie are left alone.
+
+    Job flows of the same shape share their instance groups.
+
+    Returns:
+        A new list of job flows in the same order. Collapsed job flows are
+            copies of the first job flow of their group with the group's
+            instances, a 'multiplicity' of how many job flows they stand for
+            and the group's 'collapsedjobflowids'.
+    """
+    shapes = {}
+    groups = OrderedDict()
+    for job in job_flows:
+        shape = job_shape(job)
+        shape = shapes.setdefault(shape, shape)
+        key = (job['startdatetime'], job['enddatetime'], shape)
+        groups.setdefault(key, []).append(job)
+
+    # Count the groups with an event at each time for each instance type,
+    # for the times that groups of more than one job flow have events.
+    wanted = set()
+    for key, jobs in groups.items():
+        if len(jobs) > 1:
+            wanted.update(_event_keys(key))
+    groups_with_event = defaultdict(int)
+    for key in groups:
+        for event_key in _event_keys(key):
+            if event_key in wanted:
+                groups_with_event[event_key] += 1
+
+    instance_groups = {}
+    collapsed = []
+    for key, jobs in groups.items():
+        if len(jobs) == 1 or any(groups_with_event[event_key] > 1
+                                for event_key in _event_keys(key)):
+            collapsed.extend(jobs)
+            continue
+        shape = tuple((instance_type, count * len(jobs))
+                    for instance_type, count in key[2])
+        if shape not in instance_groups:
+            instance_groups[shape] = [
+                {'instancetype': instance_type,
+                'instancerequestcount': str(count)}
+                for instance_type, count in shape]
+        collapsed.append(dict(jobs[0],
+            instancegroups=instance_groups[shape],
+            multiplicity=len(jobs),
+            collapsedjobflowids=[job.get('jobflowid') for job in jobs]))
+    logging.debug("Collapsed %d job flows into %d", len(job_flows),
+        len(collapsed))
+    return collapsed
+
+
+def _event_keys(group_key):
+    """Yields (time, event type, instance type) for each of the simulator's
+    events for a group of job flows and each of their instance types."""
+    start_time, end_time, shape = group_key
+    events = [(start_time, START), (end_time, END)]
+    hour_increment = start_time + datetime.timedelta(0, 3600)
+    while hour_increment < end_time:
+        events.append((hour_increment, LOG))
+        hour_increment += datetime.timedelta(0, 3600)
+    for time, event_type in events:
+        for instance_type, _ in shape:
+            yield time, event_type, instance_type
+
+
 def convert_dates(job_flows, timezone):
     """Converts the dates of all the jobs to the datetime object
     since they are originally in unicode strings
@@ -82,31 +247,38 @@ def no_date_filter(job_flows):
     return filtered_job_flows
 
 
-def range_date_filter(job_flows, min_days, max_days, timezone):
+def range_date_filter(job_flows, min_days, max_days, timezone,
+                    job_flows_index=None):
     """Removes any job that is not within the interval of min day and
     max day and returns the new filtered list.
 
+    Args:
+        job_flows_index: A JobFlowIndex of job_flows to look the range up in.
+            Built here if None.
+
     Returns:
-        Returns job flows that ran within the interval of dates allowed.
+        Returns job flows that ran within the interval of dates allowed,
+            sorted by start time.
     """
+    if job_flows_index is None:
+        job_flows_index = JobFlowIndex(job_flows)
+    return job_flows_index.range(*day_range(min_days, max_days, timezone))
 
-    filtered_job_flows = []
+
+def day_range(min_days, max_days, timezone):
+    """Turns --min-day and --max-day strings into datetimes in timezone.
+    Missing days stay None."""
     if min_days:
         min_days = datetime.datetime.strptime(min_days, "%Y/%m/%d")
         min_days = min_days.replace(tzinfo=timezone)
+    else:
+        min_days = None
     if max_days:
         max_days = datetime.datetime.strptime(max_days, "%Y/%m/%d")
         max_days = max_days.replace(tzinfo=timezone)
-    for job  in job_flows:
-        job_within_range = True
-        if min_days and job['startdatetime'] < min_days:
-            job_within_range = False
-        if max_days and job['enddatetime'] > max_days:
-            job_within_range = False
-
-        if job_within_range:
-            filtered_job_flows.append(job)
-    return filtered_job_flows
+    else:
+        max_days = None
+    return min_days, max_days
 
 
 def parse_date(str_date, timezone=None):
@@ -130,18 +302,19 @@ def parse_date(str_date, timezone=None):
 def load_job_flows_from_file(filename):
     """Loads job flows from a file specified by the filename. Will
     try comma-separated JSON objects then per-line objects before failing.
+    Compressed files are decompressed as they are read, see compression.
     """
     try:
-        current_file = open(filename, 'r')
+        current_file = open_history(filename)
         contents = current_file.read().rstrip('\n')[:-1]
         job_flows = json.loads(contents)
         current_file.close()
         return job_flows
     except ValueError:
-        print "Failed parsing pure json, trying back up format now..."
+        logging.debug("Failed parsing pure json, trying back up format now...")
     job_flows = []
-    current_file = open(filename, 'r')
-    for line in current_file.readlines():
+    current_file = open_history(filename)
+    for line in current_file:
         job_flows.append(json.loads(line))
     current_file.close()
     return job_flows
@@ -166,7 +339,8 @@ def load_job_flows_from_amazon(conf_path, max_days_ago):
     return job_flows
 
 
-def get_job_flow_objects(conf_path, max_days_ago=None, now=None):
+def get_job_flow_objects(conf_path, max_days_ago=None, now=None,
+                        client=None):
     """Get relevant job flow information from EMR.
 
     Args:
@@ -178,18 +352,22 @@ def get_job_flow_objects(conf_path, max_days_ago=None, now=None):
 
         now: the current UTC time as a datetime.datetime object.
             defaults to the current time.
+
+        client: The AWSClient to fetch the job flows with. Defaults to the
+            one shared by the run (see aws_client.default_client).
     Returns:
         job_flows: A list of boto job flow objects.
     """
     if now is None:
         now = datetime.datetime.utcnow()
-    emr_conn = EmrConnection()
+    if client is None:
+        client = default_client()
     # if --max-days-ago is set, only look at recent jobs
     created_after = None
     if max_days_ago is not None:
         created_after = now - datetime.timedelta(days=max_days_ago)
 
-    return describe_all_job_flows(emr_conn, created_after=created_after)
+    return client.describe_job_flows(created_after=created_after, now=now)
 
 
 def describe_all_job_flows(emr_conn, states=None, jobflow_ids=None,
@@ -199,7 +377,9 @@ def describe_all_job_flows(emr_conn, states=None, jobflow_ids=None,
     is available through the EMR API.
 
     This is a way of getting around the limits of the API, both on number
-    of job flows returned, and how far back in time we can go.
+    of job flows returned, and how far back in time we can go. It pages
+    through the history on one connection, AWSClient.describe_job_flows
+    fetches windows of it at once.
 
     Args:
         states: A list of strings with job flow states wanted.
@@ -213,46 +393,7 @@ def describe_all_job_flows(emr_conn, states=None, jobflow_ids=None,
     Returns:
         job_flows: A list of job flow boto objects
     """
-    all_job_flows = []
-    ids_seen = set()
-
-    if not (states or jobflow_ids or created_after or created_before):
-        created_before = (
-            datetime.datetime.utcnow() + datetime.timedelta(days=1))
-
-    while True:
-        if created_before and created_after and created_before < created_after:
-            break
-        boto_logger = logging.getLogger('boto')
-        boto_logger.disabled = True
-        try:
-            results = emr_conn.describe_jobflows(
-                states=states, jobflow_ids=jobflow_ids,
-                created_after=created_after, created_before=created_before)
-        except boto.exception.BotoServerError, ex:
-            if 'ValidationError' in ex.body:
-                break
-            else:
-                raise
-
-        # don't count the same job flow twice
-        job_flows = [jf for jf in results if jf.jobflowid not in ids_seen]
-        all_job_flows.extend(job_flows)
-        ids_seen.update(jf.jobflowid for jf in job_flows)
-
-        if job_flows:
-            # set created_before to be just after the start time of
-            # the first job returned, to deal with job flows started
-            # in the same second
-            min_create_time = min(parse_date(jf.creationdatetime)
-                                    for jf in job_flows)
-            created_before = min_create_time + datetime.timedelta(seconds=1)
-            # if someone managed to start 501 job flows in the same second,
-            # they are still screwed (the EMR API only returns up to 500),
-            # but this seems unlikely. :)
-        else:
-            if not created_before:
-                created_before = datetime.datetime.utcnow()
-            created_before -= datetime.timedelta(weeks=2)
-
-    return all_job_flows
+    job_flows, _ = paginate_job_flows(emr_conn.describe_jobflows,
+        states=states, jobflow_ids=jobflow_ids, created_after=created_after,
+        created_before=created_before)
+    return job_flows
@@ -0,0 +1,200 @@
+"""An index over a job flow history's start and end times.
+
+The index is built once when the history is read, and answers the questions
+that otherwise need a pass over every job flow (or replaying the simulator's
+event heap):
+
+    - Which job flows fall in a date range (range_date_filter)?
+    - When does the history begin and end, and how long is it?
+    - Which job flows, and how many instances of each type, are running at a
+      given time?
+
+Job flows are kept sorted by start time next to a sorted list of their end
+times, so range and count lookups are binary searches. Finding the job flows
+running at a time uses a tree of the largest end time of each run of job
+flows (sorted by start), so only the runs that hold a running job flow are
+visited. Each instance type also keeps running totals of its instances by
+start and by end time, so the instances running at a time are the difference
+of two sums found with binary searches.
+
+Job flows are running from their start time up to, but not including, their
+end time, like in the simulator.
+"""
+import bisect
+import datetime
+from collections import defaultdict
+
+
+class JobFlowIndex(object):
+
+    def __init__(self, job_flows):
+        """
+        Args:
+            job_flows: Job flows with datetimes for their start and end times
+                (see job_handler.convert_dates). They don't need to be
+                sorted.
+        """
+        self.job_flows = sorted(job_flows,
+                                key=lambda job: job.get('startdatetime'))
+        self.starts = [job.get('startdatetime') for job in self.job_flows]
+        self.ends = sorted(job.get('enddatetime') for job in self.job_flows)
+        self.begin_time = None
+        self.end_time = None
+        if self.job_flows:
+            self.begin_time = self.starts[0]
+            self.end_time = self.ends[-1]
+
+        # Only the point in time queries need these, so they are built the
+        # first time one is asked.
+        self._max_ends = None
+        self._type_totals = None
+        self._type_indexes = {}
+
+    def __len__(self):
+        return len(self.job_flows)
+
+    def interval(self):
+        """Returns the timedelta from the first start to the last end, or
+        no time for an empty history. Check the index isn't empty before
+        scaling hours by it."""
+        if not self.job_flows:
+            return datetime.timedelta(0)
+        return self.end_time - self.begin_time
+
+    def instance_types(self):
+        """Returns the sorted instance types the job flows use."""
+        return sorted(self._instance_type_totals())
+
+    def range(self, min_time=None, max_time=None):
+        """Returns the job flows that start at or after min_time and end at
+        or before max_time, sorted by start time. None means no limit.
+
+        The start times are found with binary searches, but with a max_time
+        the end times of the job flows starting in the range are still
+        checked one by one.
+        """
+        low = 0
+        high = len(self.job_flows)
+        if min_time is not None:
+            low = bisect.bisect_left(self.starts, min_time)
+        if max_time is None:
+            return self.job_flows[low:high]
+        # A job flow ending by max_time also starts by then.
+        high = bisect.bisect_right(self.starts, max_time)
+        return [job for job in self.job_flows[low:high]
+                if job.get('enddatetime') <= max_time]
+
+    def count_running_at(self, time):
+        """Returns how many job flows are running at time."""
+        return (bisect.bisect_right(self.starts, time) -
+                bisect.bisect_right(self.ends, time))
+
+    def running_at(self, time, instance_type=None):
+        """Returns the job flows running at time, sorted by start time.
+
+        Args:
+            instance_type: Only return the job flows using this instance
+                type.
+        """
+        if instance_type is not None:
+            return self.for_instance_type(instance_type).running_at(time)
+        if not self.job_flows:
+            return []
+        limit = bisect.bisect_right(self.starts, time)
+        found = []
+        max_ends = self._max_end_tree()
+        self._collect_running(len(max_ends) - 1, 0, limit, time, found)
+        return [self.job_flows[position] for position in found]
+
+    def instances_running_at(self, time):
+        """Returns a dict of instance type to the instances the job flows
+        running at time use."""
+        running = {}
+        for instance_type, (start_times, start_totals, end_times,
+                end_totals) in self._instance_type_totals().items():
+            count = (start_totals[bisect.bisect_right(start_times, time)] -
+                    end_totals[bisect.bisect_right(end_times, time)])
+            if count:
+                running[instance_type] = count
+        return running
+
+    def for_instance_type(self, instance_type):
+        """Returns the index of just the job flows using instance_type."""
+        if instance_type not in self._type_indexes:
+            self._type_indexes[instance_type] = JobFlowIndex(
+                [job for job in self.job_flows
+                if instance_type in instance_counts(job)])
+        return self._type_indexes[instance_type]
+
+    def _max_end_tree(self):
+        """Returns the levels of the tree of largest end times. The first
+        level is the job flows' end times, and each level above holds the
+        largest end time of pairs of the level below, up to a single one for
+        the whole history."""
+        if self._max_ends is None:
+            self._max_ends = [[job.get('enddatetime')
+                            for job in self.job_flows]]
+            while len(self._max_ends[-1]) > 1:
+                below = self._max_ends[-1]
+                level = [max(left, right) for left, right in
+                        zip(below[::2], below[1::2])]
+                if len(below) % 2:
+                    level.append(below[-1])
+                self._max_ends.append(level)
+        return self._max_ends
+
+    def _instance_type_totals(self):
+        """Returns a dict of instance type to the sorted start times, the
+        running totals of instances by start time, the sorted end times and
+        the running totals of instances by end time."""
+        if self._type_totals is None:
+            starts_by_type = defaultdict(list)
+            ends_by_type = defaultdict(list)
+            for job in self.job_flows:
+                for instance_type, count in instance_counts(job).items():
+                    starts_by_type[instance_type].append(
+                        (job.get('startdatetime'), count))
+                    ends_by_type[instance_type].append(
+                        (job.get('enddatetime'), count))
+            self._type_totals = {}
+            for instance_type in starts_by_type:
+                self._type_totals[instance_type] = (
+                    _running_totals(starts_by_type[instance_type]) +
+                    _running_totals(ends_by_type[instance_type]))
+        return self._type_totals
+
+    def _collect_running(self, level, position, limit, time, found):
+        """Adds the positions of the job flows before limit that end after
+        time, under the tree node at level and position, to found."""
+        if (position << level >= limit or
+                self._max_ends[level][position] <= time):
+            return
+        if level == 0:
+            found.append(position)
+            return
+        below = self._max_ends[level - 1]
+        for child in (2 * position, 2 * position + 1):
+            if child < len(below):
+                self._collect_running(level - 1, child, limit, time, found)
+
+
+def instance_counts(job):
+    """Returns a dict of instance type to how many instances the job flow
+    requests."""
+    counts = defaultdict(int)
+    for instance in job.get('instancegroups', []):
+        counts[instance['instancetype']] += int(
+            instance.get('instancerequestcount', 0))
+    return counts
+
+
+def _running_totals(times_and_counts):
+    """Sorts (time, count) pairs by time and returns the times and the
+    running totals of the counts, starting with 0 for before the first
+    time."""
+    times_and_counts.sort(key=lambda pair: pair[0])
+    times = [time for time, _ in times_and_counts]
+    totals = [0]
+    for _, count in times_and_counts:
+        totals.append(totals[-1] + count)
+    return times, totals
@@ -0,0 +1,171 @@
+"""A SQLite store for job flow histories longer than EMR keeps.
+
+The EMR API only returns about two months of job flows, so longer histories
+have to be kept locally. Instead of appending --dump-jobs files together,
+the job flows can be upserted into a store, which keeps one row per job flow
+and a row per instance group. Job flows are indexed by their start and end
+times, so the date range a run asks for is read with an index lookup rather
+than by parsing the whole history.
+
+Times are stored as strings in one format ('%Y-%m-%dT%H:%M:%S.%fZ'), so
+they sort and compare as strings in the same order as the times.
+"""
+import datetime
+import sqlite3
+
+STORE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+SQLITE_HEADER = b'SQLite format 3\x00'
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+# The formats EMR times come in (see job_handler.parse_date).
+EMR_TIME_FORMATS = (TIME_FORMAT, '%Y-%m-%dT%H:%M:%SZ')
+DAY_FORMAT = '%Y/%m/%d'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_flows (
+    jobflowid TEXT PRIMARY KEY,
+    startdatetime TEXT,
+    enddatetime TEXT
+);
+CREATE INDEX IF NOT EXISTS job_flows_startdatetime
+    ON job_flows (startdatetime);
+CREATE INDEX IF NOT EXISTS job_flows_enddatetime
+    ON job_flows (enddatetime);
+CREATE TABLE IF NOT EXISTS instance_groups (
+    jobflowid TEXT NOT NULL REFERENCES job_flows (jobflowid),
+    position INTEGER NOT NULL,
+    instancetype TEXT NOT NULL,
+    instancerequestcount INTEGER NOT NULL,
+    PRIMARY KEY (jobflowid, position)
+);
+"""
+
+
+def is_job_flow_store(filename):
+    """Returns whether filename is (or, if it doesn't exist yet, is named
+    like) a job flow store rather than a JSON history file."""
+    try:
+        with open(filename, 'rb') as f:
+            header = f.read(len(SQLITE_HEADER))
+    except IOError:
+        return filename.endswith(STORE_EXTENSIONS)
+    if not header:
+        return filename.endswith(STORE_EXTENSIONS)
+    return header == SQLITE_HEADER
+
+
+class JobFlowStore(object):
+
+    def __init__(self, filename):
+        """Opens the store in filename, creating it if needed."""
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def upsert(self, job_flows):
+        """Adds job flows to the store, replacing any stored job flows with
+        the same ids.
+
+        Args:
+            job_flows: Job flow dicts like --dump-jobs writes, with times as
+                strings. Job flows that haven't started or ended yet can have
+                None for those times.
+
+        Returns:
+            The number of job flows upserted.
+        """
+        count = 0
+        with self.connection:
+            for job in job_flows:
+                job_id = job['jobflowid']
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO job_flows VALUES (?, ?, ?)',
+                    (job_id, normalize_time(job.get('startdatetime')),
+                    normalize_time(job.get('enddatetime'))))
+                self.connection.execute(
+                    'DELETE FROM instance_groups WHERE jobflowid = ?',
+                    (job_id,))
+                self.connection.executemany(
+                    'INSERT INTO instance_groups VALUES (?, ?, ?, ?)',
+                    [(job_id, position, instance['instancetype'],
+                    int(instance['instancerequestcount']))
+                    for position, instance in enumerate(
+                        job.get('instancegroups', []))])
+                count += 1
+        return count
+
+    def query(self, min_day=None, max_day=None):
+        """Returns the stored job flows that start on or after min_day and
+        end on or before max_day, sorted by start time.
+
+        Args:
+            min_day, max_day: Days like --min-day and --max-day take
+                ('%Y/%m/%d'), or None for no limit. Job flows without a
+                start (or end) time are only returned without a min_day (or
+                max_day), like range_date_filter does.
+
+        Returns:
+            A list of job flow dicts in the format load_job_flows_from_file
+                returns, with times as strings.
+        """
+        conditions = []
+        arguments = []
+        if min_day:
+            conditions.append('startdatetime >= ?')
+            arguments.append(day_to_time(min_day))
+        if max_day:
+            conditions.append('enddatetime <= ?')
+            arguments.append(day_to_time(max_day))
+        where = ''
+        if conditions:
+            where = 'WHERE ' + ' AND '.join(conditions)
+
+        job_flows = []
+        jobs_by_id = {}
+        for job_id, start, end in self.connection.execute(
+                'SELECT jobflowid, startdatetime, enddatetime FROM job_flows '
+                '%s ORDER BY startdatetime, jobflowid' % where, arguments):
+            job = {
+                'jobflowid': job_id,
+                'startdatetime': start,
+                'enddatetime': end,
+                'instancegroups': [],
+            }
+            job_flows.append(job)
+            jobs_by_id[job_id] = job
+
+        for job_id, instance_type, count in self.connection.execute(
+                'SELECT instance_groups.jobflowid, instancetype, '
+                'instancerequestcount FROM instance_groups JOIN job_flows '
+                'ON instance_groups.jobflowid = job_flows.jobflowid '
+                '%s ORDER BY instance_groups.jobflowid, position' % where,
+                arguments):
+            jobs_by_id[job_id]['instancegroups'].append({
+                'instancetype': instance_type,
+                'instancerequestcount': str(count),
+            })
+        return job_flows
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM job_flows').fetchone()[0]
+
+
+def normalize_time(time):
+    """Converts an EMR time string to the store's format. None stays None."""
+    if not time:
+        return None
+    for time_format in EMR_TIME_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(time, time_format)
+        except ValueError:
+            continue
+        return parsed.strftime(TIME_FORMAT)
+    raise ValueError("Unknown time format: %s" % time)
+
+
+def day_to_time(day):
+    """Converts a '%Y/%m/%d' day to the store's format."""
+    return datetime.datetime.strptime(day, DAY_FORMAT).strftime(TIME_FORMAT)
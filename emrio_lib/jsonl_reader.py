@@ -0,0 +1,316 @@
+"""Reads large one job flow per line history files in parallel.
+
+The file is memory mapped rather than read into a string. Its lines are
+found once, and with --cache-dir their offsets are saved in the cache
+directory, so later reads of the same, unchanged file can skip straight to
+splitting it up. The offsets are kept as a plain array of numbers, not a
+pickle, so a stray offsets file can't run code when it's read. The
+lines are cut into chunks of about the same number of lines, and each chunk
+is parsed in a process pool: every worker maps the file itself, loads the
+JSON of its lines and parses their dates.
+
+Workers send back their job flows as a few flat lists (columns) rather than
+a list of dicts, which is much cheaper to pickle, and the job flow dicts are
+put together in the parent in file order.
+
+Compressed files can't be mapped, so they are decompressed as a stream in
+this process and blocks of their lines are sent to the workers as they are
+read.
+
+Job flows without a start or end time are left out, like no_date_filter
+does, and the dates are converted like convert_dates does, so the job flows
+are ready for range_date_filter.
+"""
+import array
+import datetime
+import hashlib
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+
+from compression import compression_of
+from compression import open_history
+from job_store import EMR_TIME_FORMATS
+
+LINES_SUFFIX = '.lines'
+# Starts an offsets file: a version tag, the size and modification time of
+# the history file, the number of offsets and the size of each one.
+LINES_HEADER = struct.Struct('<8sqdqi')
+LINES_TAG = b'EMRIOLN1'
+# Smaller files are parsed in this process, starting workers isn't worth it.
+MIN_PARALLEL_BYTES = 16 * 1024 * 1024
+# More chunks than processes, so a slow chunk doesn't hold up the others.
+CHUNKS_PER_PROCESS = 4
+# About how much of a compressed file is decompressed for each worker task.
+BLOCK_BYTES = 4 * 1024 * 1024
+
+# Set in each worker process by _init_worker.
+_worker_map = None
+_worker_timezone = None
+
+
+def read_job_flows(filename, timezone, processes=None,
+                min_parallel_bytes=MIN_PARALLEL_BYTES, offsets_dir=None):
+    """Reads the job flows in a one job flow per line history file and
+    converts their dates.
+
+    Args:
+        timezone: The timezone to give the dates, see parse_date.
+
+        processes: Number of processes to parse the file in. None uses every
+            core.
+
+        min_parallel_bytes: Files smaller than this are parsed in this
+            process.
+
+        offsets_dir: A directory to save the file's line offsets in, see
+            line_offsets.
+
+    Returns:
+        A list of job flow dicts with datetimes for their start and end
+            times, in the order of the file.
+
+    Raises:
+        ValueError: If the file isn't one JSON object per line.
+    """
+    size = os.path.getsize(filename)
+    if not size:
+        return []
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if compression_of(filename):
+        return read_compressed_job_flows(filename, timezone,
+            processes=processes, parallel=size >= min_parallel_bytes)
+
+    with open(filename, 'rb') as f:
+        file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        offsets = line_offsets(filename, file_map, offsets_dir=offsets_dir)
+        if processes == 1 or size < min_parallel_bytes:
+            return assemble_job_flows(
+                [parse_lines(mapped_lines(file_map, offsets), timezone)])
+        ranges = chunk_ranges(offsets, processes * CHUNKS_PER_PROCESS)
+    finally:
+        file_map.close()
+
+    logging.debug("Parsing %d lines of %s in %d chunks", len(offsets) - 1,
+        filename, len(ranges))
+    pool = multiprocessing.Pool(processes, _init_worker, (filename, timezone))
+    try:
+        return assemble_job_flows(pool.map(_parse_range, ranges))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_compressed_job_flows(filename, timezone, processes, parallel=True):
+    """Like read_job_flows, for a compressed file.
+
+    Args:
+        parallel: Whether to parse the blocks of lines in processes workers
+            (if more than one) rather than in this process.
+    """
+    with open_history(filename) as f:
+        if processes == 1 or not parallel:
+            return assemble_job_flows([parse_lines(f, timezone)])
+        blocks = iter(lambda: b''.join(f.readlines(BLOCK_BYTES)), b'')
+        pool = multiprocessing.Pool(processes, _init_worker,
+                                    (None, timezone))
+        try:
+            return assemble_job_flows(pool.imap(_parse_block, blocks))
+        finally:
+            pool.close()
+            pool.join()
+
+
+def line_offsets(filename, file_map, offsets_dir=None):
+    """Returns an array of the offsets the lines of the file start at,
+    followed by the file's size. Blank lines are left out.
+
+    Args:
+        offsets_dir: A directory to save the offsets in, along with the
+            file's size and modification time. They are read back from there
+            while those match. None to always find the lines.
+    """
+    stat = os.stat(filename)
+    lines_filename = None
+    if offsets_dir:
+        lines_filename = offsets_path(offsets_dir, filename)
+        offsets = _read_offsets(lines_filename, stat)
+        if offsets is not None:
+            return offsets
+
+    offsets = array.array('l')
+    start = 0
+    while start < stat.st_size:
+        end = file_map.find(b'\n', start)
+        if end == -1:
+            end = stat.st_size
+        # Only short lines can be blank, so most lines aren't copied.
+        if end - start > 2 or file_map[start:end].strip():
+            offsets.append(start)
+        start = end + 1
+    offsets.append(stat.st_size)
+
+    if lines_filename:
+        try:
+            with open(lines_filename, 'wb') as f:
+                f.write(LINES_HEADER.pack(LINES_TAG, stat.st_size,
+                                        stat.st_mtime, len(offsets),
+                                        offsets.itemsize))
+                offsets.tofile(f)
+        except IOError:
+            logging.debug("Couldn't save the line offsets of %s", filename)
+    return offsets
+
+
+def offsets_path(offsets_dir, filename):
+    """Returns where the line offsets of filename are saved in
+    offsets_dir."""
+    digest = hashlib.sha1(os.path.abspath(filename)).hexdigest()
+    return os.path.join(offsets_dir, digest + LINES_SUFFIX)
+
+
+def _read_offsets(lines_filename, stat):
+    """Returns the offsets saved in lines_filename if they are for a file
+    with stat's size and modification time, otherwise None."""
+    try:
+        with open(lines_filename, 'rb') as f:
+            tag, size, mtime, count, itemsize = LINES_HEADER.unpack(
+                f.read(LINES_HEADER.size))
+            offsets = array.array('l')
+            if (tag != LINES_TAG or itemsize != offsets.itemsize or
+                    size != stat.st_size or mtime != stat.st_mtime):
+                return None
+            offsets.fromfile(f, count)
+    except (IOError, EOFError, struct.error):
+        return None
+    return offsets
+
+
+def chunk_ranges(offsets, chunks):
+    """Splits the lines into at most chunks (start, end) byte ranges with
+    about the same number of lines each."""
+    lines = len(offsets) - 1
+    chunks = max(1, min(chunks, lines))
+    ranges = []
+    for chunk in range(chunks):
+        first = lines * chunk // chunks
+        last = lines * (chunk + 1) // chunks
+        ranges.append((offsets[first], offsets[last]))
+    return ranges
+
+
+def mapped_lines(file_map, offsets):
+    """Yields the lines of a mapped file at offsets (see line_offsets) one
+    at a time, so the file is never copied into one string."""
+    for i in xrange(len(offsets) - 1):
+        yield file_map[offsets[i]:offsets[i + 1]]
+
+
+def parse_lines(lines, timezone):
+    """Parses the job flows in an iterable of lines.
+
+    Returns:
+        The job flows as columns: (job flow ids, start times, end times,
+            number of instance groups of each job flow, instance types,
+            instance request counts). The last two have one entry per
+            instance group.
+    """
+    ids = []
+    starts = []
+    ends = []
+    group_counts = []
+    instance_types = []
+    request_counts = []
+    for line in lines:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError("Not a job flow: %s" % line[:100])
+        if not (job.get('startdatetime') and job.get('enddatetime')):
+            continue
+        # Missing keys are looked up with .get, like the simulator does.
+        ids.append(job.get('jobflowid'))
+        starts.append(parse_time(job['startdatetime'], timezone))
+        ends.append(parse_time(job['enddatetime'], timezone))
+        groups = job.get('instancegroups', [])
+        group_counts.append(len(groups))
+        for instance in groups:
+            instance_types.append(instance.get('instancetype'))
+            request_counts.append(instance.get('instancerequestcount', 0))
+    return (ids, starts, ends, group_counts, instance_types, request_counts)
+
+
+def assemble_job_flows(chunks):
+    """Turns the columns from parse_lines back into job flow dicts."""
+    job_flows = []
+    for (ids, starts, ends, group_counts, instance_types,
+            request_counts) in chunks:
+        group = 0
+        for job_id, start, end, group_count in zip(ids, starts, ends,
+                                                group_counts):
+            job_flows.append({
+                'jobflowid': job_id,
+                'startdatetime': start,
+                'enddatetime': end,
+                'instancegroups': [
+                    {'instancetype': instance_types[i],
+                    'instancerequestcount': request_counts[i]}
+                    for i in range(group, group + group_count)],
+            })
+            group += group_count
+    return job_flows
+
+
+def parse_time(text, timezone):
+    """Parses an EMR time like job_handler.parse_date does.
+
+    strptime is most of the cost of parsing a history, so the two fixed
+    width formats EMR uses are picked apart by position first.
+    """
+    if (len(text) in (20, 22, 23, 24, 25, 26, 27) and text[-1] == 'Z' and
+            text[4] == text[7] == '-' and text[10] == 'T' and
+            text[13] == text[16] == ':' and
+            (len(text) == 20 or text[19] == '.')):
+        digits = (text[0:4] + text[5:7] + text[8:10] + text[11:13] +
+                text[14:16] + text[17:19] + text[20:-1])
+        if digits.isdigit():
+            try:
+                return datetime.datetime(
+                    int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                    int(text[11:13]), int(text[14:16]), int(text[17:19]),
+                    int((text[20:-1] + '000000')[:6]), tzinfo=timezone)
+            except ValueError:
+                pass
+    for time_format in EMR_TIME_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+        return parsed.replace(tzinfo=timezone)
+    raise ValueError("Unknown time format: %s" % text)
+
+
+def _init_worker(filename, timezone):
+    """Maps filename (unless it's None, for compressed files) and keeps the
+    timezone for the worker's tasks."""
+    global _worker_map, _worker_timezone
+    if filename is not None:
+        with open(filename, 'rb') as f:
+            _worker_map = mmap.mmap(f.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+    _worker_timezone = timezone
+
+
+def _parse_range(byte_range):
+    start, end = byte_range
+    return parse_lines(_worker_map[start:end].splitlines(), _worker_timezone)
+
+
+def _parse_block(data):
+    return parse_lines(data.splitlines(), _worker_timezone)
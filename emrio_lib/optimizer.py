@@ -8,22 +8,72 @@ from math import ceil
 from ec2_cost import instance_types_in_pool
 from ec2_cost import fill_instance_types
 from simulate_jobs import Simulator
+from simulate_jobs import SimulatorStats
 
 
 class Optimizer(object):
-    def __init__(self, job_flows, EC2, job_flows_interval=None):
+    def __init__(self, job_flows, EC2, job_flows_interval=None,
+                demand_hours=None, stats=None, job_event_timeline=None,
+                hours_cache=None):
+        """
+        Args:
+            job_flows: A list of job flow dicts to optimize for.
+
+            EC2: An EC2Info object with the costs to optimize against.
+
+            job_flows_interval: The timedelta the job flows span. Calculated
+                from the job flows if None.
+
+            demand_hours: Optional dict of instance type to the hours the job
+                flows use on demand (see job_handler.calculate_demand_hours).
+                If given, instance types that can't possibly save money with
+                reserved instances are skipped without simulating.
+
+            stats: An OptimizerStats to count work in. A new one is made if
+                None.
+
+            job_event_timeline: The job flows' sorted event timeline (see
+                Simulator.sorted_job_event_timeline). Built once here if None
+                and shared by every simulation the optimizer runs.
+
+            hours_cache: Optional dict of instance type to a dict of its
+                counts (a tuple in RESERVE_PRIORITIES order) to the hours it
+                logged in each utilization class with those counts, before
+                they are made yearly. Simulations are looked up in it and
+                added to it, so it can be kept for job flows that don't
+                change and reused over a different interval. Costs are then
+                only those of the instance type being optimized.
+        """
         self.EC2 = EC2
         self.job_flows = job_flows
         self.job_flows_interval = job_flows_interval
+        self.demand_hours = demand_hours
+        self.stats = stats
+        if stats is None:
+            self.stats = OptimizerStats()
         if job_flows_interval is None:
             min_time = min(job.get('startdatetime') for job in job_flows)
             max_time = max(job.get('enddatetime') for job in job_flows)
             self.job_flows_interval = max_time - min_time
+        if job_event_timeline is None:
+            job_event_timeline = Simulator(job_flows, None,
+                                        EC2).sorted_job_event_timeline()
+        self.job_event_timeline = job_event_timeline
+        self.hours_cache = hours_cache
 
-    def run(self, pre_existing_pool=None):
+    def run(self, pre_existing_pool=None, initial_pool=None):
         """Take all the max_instance counts, then use that to hill climb to
         find the most cost efficient instance cost
 
+        Args:
+            pre_existing_pool: Instances that are already owned. The
+                optimal pool never has fewer than these.
+
+            initial_pool: A pool to start the search from instead of
+                pre_existing_pool, like the optimal pool of similar job flows.
+                Instances are taken out of it or moved between utilization
+                classes while that lowers the cost before any are added.
+
         Returns:
             optimal_pool: dict of the best pool of instances to be used.
         """
@@ -32,22 +82,84 @@ class Optimizer(object):
         else:
             optimized_pool = pre_existing_pool
 
+        floor = None
+        if initial_pool is not None:
+            floor = copy.deepcopy(optimized_pool)
+            for utilization_class in initial_pool:
+                counts = optimized_pool[utilization_class]
+                for instance_type, count in (
+                        initial_pool[utilization_class].items()):
+                    counts[instance_type] = max(count, counts[instance_type])
+
         # Zero-ing the instances just makes it so the optimized pool
         # knows all the instance_types the job flows use beforehand.
         fill_instance_types(self.job_flows, optimized_pool)
         for instance in instance_types_in_pool(optimized_pool):
+            if not self.could_save_money(instance):
+                logging.debug("Reserving %s can't save money, skipping",
+                    instance)
+                self.stats.skipped_instance_types.append(instance)
+                if floor is not None:
+                    for utilization_class in optimized_pool:
+                        optimized_pool[utilization_class][instance] = (
+                            floor[utilization_class][instance])
+                continue
             logging.debug("Finding optimal instances for %s", instance)
-            self.optimize_reserve_pool(instance, optimized_pool)
+            self.optimize_reserve_pool(instance, optimized_pool, floor=floor)
+        logging.debug("Optimizer stats: %s", self.stats.as_dict())
         return optimized_pool
 
-    def optimize_reserve_pool(self, instance_type, pool):
+    def could_save_money(self, instance_type):
+        """Uses the on demand hours to check if buying a reserved instance
+        of instance_type could ever be cheaper than running on demand.
+
+        A single reserved instance can at most cover all the hours the
+        instance type runs, so if even that doesn't make up for the upfront
+        cost for any utilization class, the optimizer won't buy any.
+
+        Returns:
+            False only if reserving can't save money. Always True when no
+            demand hours were given.
+        """
+        if self.demand_hours is None:
+            return True
+        yearly_hours = self.EC2.init_empty_all_instance_types()
+        on_demand = self.EC2.on_demand_class()
+        yearly_hours[on_demand][instance_type] = (
+            self.demand_hours.get(instance_type, 0))
+        convert_to_yearly_estimated_hours(yearly_hours,
+            self.job_flows_interval)
+        hours = yearly_hours[on_demand][instance_type]
+
+        demand_cost = self.EC2.COST[on_demand][instance_type]['hourly']
+        for utilization_class in self.EC2.RESERVE_PRIORITIES:
+            cost = self.EC2.COST[utilization_class][instance_type]
+            best_savings = hours * (demand_cost - cost['hourly']) - (
+                cost['upfront'])
+            # NaN (from infinite costs) fails this too, so it isn't skipped.
+            if not best_savings < 0:
+                return True
+        return False
+
+    def optimize_reserve_pool(self, instance_type, pool, floor=None):
         """The brute force approach will take a single instance type and
         optimize the instance pool for it. By using the job_flows in
         simulations.
 
+        Args:
+            floor: When warm starting, the pool the search can't go below.
+                Instances above it are removed or moved first while that
+                lowers the cost. None if pool is the floor.
+
         Mutates: pool
         """
-        simulator = Simulator(self.job_flows, pool, self.EC2)
+        simulator = self._simulator(pool)
+        cost_cache = {}
+        self.stats.iterations[instance_type] = 0
+        if floor is not None:
+            self._improve_initial_pool(simulator, instance_type, pool, floor,
+                cost_cache)
+
         previous_cost = float('inf')
         current_min_cost = float("inf")
         current_cost = float('inf')
@@ -55,22 +167,23 @@ class Optimizer(object):
             instance_type)
 
         # Calculate the default cost first.
-        logged_hours = simulator.run()
-        convert_to_yearly_estimated_hours(logged_hours,
-            self.job_flows_interval)
-        current_min_cost, _ = self.EC2.calculate_cost(logged_hours, pool)
+        current_min_cost = self._simulated_cost(simulator, instance_type, pool,
+            cost_cache)
         logging.debug('Current min cost: %s' % str(current_min_cost))
         current_cost = current_min_cost
         delta_reserved_hours = (
             self.delta_reserved_instance_hours_generator(instance_type, pool))
 
         while previous_cost >= current_cost:
+            self.stats.iterations[instance_type] += 1
             current_simulation_costs = (
                 self.EC2.init_reserve_costs(float('inf')))
             # Add a single instance to each utilization type, and
             # record the costs. Choose the minimum cost utilization type.
-            logging.debug("Simulation hours added %d",
-                delta_reserved_hours.next())
+            # The generator simulates, so only run it when it's logged.
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Simulation hours added %d",
+                    delta_reserved_hours.next())
             for utilization_class in pool:
                 # Reset the min instances to the best values.
                 for current_util in pool:
@@ -79,12 +192,9 @@ class Optimizer(object):
 
                 pool[utilization_class][instance_type] = (
                         current_min_instances[utilization_class] + 1)
-                logged_hours = simulator.run()
-
-                convert_to_yearly_estimated_hours(logged_hours,
-                    self.job_flows_interval)
-                cost, _ = self.EC2.calculate_cost(logged_hours, pool)
-                current_simulation_costs[utilization_class] = cost
+                current_simulation_costs[utilization_class] = (
+                    self._simulated_cost(simulator, instance_type, pool,
+                        cost_cache))
             previous_cost = current_cost
             current_cost = min(current_simulation_costs.values())
             min_util_level = None
@@ -110,23 +220,151 @@ class Optimizer(object):
             pool[utilization_class][instance_type] = (
                     current_min_instances[utilization_class])
 
+    def _improve_initial_pool(self, simulator, instance_type, pool, floor,
+                            cost_cache):
+        """Hill climbs down from a warm start pool. Each step takes a single
+        instance of instance_type out of the pool or moves it to another
+        utilization class, whichever lowers the cost the most, until no step
+        lowers the cost. Instances in the floor aren't taken out or moved.
+
+        Mutates: pool
+        """
+        current_cost = self._simulated_cost(simulator, instance_type, pool,
+            cost_cache)
+        while True:
+            self.stats.iterations[instance_type] += 1
+            best_cost, best_move = current_cost, None
+            for from_class in self.EC2.RESERVE_PRIORITIES:
+                if pool[from_class][instance_type] <= (
+                        floor[from_class][instance_type]):
+                    continue
+                # None takes the instance out of the pool.
+                for to_class in [None] + self.EC2.RESERVE_PRIORITIES:
+                    if to_class == from_class:
+                        continue
+                    self._move_instance(pool, instance_type, from_class,
+                        to_class)
+                    cost = self._simulated_cost(simulator, instance_type,
+                        pool, cost_cache)
+                    self._move_instance(pool, instance_type, to_class,
+                        from_class)
+                    if cost < best_cost:
+                        best_cost, best_move = cost, (from_class, to_class)
+            if best_move is None:
+                return
+            self._move_instance(pool, instance_type, *best_move)
+            current_cost = best_cost
+
+    def _move_instance(self, pool, instance_type, from_class, to_class):
+        """Moves one instance between utilization classes, where None is
+        outside of the pool."""
+        if from_class is not None:
+            pool[from_class][instance_type] -= 1
+        if to_class is not None:
+            pool[to_class][instance_type] += 1
+
+    def _simulator(self, pool):
+        """Makes a Simulator that counts its work in the optimizer's stats."""
+        simulator = Simulator(self.job_flows, pool, self.EC2,
+                            job_event_timeline=self.job_event_timeline)
+        simulator.stats = self.stats.simulator
+        return simulator
+
+    def _simulated_cost(self, simulator, instance_type, pool, cost_cache):
+        """Simulates the pool and returns its yearly cost.
+
+        Only instance_type's counts change while it is being optimized, so
+        they are enough to key cost_cache on, which avoids simulating the
+        same pool twice.
+        """
+        counts = tuple(pool[utilization_class][instance_type]
+                    for utilization_class in self.EC2.RESERVE_PRIORITIES)
+        if counts in cost_cache:
+            self.stats.cache_hits += 1
+            return cost_cache[counts]
+
+        if self.hours_cache is None:
+            self.stats.simulations_run += 1
+            logged_hours = simulator.run()
+            convert_to_yearly_estimated_hours(logged_hours,
+                self.job_flows_interval)
+            cost, _ = self.EC2.calculate_cost(logged_hours, pool)
+            cost_cache[counts] = cost
+            return cost
+
+        type_hours_cache = self.hours_cache.setdefault(instance_type, {})
+        if counts in type_hours_cache:
+            self.stats.cache_hits += 1
+        else:
+            self.stats.simulations_run += 1
+            logged_hours = simulator.run()
+            type_hours_cache[counts] = dict(
+                (utilization_class, logged_hours[utilization_class].get(
+                    instance_type, 0))
+                for utilization_class in logged_hours)
+        cost = self._instance_type_cost(instance_type, counts,
+            type_hours_cache[counts])
+        cost_cache[counts] = cost
+        return cost
+
+    def _instance_type_cost(self, instance_type, counts, hours):
+        """Returns the yearly cost of instance_type alone, from its counts
+        and the hours it logged in each utilization class."""
+        logged_hours = dict(
+            (utilization_class, {instance_type: class_hours})
+            for utilization_class, class_hours in hours.items())
+        convert_to_yearly_estimated_hours(logged_hours,
+            self.job_flows_interval)
+        pool = dict((utilization_class, {instance_type: count})
+                    for utilization_class, count in zip(
+                        self.EC2.RESERVE_PRIORITIES, counts))
+        cost, _ = self.EC2.calculate_cost(logged_hours, pool)
+        return cost
+
     def delta_reserved_instance_hours_generator(self, instance_type, pool):
 
         starter_pool = copy.deepcopy(pool)
         assert(len(self.EC2.RESERVE_PRIORITIES) > 0)
         highest_util = self.EC2.RESERVE_PRIORITIES[0]
-        iterative_simulator = Simulator(self.job_flows, starter_pool, self.EC2)
+        iterative_simulator = self._simulator(starter_pool)
+        self.stats.simulations_run += 1
         previous_logged_hours = iterative_simulator.run()
         previous_hours = previous_logged_hours[highest_util][instance_type]
 
         while True:
             starter_pool[highest_util][instance_type] += 1
+            self.stats.simulations_run += 1
             current_logged_hours = iterative_simulator.run()
             current_hours = current_logged_hours[highest_util][instance_type]
             yield (current_hours - previous_hours)
             previous_hours = current_hours
 
 
+class OptimizerStats(object):
+    """Counts the work an Optimizer does.
+
+    simulations_run includes the simulations done to log the reserved hours
+    each iteration adds. simulator holds the counts of all the simulators the
+    optimizer ran.
+    """
+    def __init__(self):
+        self.simulations_run = 0
+        self.cache_hits = 0
+        # Instance type to the amount of hill climbing iterations it took.
+        self.iterations = {}
+        self.skipped_instance_types = []
+        self.simulator = SimulatorStats()
+
+    def as_dict(self):
+        return {
+            'simulations_run': self.simulations_run,
+            'cache_hits': self.cache_hits,
+            'iterations': dict(self.iterations),
+            'skipped_instance_types': list(self.skipped_instance_types),
+            'simulator': self.simulator.as_dict(),
+        }
+
+
 def convert_to_yearly_estimated_hours(logged_hours, interval):
     """Takes a min and max time and will convert to the amount of hours
     estimated for a year.
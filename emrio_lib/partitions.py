@@ -0,0 +1,198 @@
+"""Job flow histories split into a directory of daily or weekly partitions.
+
+With one history file, every --min-day/--max-day run reads the whole
+history. A partitioned history keeps the job flows in one file per day (or
+week) they started on, one job flow per line, next to a manifest
+(manifest.json) with each partition's row count and the earliest and latest
+start and end times in it. Reading a date range only opens the partitions
+whose times can overlap it.
+
+A job flow is kept only in the partition of the day it started on, however
+long it runs, so it is never read twice. Since a job flow in the range has
+to start and end within it, a partition is read if its start times reach
+into the range and its earliest end is before the end of the range.
+Job flows that haven't started yet are kept in an undated partition, which
+is only read without --min-day and --max-day, and are moved out when they
+start.
+
+Times are compared in job_store's format, like in the job flow store.
+"""
+import datetime
+import hashlib
+import json
+import os
+
+from job_store import day_to_time
+from job_store import normalize_time
+from job_store import TIME_FORMAT
+
+DAY = 'day'
+WEEK = 'week'
+PERIODS = (DAY, WEEK)
+MANIFEST_FILENAME = 'manifest.json'
+UNDATED = 'undated'
+PARTITION_EXTENSION = '.json'
+
+
+def is_partitioned_history(path):
+    """Returns whether path is a partitioned history directory."""
+    return os.path.isfile(manifest_path(path))
+
+
+def manifest_path(directory):
+    return os.path.join(directory, MANIFEST_FILENAME)
+
+
+class PartitionedHistory(object):
+
+    def __init__(self, directory, period=None):
+        """Opens the partitioned history in directory, creating it if
+        needed.
+
+        Args:
+            period: DAY or WEEK. Needed to create a history. An existing
+                history keeps its period, and asking for another one is an
+                error.
+        """
+        self.directory = directory
+        if is_partitioned_history(directory):
+            with open(manifest_path(directory)) as f:
+                manifest = json.load(f)
+            if period and period != manifest['period']:
+                raise ValueError("%s is partitioned by %s, not %s" %
+                    (directory, manifest['period'], period))
+            self.period = manifest['period']
+            self.partitions = manifest['partitions']
+        else:
+            if period not in PERIODS:
+                raise ValueError("A partitioned history needs a period, one"
+                    " of %s" % ', '.join(PERIODS))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.period = period
+            # Partition key to its row count, file and time bounds.
+            self.partitions = {}
+
+    def __len__(self):
+        return sum(partition['rows'] for partition in
+                self.partitions.values())
+
+    def partition_key(self, job):
+        """Returns the key of the partition job belongs in: the day (or
+        Monday of the week) it started, as '%Y-%m-%d'."""
+        start = normalize_time(job.get('startdatetime'))
+        if start is None:
+            return UNDATED
+        day = datetime.datetime.strptime(start, TIME_FORMAT).date()
+        if self.period == WEEK:
+            day -= datetime.timedelta(day.weekday())
+        return day.strftime('%Y-%m-%d')
+
+    def upsert(self, job_flows):
+        """Adds job flows to the history, replacing any with the same ids.
+        Only the partitions the job flows go in (and the undated one) are
+        rewritten.
+
+        Returns:
+            The number of job flows upserted.
+        """
+        new_by_key = {}
+        job_ids = set()
+        for job in job_flows:
+            new_by_key.setdefault(self.partition_key(job), []).append(job)
+            job_ids.add(job['jobflowid'])
+
+        keys = set(new_by_key)
+        if UNDATED in self.partitions:
+            # Job flows that have started since leave the undated partition.
+            keys.add(UNDATED)
+        for key in sorted(keys):
+            jobs_by_id = {}
+            for job in self._read_partition(key):
+                if key != UNDATED or job['jobflowid'] not in job_ids:
+                    jobs_by_id[job['jobflowid']] = job
+            for job in new_by_key.get(key, []):
+                jobs_by_id[job['jobflowid']] = job
+            self._write_partition(key, sorted(
+                jobs_by_id.values(),
+                key=lambda job: (normalize_time(job.get('startdatetime')),
+                                job['jobflowid'])))
+        self._write_manifest()
+        return len(job_ids)
+
+    def query(self, min_day=None, max_day=None):
+        """Returns the job flows that start on or after min_day and end on
+        or before max_day, reading only the partitions that can hold them.
+        See JobFlowStore.query, which this matches."""
+        min_time = min_day and day_to_time(min_day)
+        max_time = max_day and day_to_time(max_day)
+        job_flows = []
+        for key in self.overlapping_partitions(min_time, max_time):
+            for job in self._read_partition(key):
+                start = normalize_time(job.get('startdatetime'))
+                end = normalize_time(job.get('enddatetime'))
+                if min_time and (start is None or start < min_time):
+                    continue
+                if max_time and (end is None or end > max_time):
+                    continue
+                job_flows.append(job)
+        return job_flows
+
+    def overlapping_partitions(self, min_time=None, max_time=None):
+        """Returns the sorted keys of the partitions that can have job flows
+        starting at or after min_time and ending at or before max_time
+        (times in TIME_FORMAT, None for no limit)."""
+        keys = []
+        for key, partition in sorted(self.partitions.items()):
+            if key == UNDATED:
+                # Without a start (or end) time, they're out of any range.
+                if min_time is None and max_time is None:
+                    keys.append(key)
+                continue
+            if min_time and partition['max_start'] < min_time:
+                continue
+            if max_time and (partition['min_end'] is None or
+                            partition['min_end'] > max_time):
+                continue
+            keys.append(key)
+        return keys
+
+    def _partition_path(self, key):
+        return os.path.join(self.directory, key + PARTITION_EXTENSION)
+
+    def _read_partition(self, key):
+        if key not in self.partitions:
+            return []
+        with open(self._partition_path(key)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _write_partition(self, key, job_flows):
+        """Writes a partition and its manifest entry."""
+        lines = [json.dumps(job, sort_keys=True) + '\n' for job in job_flows]
+        path = self._partition_path(key)
+        with open(path + '.tmp', 'w') as f:
+            f.writelines(lines)
+        os.rename(path + '.tmp', path)
+
+        starts = [normalize_time(job.get('startdatetime'))
+                for job in job_flows if job.get('startdatetime')]
+        ends = [normalize_time(job.get('enddatetime'))
+                for job in job_flows if job.get('enddatetime')]
+        self.partitions[key] = {
+            'filename': os.path.basename(path),
+            'rows': len(job_flows),
+            'min_start': min(starts) if starts else None,
+            'max_start': max(starts) if starts else None,
+            'min_end': min(ends) if ends else None,
+            'max_end': max(ends) if ends else None,
+            # Changes whenever the partition does, so the manifest can stand
+            # for the history in the stage cache.
+            'sha1': hashlib.sha1(''.join(lines)).hexdigest(),
+        }
+
+    def _write_manifest(self):
+        path = manifest_path(self.directory)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'period': self.period, 'partitions': self.partitions},
+                    f, indent=2, sort_keys=True)
+        os.rename(path + '.tmp', path)
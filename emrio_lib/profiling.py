@@ -0,0 +1,98 @@
+"""Per-stage timing for the EMRio pipeline.
+
+StageProfiler records the wall time, CPU time and peak resident memory of each
+stage of a run (fetching job flows, optimizing, simulating, ...) so slow runs
+can be pinned on a stage. The operating system only keeps the peak memory of
+the whole process, so each stage records the peak so far and how much the
+stage raised it. It can also run cProfile over each stage and dump
+the stats to a file per stage, to be read with pstats.
+"""
+import cProfile
+import os
+import time
+from contextlib import contextmanager
+
+
+class StageProfiler(object):
+
+    def __init__(self, enabled=False, profile_dir=None):
+        """
+        Args:
+            enabled: Record stages. When False, stage() does nothing.
+
+            profile_dir: If set, also cProfile every stage and dump the stats
+                into this directory as STAGE.pstats.
+        """
+        self.enabled = enabled or profile_dir is not None
+        self.profile_dir = profile_dir
+        self.stages = []
+        if profile_dir and not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager that records the stage run inside it."""
+        if not self.enabled:
+            yield
+            return
+
+        profile = None
+        if self.profile_dir:
+            profile = cProfile.Profile()
+        start_time = time.time()
+        start_cpu = sum(os.times()[:2])
+        start_peak_rss = peak_rss_kb()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            peak_rss = peak_rss_kb()
+            self.stages.append({
+                'stage': name,
+                'wall_seconds': time.time() - start_time,
+                'cpu_seconds': sum(os.times()[:2]) - start_cpu,
+                # The process' peak so far, not the stage's own.
+                'peak_rss_kb': peak_rss,
+                'peak_rss_growth_kb': (peak_rss - start_peak_rss
+                                    if peak_rss is not None else None),
+            })
+            if profile:
+                profile.dump_stats(
+                    os.path.join(self.profile_dir, name + '.pstats'))
+
+    def report(self, out):
+        """Writes a table of the recorded stages to a file object."""
+        out.write("%-15s %12s %12s %18s %14s\n" % (
+            'Stage', 'Wall (s)', 'CPU (s)', 'Peak so far (MB)',
+            'Raised (MB)'))
+        for stage in self.stages:
+            out.write("%-15s %12.3f %12.3f %18s %14s\n" % (
+                stage['stage'], stage['wall_seconds'], stage['cpu_seconds'],
+                _megabytes(stage['peak_rss_kb']),
+                _megabytes(stage['peak_rss_growth_kb'])))
+        out.write("%-15s %12.3f %12.3f\n" % ('total',
+            sum(stage['wall_seconds'] for stage in self.stages),
+            sum(stage['cpu_seconds'] for stage in self.stages)))
+
+
+def peak_rss_kb():
+    """Returns the peak resident memory of this process so far in kilobytes,
+    or None where the resource module isn't available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X reports bytes.
+    if os.uname()[0] == 'Darwin':
+        peak_rss /= 1024
+    return peak_rss
+
+
+def _megabytes(kilobytes):
+    if kilobytes is None:
+        return '-'
+    return '%.1f' % (kilobytes / 1024.0)
@@ -0,0 +1,313 @@
+"""A long running EMRio process that answers what-if questions over HTTP.
+
+`emrio serve --file HISTORY` loads the job flow history once, keeps it and its
+on demand hours in memory and answers JSON requests on a local socket, so
+trying out different date ranges, price files and pools doesn't pay for
+startup and ingest every time. When the history file is appended to (for
+example by a cron job running --dump-jobs), only the new lines are read.
+
+Requests are POSTed as JSON objects. All of them accept:
+
+    instance_costs: Price file to use. Defaults to the --instance-cost the
+        server was started with.
+    min_day, max_day: Date filters, same format as --min-day and --max-day.
+
+/evaluate takes a pool and returns the report (pools, yearly hours, costs)
+    for it.
+/optimize returns the optimal pool. Takes an optional pre_existing_pool.
+/report does an /optimize and returns the full report for the pool.
+
+In the reports, owned instances are taken from an optional owned pool in the
+request rather than fetched from Amazon. GET /status describes the loaded
+history.
+"""
+import BaseHTTPServer
+import json
+import logging
+import os
+from collections import defaultdict
+
+from compression import compression_of
+from ec2_cost import EC2Info
+from EMRio import build_report
+from EMRio import simulate_job_flows
+from job_handler import calculate_demand_hours
+from job_handler import convert_dates
+from job_handler import load_job_flows_from_file
+from job_handler import no_date_filter
+from job_handler import range_date_filter
+from job_index import JobFlowIndex
+from job_store import is_job_flow_store
+from optimizer import Optimizer
+from partitions import is_partitioned_history
+
+# How much of the already read history is compared on refresh to check the
+# file was appended to rather than rewritten.
+TAIL_BYTES = 4096
+
+class JobFlowHistory(object):
+    """A job flow history file kept in memory along with its on demand
+    hours, which picks up lines appended to the file without reloading it.
+    """
+
+    def __init__(self, filename, timezone):
+        self.filename = filename
+        self.timezone = timezone
+        self.reload()
+
+    def reload(self):
+        """Reads the whole history file."""
+        stat = os.stat(self.filename)
+        self.compressed = compression_of(self.filename) is not None
+        self.jobs_by_id = {}
+        self.demand_hours = defaultdict(int)
+        self._index = None
+        self._add_jobs(load_job_flows_from_file(self.filename))
+        self._offset = stat.st_size
+        self._inode = stat.st_ino
+        self._mtime = stat.st_mtime
+        self._tail = self._read_tail()
+        logging.info("Loaded %d job flows from %s", len(self.jobs_by_id),
+            self.filename)
+
+    def refresh(self):
+        """Picks up changes to the history file.
+
+        If lines were only appended, just the new lines are read. If it was
+        replaced, truncated or rewritten (--dump-jobs rewrites the whole
+        file), it is reloaded. Compressed files are always reloaded.
+
+        Returns:
+            True if anything changed.
+        """
+        stat = os.stat(self.filename)
+        if stat.st_size == self._offset and stat.st_mtime == self._mtime:
+            return False
+        if (self.compressed or stat.st_ino != self._inode or
+                stat.st_size < self._offset or
+                self._read_tail() != self._tail):
+            self.reload()
+            return True
+
+        with open(self.filename, 'r') as f:
+            f.seek(self._offset)
+            new_data = f.read(stat.st_size - self._offset)
+        # Leave a partly written last line for the next refresh.
+        complete = new_data[:new_data.rfind('\n') + 1]
+        try:
+            raw_jobs = [json.loads(line) for line in complete.splitlines()
+                        if line.strip()]
+        except ValueError:
+            # Not the one job per line format, read it the slow way.
+            self.reload()
+            return True
+        self._add_jobs(raw_jobs)
+        self._offset += len(complete)
+        self._mtime = stat.st_mtime
+        self._tail = self._read_tail()
+        logging.info("Read %d new job flows from %s", len(raw_jobs),
+            self.filename)
+        return True
+
+    def job_flows(self):
+        """Returns all the job flows sorted by start time."""
+        return self.index().job_flows
+
+    def index(self):
+        """Returns a JobFlowIndex of all the job flows, built again only
+        after the history changes."""
+        if self._index is None:
+            self._index = JobFlowIndex(self.jobs_by_id.values())
+        return self._index
+
+    def _read_tail(self):
+        """Returns the bytes just before the read offset, used to tell an
+        appended file from a rewritten one."""
+        start = max(self._offset - TAIL_BYTES, 0)
+        with open(self.filename, 'r') as f:
+            f.seek(start)
+            return f.read(self._offset - start)
+
+    def _add_jobs(self, raw_jobs):
+        """Adds jobs with string dates, replacing any with the same id."""
+        job_flows = convert_dates(no_date_filter(raw_jobs), self.timezone)
+        for job in job_flows:
+            old_job = self.jobs_by_id.get(job['jobflowid'])
+            if old_job is not None:
+                self._update_demand_hours(old_job, -1)
+            self.jobs_by_id[job['jobflowid']] = job
+            self._update_demand_hours(job, 1)
+        if job_flows:
+            self._index = None
+
+    def _update_demand_hours(self, job, sign):
+        for instance_type, hours in calculate_demand_hours([job]).items():
+            self.demand_hours[instance_type] += sign * hours
+
+
+class EMRioServer(BaseHTTPServer.HTTPServer):
+    """Holds the state shared by all requests."""
+
+    def __init__(self, address, history, default_instance_costs):
+        BaseHTTPServer.HTTPServer.__init__(self, address, EMRioRequestHandler)
+        self.history = history
+        self.default_instance_costs = default_instance_costs
+        self.ec2_infos = {}
+
+    def ec2_info(self, filename):
+        """Returns the EC2Info for a price file, parsing it again only after
+        it changes.
+
+        Raises:
+            ValueError: If the price file can't be read.
+        """
+        try:
+            key = (filename, os.path.getmtime(filename))
+        except OSError:
+            raise ValueError("Can't read price file %s" % filename)
+        if key not in self.ec2_infos:
+            try:
+                EC2 = EC2Info(filename)
+            except Exception, ex:
+                # EC2Info raises a bare Exception for a bad price file.
+                raise ValueError(str(ex))
+            # Forget older versions of the file.
+            for old_key in [old_key for old_key in self.ec2_infos
+                            if old_key[0] == filename]:
+                del self.ec2_infos[old_key]
+            self.ec2_infos[key] = EC2
+        return self.ec2_infos[key]
+
+    def evaluate(self, request):
+        job_flows, demand_hours, EC2 = self._setup(request)
+        pool = read_pool(request.get('pool', {}), EC2)
+        return self._report(job_flows, demand_hours, pool, EC2, request)
+
+    def optimize(self, request):
+        job_flows, demand_hours, EC2 = self._setup(request)
+        pool = self._optimize(job_flows, demand_hours, EC2, request)
+        return {'pool': pool}
+
+    def report(self, request):
+        job_flows, demand_hours, EC2 = self._setup(request)
+        pool = self._optimize(job_flows, demand_hours, EC2, request)
+        return self._report(job_flows, demand_hours, pool, EC2, request)
+
+    def status(self):
+        index = self.history.index()
+        status = {'job_flows': len(index),
+                'history_file': self.history.filename}
+        if len(index):
+            status['first_start'] = str(index.begin_time)
+            status['last_end'] = str(index.end_time)
+        return status
+
+    def _setup(self, request):
+        """Returns the job flows and demand hours for the request's date
+        range and the EC2Info for its price file."""
+        self.history.refresh()
+        EC2 = self.ec2_info(request.get('instance_costs',
+                                        self.default_instance_costs))
+        job_flows = self.history.job_flows()
+        demand_hours = self.history.demand_hours
+        min_day = request.get('min_day')
+        max_day = request.get('max_day')
+        if min_day or max_day:
+            job_flows = range_date_filter(job_flows, min_day, max_day,
+                self.history.timezone, job_flows_index=self.history.index())
+            demand_hours = calculate_demand_hours(job_flows)
+        if not job_flows:
+            raise ValueError("No job flows in the requested range")
+        return job_flows, demand_hours, EC2
+
+    def _optimize(self, job_flows, demand_hours, EC2, request):
+        pre_existing_pool = read_pool(request.get('pre_existing_pool', {}),
+                                    EC2)
+        return Optimizer(job_flows, EC2, demand_hours=demand_hours).run(
+            pre_existing_pool=pre_existing_pool)
+
+    def _report(self, job_flows, demand_hours, pool, EC2, request):
+        optimal_logged_hours, demand_logged_hours = simulate_job_flows(
+            job_flows, pool, EC2, demand_hours=demand_hours)
+        owned = read_pool(request.get('owned', {}), EC2)
+        return build_report(optimal_logged_hours, pool, demand_logged_hours,
+                            EC2, owned_reserved_instances=owned)
+
+
+class EMRioRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    POST_ROUTES = {
+        '/evaluate': EMRioServer.evaluate,
+        '/optimize': EMRioServer.optimize,
+        '/report': EMRioServer.report,
+    }
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._respond(200, self.server.status())
+        else:
+            self._respond(404, {'error': 'Unknown path %s' % self.path})
+
+    def do_POST(self):
+        route = self.POST_ROUTES.get(self.path)
+        if route is None:
+            self._respond(404, {'error': 'Unknown path %s' % self.path})
+            return
+        try:
+            length = int(self.headers.getheader('content-length') or 0)
+            request = json.loads(self.rfile.read(length) or '{}')
+            if not isinstance(request, dict):
+                raise ValueError("Requests must be JSON objects")
+            response = route(self.server, request)
+        except (ValueError, KeyError, TypeError), ex:
+            self._respond(400, {'error': str(ex)})
+            return
+        except Exception, ex:
+            logging.exception("Error answering %s", self.path)
+            self._respond(500, {'error': str(ex)})
+            return
+        self._respond(200, response)
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+    def _respond(self, code, body):
+        encoded = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+def read_pool(pool_dict, EC2):
+    """Turns a pool from a request into a full pool with every reserved
+    utilization class."""
+    pool = EC2.init_empty_reserve_pool()
+    for utilization_class in pool_dict:
+        if utilization_class not in pool:
+            raise ValueError("Unknown utilization class: %s" %
+                utilization_class)
+        pool[utilization_class].update(pool_dict[utilization_class])
+    return pool
+
+
+def serve(options, timezone):
+    """Loads the history in options.file_inputs and serves requests until
+    interrupted."""
+    if not options.file_inputs:
+        raise ValueError("emrio serve needs a history file (--file)")
+    if (is_job_flow_store(options.file_inputs) or
+            is_partitioned_history(options.file_inputs)):
+        raise ValueError("emrio serve needs a JSON history file, not a job"
+            " flow store or partitioned history")
+    history = JobFlowHistory(options.file_inputs, timezone)
+    server = EMRioServer((options.host, options.port), history,
+                        options.instance_costs)
+    logging.info("Serving on http://%s:%d", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
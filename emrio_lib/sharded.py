@@ -0,0 +1,269 @@
+"""Simulating a long job flow history in parallel, a window of time at a time.
+
+The event timeline is cut into shards that span the same amount of time, and
+each shard is simulated in a worker process. A shard can't know which
+reserved instances its running jobs held at its start without simulating
+everything before it, so each worker guesses: it allocates the jobs that were
+running a little before the shard starts (the overlap) in the order they
+started, then replays the overlap's events without logging their hours to
+settle the allocations. Every running job is rearranged at least once an
+hour, so an hour of overlap settles most boundaries.
+
+The shards are then stitched together in order. If the state a shard was
+seeded with is the same as the state the shard before it ended in, its hours
+are exactly what a serial simulation would have logged. If not, the shard is
+simulated again from the right state until its allocations agree with one of
+the checkpoints the worker recorded along the way, and the worker's hours are
+used from there on. The merged hours always match Simulator.run.
+"""
+import bisect
+import datetime
+import logging
+import multiprocessing
+from collections import OrderedDict
+
+from simulate_jobs import END
+from simulate_jobs import Simulator
+from simulate_jobs import START
+
+DEFAULT_OVERLAP = datetime.timedelta(0, 3600)
+DEFAULT_CHECKPOINTS = 16
+
+# Set in each worker process by _init_worker.
+_worker_pool = None
+_worker_EC2 = None
+_worker_checkpoints = None
+
+
+class ShardedSimulator(Simulator):
+    """A Simulator that splits its run into time shards simulated in
+    parallel.
+
+    Observers need every event in order, so if any are attached run
+    simulates serially.
+    """
+
+    def __init__(self, job_flows, pool, EC2, job_event_timeline=None,
+                shards=None, overlap=DEFAULT_OVERLAP,
+                checkpoints=DEFAULT_CHECKPOINTS, processes=None):
+        """
+        Args:
+            shards: Number of time shards to cut the timeline into. Defaults
+                to the number of processes.
+
+            overlap: timedelta of events before each shard replayed to
+                settle the running jobs' allocations.
+
+            checkpoints: Number of times during each shard to record its
+                allocations, so a wrongly seeded shard only has to be
+                simulated again until it agrees with one of them.
+
+            processes: Number of processes to simulate shards in. Defaults
+                to the number of cores.
+        """
+        Simulator.__init__(self, job_flows, pool, EC2,
+                        job_event_timeline=job_event_timeline)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.shards = shards or processes
+        self.overlap = overlap
+        self.checkpoints = checkpoints
+        # How many events of wrongly seeded shards had to be simulated again
+        # on the last run.
+        self.resimulated_events = 0
+
+    def run(self):
+        """Same as Simulator.run, but simulates shards in parallel."""
+        if self.log_observers or self.use_pool_observers:
+            return Simulator.run(self)
+
+        if self.job_event_timeline is not None:
+            job_event_timeline = self.job_event_timeline
+        else:
+            job_event_timeline = self.sorted_job_event_timeline()
+        self.stats.runs += 1
+        self.stats.peak_heap_size = max(self.stats.peak_heap_size,
+                                        len(job_event_timeline))
+
+        tasks = shard_tasks(job_event_timeline, self.shards, self.overlap)
+        worker_args = (self.pool, self.EC2, self.checkpoints)
+        logging.info("Simulating %d events in %d shards",
+            len(job_event_timeline), len(tasks))
+        if self.processes == 1 or len(tasks) <= 1:
+            _init_worker(*worker_args)
+            results = map(simulate_shard, tasks)
+        else:
+            pool = multiprocessing.Pool(min(self.processes, len(tasks)),
+                                        _init_worker, worker_args)
+            try:
+                results = pool.map(simulate_shard, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        return self.stitch(tasks, results)
+
+    def stitch(self, tasks, results):
+        """Merges the shards' hours in order, simulating again the start of
+        any shard that was seeded wrong.
+
+        Simulating again only goes as far as the first of the shard's
+        checkpoints whose allocations match, since from there on the
+        shard's events were simulated from the right state.
+
+        Args:
+            tasks: The shards' tasks from shard_tasks.
+
+            results: The shards' results from simulate_shard.
+
+        Returns:
+            logged_hours: The same hours Simulator.run would log.
+        """
+        logged_hours = self.EC2.init_empty_all_instance_types()
+        self.resimulated_events = 0
+        jobs_running, pool_used = {}, self.EC2.init_empty_all_instance_types()
+        for (_, _, events), result in zip(tasks, results):
+            shard_hours, checkpoints, end_jobs, end_pool_used, stats = result
+            self.stats.merge(stats)
+            position = 0
+            for index, checkpoint_jobs, checkpoint_hours in checkpoints:
+                self.simulate_events(events[position:index], logged_hours,
+                                    jobs_running, pool_used)
+                self.resimulated_events += index - position
+                position = index
+                if checkpoint_jobs == allocations(jobs_running):
+                    add_logged_hours(logged_hours, shard_hours)
+                    add_logged_hours(logged_hours, checkpoint_hours, -1)
+                    jobs_running, pool_used = end_jobs, end_pool_used
+                    break
+            else:
+                self.simulate_events(events[position:], logged_hours,
+                                    jobs_running, pool_used)
+                self.resimulated_events += len(events) - position
+
+        if self.resimulated_events:
+            logging.info("Simulated %d events again to stitch the shards",
+                self.resimulated_events)
+        return logged_hours
+
+
+def shard_tasks(job_event_timeline, shards, overlap):
+    """Cuts a sorted event timeline into shards spanning the same amount of
+    time.
+
+    Events at the same time are always in the same shard. Shards without any
+    events are left out.
+
+    Returns:
+        A list of (seed_jobs, settle_events, events) for each shard.
+            seed_jobs are the jobs running when settle_events start, in the
+            order they started. settle_events are the events in the overlap
+            before the shard and events are the shard's own events. The first
+            shard doesn't need settling, so it has neither.
+    """
+    if not job_event_timeline:
+        return []
+    times = [event[0] for event in job_event_timeline]
+    first, last = times[0], times[-1]
+    span = (last - first) / max(shards, 1)
+    starts = [0]
+    for i in range(1, shards):
+        start = bisect.bisect_left(times, first + i * span)
+        if starts[-1] < start < len(times):
+            starts.append(start)
+    ends = starts[1:] + [len(times)]
+
+    # The jobs running at the start of each shard's overlap.
+    settle_starts = [bisect.bisect_left(times, times[start] - overlap)
+                    for start in starts]
+    seeds = {}
+    running = OrderedDict()
+    wanted = sorted(set(settle_starts))
+    w = 0
+    for i, (time, event_type, job) in enumerate(job_event_timeline):
+        while w < len(wanted) and wanted[w] == i:
+            seeds[i] = list(running.values())
+            w += 1
+        if w == len(wanted):
+            break
+        if event_type is START:
+            running[job.get('jobflowid')] = job
+        elif event_type is END:
+            running.pop(job.get('jobflowid'), None)
+
+    tasks = [([], [], job_event_timeline[starts[0]:ends[0]])]
+    for start, end, settle_start in zip(starts[1:], ends[1:],
+                                        settle_starts[1:]):
+        tasks.append((seeds[settle_start],
+                    job_event_timeline[settle_start:start],
+                    job_event_timeline[start:end]))
+    return tasks
+
+
+def _init_worker(pool, EC2, checkpoints):
+    global _worker_pool, _worker_EC2, _worker_checkpoints
+    _worker_pool = pool
+    _worker_EC2 = EC2
+    _worker_checkpoints = checkpoints
+
+
+def simulate_shard(task):
+    """Simulates a shard in a worker from its guessed starting state.
+
+    Returns:
+        (logged_hours, checkpoints, jobs_running, pool_used, stats):
+            The shard's hours, its checkpoints, the jobs running and pool
+            used at its end and the Simulator's stats. checkpoints is a list
+            of (index, allocations, logged_hours) with the allocations and
+            hours logged before the event at index, starting with the seeded
+            state at index 0.
+    """
+    seed_jobs, settle_events, events = task
+    EC2 = _worker_EC2
+    simulator = Simulator(None, _worker_pool, EC2)
+    jobs_running = {}
+    pool_used = EC2.init_empty_all_instance_types()
+    for job in seed_jobs:
+        simulator.allocate_job(jobs_running, pool_used, job)
+    simulator.simulate_events(settle_events,
+                            EC2.init_empty_all_instance_types(),
+                            jobs_running, pool_used)
+
+    logged_hours = EC2.init_empty_all_instance_types()
+    checkpoints = []
+    step = max(-(-len(events) // max(_worker_checkpoints, 1)), 1)
+    for index in range(0, len(events), step):
+        checkpoint_hours = EC2.init_empty_all_instance_types()
+        add_logged_hours(checkpoint_hours, logged_hours)
+        checkpoints.append((index, allocations(jobs_running),
+                            checkpoint_hours))
+        simulator.simulate_events(events[index:index + step], logged_hours,
+                                jobs_running, pool_used)
+    return (logged_hours, checkpoints, jobs_running, pool_used,
+            simulator.stats)
+
+
+def allocations(jobs_running):
+    """Returns the instances each running job uses, without empty entries,
+    so the states of two simulations can be compared."""
+    result = {}
+    for job_id, job_instances in jobs_running.items():
+        result[job_id] = {}
+        for utilization_class, instances in job_instances.items():
+            used = dict((instance_type, count)
+                        for instance_type, count in instances.items()
+                        if count)
+            if used:
+                result[job_id][utilization_class] = used
+    return result
+
+
+def add_logged_hours(logged_hours, other, sign=1):
+    """Adds the hours in other to logged_hours, or subtracts them if sign is
+    -1."""
+    for utilization_class, hours in other.items():
+        for instance_type, count in hours.items():
+            logged_hours[utilization_class][instance_type] = (
+                logged_hours[utilization_class].get(instance_type, 0) +
+                sign * count)
@@ -28,7 +28,9 @@ JOB_ID is the id for the job running. The rest is setup like logs and pool.
         It is used to keep track of what the job is currently using in
         instances.
 """
+import calendar
 import datetime
+from array import array
 from collections import defaultdict
 from heapq import heapify, heappop
 
@@ -42,12 +44,20 @@ END = 0
 
 class Simulator:
 
-    def __init__(self, job_flows, pool, EC2):
+    def __init__(self, job_flows, pool, EC2, job_event_timeline=None):
+        """
+        Args:
+            job_event_timeline: The job flows' events from
+                sorted_job_event_timeline, to share one timeline between
+                simulators of different pools. Built on each run if None.
+        """
         self.pool = pool
         self.job_flows = job_flows
+        self.job_event_timeline = job_event_timeline
         self.log_observers = []
         self.use_pool_observers = []
         self.EC2 = EC2
+        self.stats = SimulatorStats()
 
     def run(self):
         """Will simulate a job flow using a reserved instance pool.
@@ -71,25 +81,70 @@ class Simulator:
                 types and utilization levels.
         """
         # Setup the queue, state variables and logger.
-        job_event_timeline = self.setup_job_event_timeline()
+        if self.job_event_timeline is not None:
+            job_event_timeline = self.job_event_timeline
+        else:
+            job_event_timeline = self.setup_job_event_timeline()
+        stats = self.stats
+        stats.runs += 1
+        stats.peak_heap_size = max(stats.peak_heap_size,
+                                    len(job_event_timeline))
         logged_hours = self.EC2.init_empty_all_instance_types()
         # The pool used is the amount of instances that are currently in
         # use by the simulator. available instances = pool - used.
         pool_used = self.EC2.init_empty_all_instance_types()
 
-        jobs_running = {}
+        for observer in self.use_pool_observers + self.log_observers:
+            # Observers only need update(), reserve() is optional.
+            reserve = getattr(observer, 'reserve', None)
+            if reserve is not None:
+                reserve(job_event_timeline)
+
+        if self.job_event_timeline is not None:
+            ordered_events = job_event_timeline
+        else:
+            ordered_events = [heappop(job_event_timeline)
+                            for i in range(len(job_event_timeline))]
+
+        self.simulate_events(ordered_events, logged_hours, {}, pool_used)
+        return logged_hours
+
+    def simulate_events(self, ordered_events, logged_hours, jobs_running,
+                        pool_used):
+        """Simulates a sorted run of events, starting from the jobs already
+        running.
+
+        run simulates the whole timeline from nothing running. Simulating
+        part of a timeline gives the same results as long as jobs_running
+        and pool_used are what they were when the first event happened.
+
+        Mutates:
+            logged_hours: Has the hours used by the events added.
+
+            jobs_running, pool_used: Updated by the events, so they can be
+                used to simulate the events after these.
+        """
+        stats = self.stats
+        events = stats.events
+        # Most simulations (e.g. every run of the optimizer) have nobody
+        # listening, so don't pay for notifying observers in that case.
+        observed = bool(self.log_observers or self.use_pool_observers)
+
         # Start simulating events.
-        for time, event_type, job in [heappop(job_event_timeline)
-                    for i in range(len(job_event_timeline))]:
+        for time, event_type, job in ordered_events:
             job_id = job.get('jobflowid')
+            events[event_type] += 1
 
             # Logger is used for recording information as the simulator runs
             # passing in a logger function, you can use closure to access other
             # variables and log the information you want (example: graphs)
-            self.notify_observers(time, event_type, job, logged_hours,
-                pool_used)
+            if observed:
+                self.notify_observers(time, event_type, job, logged_hours,
+                    pool_used)
             if event_type is START:
                 self.allocate_job(jobs_running, pool_used, job)
+                if len(jobs_running) > stats.peak_concurrent_jobs:
+                    stats.peak_concurrent_jobs = len(jobs_running)
 
             elif event_type is LOG:
                 self.log_hours(logged_hours, jobs_running, job_id)
@@ -101,9 +156,9 @@ class Simulator:
             elif event_type is END:
                 self.log_hours(logged_hours, jobs_running, job_id)
                 self.remove_job(jobs_running, pool_used, job)
-            self.notify_observers(time, event_type, job, logged_hours,
-                pool_used)
-        return logged_hours
+            if observed:
+                self.notify_observers(time, event_type, job, logged_hours,
+                    pool_used)
 
     def setup_job_event_timeline(self):
         """Sets up node events for the simulator.
@@ -144,6 +199,14 @@ class Simulator:
         heapify(job_event_timeline)
         return job_event_timeline
 
+    def sorted_job_event_timeline(self):
+        """Returns the events of setup_job_event_timeline as a sorted list,
+        which can be shared by any number of simulators of these job flows.
+        """
+        job_event_timeline = self.setup_job_event_timeline()
+        return [heappop(job_event_timeline)
+                for i in range(len(job_event_timeline))]
+
     def attach_log_hours_observer(self, observer):
         self.log_observers.append(observer)
 
@@ -199,6 +262,7 @@ class Simulator:
             pool_used: a dict of current instances in use. Use to allocate jobs
         """
         job_id = job.get('jobflowid')
+        self.stats.allocate_job_calls += 1
 
         # A small function that will choose the amount of instances used.
         # If the job needs more instances than the pool has, choose have.
@@ -251,6 +315,7 @@ class Simulator:
                 now free.
         """
         job_id = job.get('jobflowid')
+        self.stats.remove_job_calls += 1
 
         # Remove all the pool used by the instance then delete the job.
         for utilization_class in jobs.get(job_id, {}).keys():
@@ -288,6 +353,7 @@ class Simulator:
 
             jobs: rearranges job instances.
         """
+        self.stats.rearrange_instances_calls += 1
         self.remove_job(jobs, pool_used, job)
         self.allocate_job(jobs, pool_used, job)
 
@@ -307,6 +373,49 @@ class Simulator:
             return float('inf')
 
 
+class SimulatorStats(object):
+    """Counts the work a Simulator does, summed over all of its runs.
+
+    rearrange_instances calls remove_job and allocate_job, so those calls are
+    included in their counts too.
+    """
+    def __init__(self):
+        self.runs = 0
+        self.events = {START: 0, LOG: 0, END: 0}
+        self.allocate_job_calls = 0
+        self.remove_job_calls = 0
+        self.rearrange_instances_calls = 0
+        self.peak_heap_size = 0
+        self.peak_concurrent_jobs = 0
+
+    def merge(self, other):
+        """Adds the counts of another SimulatorStats into these."""
+        self.runs += other.runs
+        for event_type in self.events:
+            self.events[event_type] += other.events[event_type]
+        self.allocate_job_calls += other.allocate_job_calls
+        self.remove_job_calls += other.remove_job_calls
+        self.rearrange_instances_calls += other.rearrange_instances_calls
+        self.peak_heap_size = max(self.peak_heap_size, other.peak_heap_size)
+        self.peak_concurrent_jobs = max(self.peak_concurrent_jobs,
+                                        other.peak_concurrent_jobs)
+
+    def as_dict(self):
+        return {
+            'runs': self.runs,
+            'events': {
+                'start': self.events[START],
+                'log': self.events[LOG],
+                'end': self.events[END],
+            },
+            'allocate_job_calls': self.allocate_job_calls,
+            'remove_job_calls': self.remove_job_calls,
+            'rearrange_instances_calls': self.rearrange_instances_calls,
+            'peak_heap_size': self.peak_heap_size,
+            'peak_concurrent_jobs': self.peak_concurrent_jobs,
+        }
+
+
 class SimulationObserver(object):
     """Used to record information during each step of the simulation.
 
@@ -319,6 +428,13 @@ class SimulationObserver(object):
         self.hour_graph = hour_graph
         self.recorder = recorder
 
+    def reserve(self, job_event_timeline):
+        """Called once before the simulation starts with the full event
+        timeline, so observers can size their storage up front. This
+        observer grows its lists as it goes, so there is nothing to do.
+        """
+        pass
+
     def update(self, time, node_type, job, data, EC2):
         """Records data usage for each time node in the priority queue. The
         logger is called twice in a single event. So this records the state of
@@ -352,3 +468,141 @@ class SimulationObserver(object):
                     self.recorder[utilization_class][instance_type] = []
                 total += data[utilization_class].get(instance_type, 0)
                 self.recorder[utilization_class][instance_type].append(total)
+
+
+class SimulationRecorder(object):
+    """A leaner SimulationObserver that records into preallocated arrays.
+
+    SimulationObserver appends to python lists and records every event for
+    every instance type. The recorder only listens to the event types and
+    instance types it is told to, sizes its buffers exactly from the event
+    timeline before the simulation starts and stores each utilization class
+    as a fixed width column of doubles.
+
+    The columns are stacked the same way as SimulationObserver's, so the
+    value recorded for a utilization class is the running total of that class
+    and all the classes before it in ALL_UTILIZATION_PRIORITIES.
+
+    Times are stored as seconds since the epoch. Naive datetimes are treated
+    as if they were in UTC.
+    """
+    def __init__(self, EC2, event_types=None, instance_types=None):
+        """
+        Args:
+            EC2: An EC2Info object, used for the utilization classes.
+
+            event_types: An iterable of START, LOG and END events to record.
+                None records all event types.
+
+            instance_types: An iterable of instance types to record. None
+                records all instance types.
+        """
+        self.EC2 = EC2
+        self.utilization_classes = list(EC2.ALL_UTILIZATION_PRIORITIES)
+        self.event_types = None
+        if event_types is not None:
+            self.event_types = frozenset(event_types)
+        self.instance_types = None
+        if instance_types is not None:
+            self.instance_types = frozenset(instance_types)
+        self.times = {}
+        self.columns = {}
+        self.lengths = {}
+
+    def reserve(self, job_event_timeline):
+        """Allocates exactly enough rows for every subscribed instance type.
+
+        Every event is recorded twice (before and after the simulator
+        handles it) once for each of the job's instance groups.
+        """
+        rows = defaultdict(int)
+        for _, event_type, job in job_event_timeline:
+            if not self._wants_event(event_type):
+                continue
+            for instance in job.get('instancegroups'):
+                instance_type = instance.get('instancetype')
+                if self._wants_instance_type(instance_type):
+                    rows[instance_type] += 2
+
+        for instance_type, row_count in rows.items():
+            self._allocate(instance_type, row_count)
+
+    def update(self, time, node_type, job, data, EC2):
+        """Same interface as SimulationObserver.update."""
+        if not self._wants_event(node_type):
+            return
+
+        timestamp = None
+        for instance in job.get('instancegroups'):
+            instance_type = instance.get('instancetype')
+            if not self._wants_instance_type(instance_type):
+                continue
+            if timestamp is None:
+                timestamp = datetime_to_timestamp(time)
+
+            row = self.lengths.get(instance_type, 0)
+            times = self.times.get(instance_type)
+            if times is None or row == len(times):
+                # Only happens if reserve wasn't called with this timeline.
+                self._allocate(instance_type, max(2 * row, 64))
+                times = self.times[instance_type]
+            times[row] = timestamp
+
+            total = 0
+            columns = self.columns[instance_type]
+            for index, utilization_class in enumerate(
+                    self.utilization_classes):
+                total += data[utilization_class].get(instance_type, 0)
+                columns[index][row] = total
+            self.lengths[instance_type] = row + 1
+
+    def recorded_instance_types(self):
+        """Returns the instance types that have at least one row."""
+        return set(instance_type for instance_type in self.lengths
+                    if self.lengths[instance_type])
+
+    def event_times(self, instance_type):
+        """Returns an array of the times (seconds since the epoch) recorded
+        for an instance type."""
+        length = self.lengths.get(instance_type, 0)
+        return self.times.get(instance_type, array('d'))[:length]
+
+    def column(self, instance_type, utilization_class):
+        """Returns the array of stacked values recorded for a utilization
+        class of an instance type."""
+        length = self.lengths.get(instance_type, 0)
+        if not length:
+            return array('d')
+        index = self.utilization_classes.index(utilization_class)
+        return self.columns[instance_type][index][:length]
+
+    def _wants_event(self, event_type):
+        return self.event_types is None or event_type in self.event_types
+
+    def _wants_instance_type(self, instance_type):
+        return (self.instance_types is None or
+                instance_type in self.instance_types)
+
+    def _allocate(self, instance_type, row_count):
+        """Makes sure an instance type has room for row_count rows, keeping
+        any rows that are already recorded."""
+        length = self.lengths.get(instance_type, 0)
+        row_count = max(row_count, length)
+        times = array('d', [0.0]) * row_count
+        columns = [array('d', [0.0]) * row_count
+                    for _ in self.utilization_classes]
+        if length:
+            times[:length] = self.times[instance_type][:length]
+            for index, column in enumerate(columns):
+                column[:length] = self.columns[instance_type][index][:length]
+        self.times[instance_type] = times
+        self.columns[instance_type] = columns
+        self.lengths[instance_type] = length
+
+
+def datetime_to_timestamp(time):
+    """Converts a datetime to seconds since the epoch. Aware datetimes are
+    converted to UTC first, naive datetimes are assumed to already be UTC.
+    """
+    return (calendar.timegm(time.utctimetuple()) +
+            time.microsecond / 1000000.0)
@@ -0,0 +1,175 @@
+"""A content-addressed cache for the stages of the EMRio pipeline.
+
+Every stage of a run (loading the job flow history, optimizing and simulating)
+is a pure function of its inputs, so the results are stored on disk under a
+key that is the hash of everything that went into them: the job flow history,
+date filters, timezone, price file and so on. When nothing that a stage depends
+on has changed, the stage is read back from the cache instead of recomputed.
+
+Entries are stored as JSON, one file each, so reading the cache never runs
+code from it. When the cache grows past its size limit, the least recently
+used entries are deleted first.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+# Bump this when the format of anything stored in the cache changes, so old
+# entries are never read back.
+CACHE_VERSION = 2
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+ENTRY_SUFFIX = '.json'
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class StageCache(object):
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory: Directory to keep the cache entries in. It is created
+                if it doesn't exist.
+
+            max_bytes: Size the cache is trimmed down to after every put.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, *parts):
+        """Makes a cache key out of JSON serializable parts. The same parts
+        always give the same key."""
+        encoded = json.dumps([CACHE_VERSION] + list(parts), sort_keys=True)
+        return hashlib.sha1(encoded).hexdigest()
+
+    def get(self, key):
+        """Returns the value stored under key, or None if there isn't one.
+
+        Reading an entry marks it as recently used.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = json.load(f, object_hook=decode_datetime)
+        except IOError:
+            return None
+        except Exception:
+            # A half written or stale entry is the same as a miss.
+            logging.debug("Discarding unreadable cache entry %s", path)
+            self._remove(path)
+            return None
+        os.utime(path, None)
+        return value
+
+    def put(self, key, value):
+        """Stores value under key, then evicts old entries if the cache is
+        too big.
+
+        The value has to be JSON serializable, apart from datetimes. It's
+        read back with lists for tuples and dicts for defaultdicts.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            json.dump(value, f, default=encode_datetime)
+        # Renaming is atomic, so readers never see a partial entry.
+        os.rename(temp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits in
+        max_bytes."""
+        entries = []
+        total_bytes = 0
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            logging.debug("Evicting cache entry %s", path)
+            self._remove(path)
+            total_bytes -= size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def encode_datetime(value):
+    """JSON encodes the datetimes in cache entries. Their timezone is kept by
+    name, so it has to be a pytz timezone."""
+    if not isinstance(value, datetime.datetime):
+        raise TypeError("%r can't be stored in the cache" % (value,))
+    timezone = None
+    if value.tzinfo is not None:
+        timezone = value.tzinfo.zone
+    return {'__datetime__': value.strftime(DATETIME_FORMAT),
+            'timezone': timezone}
+
+
+def decode_datetime(obj):
+    """Turns the dicts encode_datetime made back into datetimes."""
+    if '__datetime__' not in obj:
+        return obj
+    value = datetime.datetime.strptime(obj['__datetime__'], DATETIME_FORMAT)
+    if obj['timezone'] is not None:
+        import pytz
+        value = value.replace(tzinfo=pytz.timezone(obj['timezone']))
+    return value
+
+
+def hash_file(filename):
+    """Returns the sha1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_job_flows(job_flows):
+    """Returns a digest of the parts of the job flows the simulations use,
+    for histories that don't come from a file."""
+    digest = hashlib.sha1()
+    for job in job_flows:
+        digest.update(repr((job.get('jobflowid'),
+                            str(job.get('startdatetime')),
+                            str(job.get('enddatetime')))))
+        for instance in job.get('instancegroups', []):
+            digest.update(repr((instance.get('instancetype'),
+                                instance.get('instancerequestcount'))))
+    return digest.hexdigest()
+
+
+def pool_items(pool):
+    """Flattens a pool (or logged hours) into a sorted list of
+    [utilization_class, instance_type, count] for the non-zero counts, which
+    can be used as part of a cache key."""
+    items = []
+    for utilization_class in pool:
+        for instance_type in pool[utilization_class]:
+            count = pool[utilization_class][instance_type]
+            if count:
+                items.append([utilization_class, instance_type, count])
+    return sorted(items)
@@ -0,0 +1,106 @@
+"""Tests for approximately optimizing on a sample of the history's days."""
+import datetime
+import random
+import unittest
+
+from emrio_lib.approximate import approximate_optimize
+from emrio_lib.approximate import neighbouring_pools
+from emrio_lib.approximate import StratifiedSample
+from emrio_lib.ec2_cost import EC2Info
+
+EC2 = EC2Info("tests/test_prices.yaml")
+BASE_TIME = datetime.datetime(2012, 5, 1, 3)
+DAY = datetime.timedelta(1)
+INSTANCE_NAME = 'm1.small'
+
+
+def create_job(j_id, day, count, hours, hour=0):
+    start = BASE_TIME + day * DAY + datetime.timedelta(0, hour * 3600)
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': start + datetime.timedelta(0, hours * 3600),
+        'instancegroups': [{'instancetype': INSTANCE_NAME,
+                            'instancerequestcount': str(count)}]}
+
+
+# Every day has a long job and a shorter one, busier on weekdays.
+JOB_FLOWS = []
+for day in range(28):
+    JOB_FLOWS.append(create_job('j-%d' % day, day, 6, 20))
+    JOB_FLOWS.append(create_job('k-%d' % day, day, 2 + 3 * (day % 7 < 5),
+                                3, hour=4))
+
+
+class TestStratifiedSample(unittest.TestCase):
+
+    def test_sample_every_day(self):
+        sample = StratifiedSample(JOB_FLOWS, 1.0, random.Random(0), EC2)
+        self.assertEqual(sample.days, 28)
+        self.assertEqual(sample.sampled_days, 28)
+        self.assertEqual(len(sample.job_flows), len(JOB_FLOWS))
+        self.assertEqual(sample.sample_interval, sample.interval)
+        total, variance = sample.estimate_total(range(28))
+        self.assertEqual(total, sum(range(28)))
+        self.assertEqual(variance, 0)
+
+    def test_sample_each_weekday(self):
+        sample = StratifiedSample(JOB_FLOWS, 0.1, random.Random(0), EC2)
+        self.assertEqual(sample.sampled_days, 14)
+        self.assertEqual(sorted(stratum for stratum, _, _ in sample.units),
+                        sorted(list(range(7)) * 2))
+        # Two days of each stratum stand for its four days.
+        total, variance = sample.estimate_total([1] * 14)
+        self.assertEqual(total, 28)
+        self.assertEqual(variance, 0)
+        total, variance = sample.estimate_total([0, 2] * 7)
+        self.assertEqual(total, 28)
+        self.assertTrue(variance > 0)
+
+
+class TestApproximateOptimize(unittest.TestCase):
+
+    def test_whole_history(self):
+        """Sampling every day gives the exact costs with no interval."""
+        approximation = approximate_optimize(JOB_FLOWS, EC2, fraction=1.0)
+        low, high = approximation['cost_interval']
+        self.assertAlmostEqual(low, approximation['cost'])
+        self.assertAlmostEqual(high, approximation['cost'])
+        self.assertTrue(approximation['separated'])
+
+    def test_savings_match_interval(self):
+        """The pool's hours cost what the estimate says, so the report's
+        savings are in the middle of their interval."""
+        approximation = approximate_optimize(JOB_FLOWS, EC2, fraction=0.3)
+        cost, _ = EC2.calculate_cost(approximation['logged_hours'],
+                                    approximation['pool'])
+        self.assertAlmostEqual(cost, approximation['cost'])
+        demand_cost, _ = EC2.calculate_cost(
+            approximation['demand_logged_hours'],
+            EC2.init_empty_reserve_pool())
+        self.assertAlmostEqual(demand_cost - cost, approximation['saved'])
+        low, high = approximation['saved_interval']
+        self.assertAlmostEqual((low + high) / 2, demand_cost - cost)
+
+    def test_falls_back_when_days_vary(self):
+        """A couple of days with very different jobs can't pin down the
+        pool."""
+        job_flows = [create_job('j-%d' % day, day, 1 + (day * 7) % 13,
+                                1 + (day * 5) % 23) for day in range(28)]
+        approximation = approximate_optimize(job_flows, EC2, fraction=0.3)
+        self.assertFalse(approximation['separated'])
+
+    def test_neighbouring_pools(self):
+        pool = EC2.init_empty_reserve_pool()
+        floor = EC2.init_empty_reserve_pool()
+        for utilization_class in EC2.RESERVE_PRIORITIES:
+            pool[utilization_class][INSTANCE_NAME] = 1
+            floor[utilization_class][INSTANCE_NAME] = 0
+        floor[EC2.RESERVE_PRIORITIES[0]][INSTANCE_NAME] = 1
+        neighbours = list(neighbouring_pools(pool, floor, EC2))
+        self.assertEqual(len(neighbours),
+                        2 * len(EC2.RESERVE_PRIORITIES) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
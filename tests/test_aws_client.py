@@ -0,0 +1,183 @@
+"""Tests for the EMR and EC2 client, run against fake connections."""
+import datetime
+import threading
+import unittest
+
+from emrio_lib.aws_client import AWSClient
+from emrio_lib.aws_client import is_retryable_error
+from emrio_lib.aws_client import RetryBudget
+from emrio_lib.job_handler import describe_all_job_flows
+from emrio_lib.job_handler import get_job_flow_objects
+
+NOW = datetime.datetime(2012, 7, 1)
+# How far back the fake EMR keeps job flows.
+RETENTION = datetime.timedelta(days=60)
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+class FakeServerError(Exception):
+    """Looks like boto's BotoServerError."""
+
+    def __init__(self, status, error_code=None, body=''):
+        Exception.__init__(self, status, error_code)
+        self.status = status
+        self.error_code = error_code
+        self.body = body
+
+
+class FakeJobFlow(object):
+
+    def __init__(self, jobflowid, created):
+        self.jobflowid = jobflowid
+        self.creationdatetime = created.strftime(TIME_FORMAT)
+        self.created = created
+
+
+class FakeEMR(object):
+    """An in-process EMR, shared by every connection made to it."""
+
+    def __init__(self, job_flows, page_size=5, throttled_calls=0):
+        self.job_flows = sorted(job_flows, key=lambda jf: jf.created,
+                                reverse=True)
+        self.page_size = page_size
+        self.throttled_calls = throttled_calls
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return FakeEMRConnection(self)
+
+    def describe_jobflows(self, states=None, jobflow_ids=None,
+                        created_after=None, created_before=None):
+        with self.lock:
+            self.calls += 1
+            if self.throttled_calls:
+                self.throttled_calls -= 1
+                raise FakeServerError(400, 'Throttling')
+        if created_before and created_before < NOW - RETENTION:
+            raise FakeServerError(400, 'ValidationError',
+                '<Code>ValidationError</Code>')
+        return [jf for jf in self.job_flows
+                if jf.created > NOW - RETENTION and
+                (created_after is None or jf.created > created_after) and
+                (created_before is None or jf.created < created_before)
+                ][:self.page_size]
+
+
+class FakeEMRConnection(object):
+
+    def __init__(self, emr):
+        self.emr = emr
+        self.closed = False
+
+    def describe_jobflows(self, **kwargs):
+        return self.emr.describe_jobflows(**kwargs)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeEC2Connection(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_all_reserved_instances(self):
+        self.calls += 1
+        return ['reserved']
+
+    def close(self):
+        pass
+
+
+def job_flows_every(hours, days=90):
+    return [FakeJobFlow('j-%d' % i,
+                        NOW - datetime.timedelta(0, 3600 * hours * i))
+            for i in range(days * 24 // hours)]
+
+
+JOB_FLOWS = job_flows_every(7)
+KEPT_IDS = sorted(jf.jobflowid for jf in JOB_FLOWS
+                if jf.created > NOW - RETENTION)
+
+
+class TestAWSClient(unittest.TestCase):
+
+    def setUp(self):
+        self.delays = []
+
+    def client(self, emr, **kwargs):
+        return AWSClient(emr_connect=emr.connect,
+                        ec2_connect=FakeEC2Connection,
+                        sleep=self.delays.append, **kwargs)
+
+    def job_ids(self, job_flows):
+        return sorted(jf.jobflowid for jf in job_flows)
+
+    def test_every_job_flow_once(self):
+        for concurrency in (1, 3):
+            job_flows = self.client(FakeEMR(JOB_FLOWS),
+                concurrency=concurrency).describe_job_flows(now=NOW)
+            self.assertEqual(self.job_ids(job_flows), KEPT_IDS)
+            self.assertEqual(len(job_flows), len(KEPT_IDS))
+            created = [jf.created for jf in job_flows]
+            self.assertEqual(created, sorted(created, reverse=True))
+
+    def test_same_as_one_connection(self):
+        self.assertEqual(
+            self.job_ids(describe_all_job_flows(
+                FakeEMR(JOB_FLOWS).connect(),
+                created_before=NOW + datetime.timedelta(1))),
+            KEPT_IDS)
+
+    def test_max_days_ago(self):
+        client = self.client(FakeEMR(JOB_FLOWS))
+        job_flows = get_job_flow_objects(None, max_days_ago=20, now=NOW,
+                                        client=client)
+        self.assertEqual(self.job_ids(job_flows), sorted(
+            jf.jobflowid for jf in JOB_FLOWS
+            if jf.created > NOW - datetime.timedelta(20)))
+
+    def test_connections_are_reused(self):
+        emr = FakeEMR(JOB_FLOWS)
+        client = self.client(emr, concurrency=2)
+        client.describe_job_flows(now=NOW)
+        client.describe_job_flows(now=NOW)
+        client.close()
+        # One per thread of the client's pool at most.
+        self.assertTrue(client.connections_made <= 2)
+        self.assertTrue(emr.calls > client.connections_made)
+
+    def test_throttled_calls_are_retried(self):
+        emr = FakeEMR(JOB_FLOWS, throttled_calls=3)
+        client = self.client(emr, retry_budget=RetryBudget(3),
+                            base_delay=1, max_delay=3)
+        self.assertEqual(self.job_ids(client.describe_job_flows(now=NOW)),
+                        KEPT_IDS)
+        self.assertEqual(len(self.delays), 3)
+        self.assertTrue(all(0.5 <= delay <= 3 for delay in self.delays))
+        self.assertEqual(client.retry_budget.retries, 0)
+
+    def test_retry_budget_runs_out(self):
+        emr = FakeEMR(JOB_FLOWS, throttled_calls=10)
+        client = self.client(emr, retry_budget=RetryBudget(4))
+        self.assertRaises(FakeServerError, client.describe_job_flows,
+                        now=NOW)
+        self.assertEqual(len(self.delays), 4)
+
+    def test_retryable_errors(self):
+        self.assertTrue(is_retryable_error(FakeServerError(400, 'Throttling')))
+        self.assertTrue(is_retryable_error(FakeServerError(503)))
+        self.assertFalse(is_retryable_error(
+            FakeServerError(400, 'ValidationError')))
+        self.assertFalse(is_retryable_error(ValueError()))
+
+    def test_reserved_instances_are_fetched_once(self):
+        client = self.client(FakeEMR([]))
+        self.assertEqual(client.reserved_instances(), ['reserved'])
+        self.assertEqual(client.reserved_instances(), ['reserved'])
+        self.assertEqual(client.ec2().calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
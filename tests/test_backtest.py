@@ -0,0 +1,108 @@
+"""Tests for backtesting pools on the job flows after their train window."""
+import copy
+import datetime
+import unittest
+
+from emrio_lib.backtest import backtest
+from emrio_lib.backtest import IndexedHistory
+from emrio_lib.backtest import make_windows
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.optimizer import Optimizer
+from emrio_lib.simulate_jobs import Simulator
+
+EC2 = EC2Info("tests/test_prices.yaml")
+BASE_TIME = datetime.datetime(2012, 5, 1, 3)
+DAY = datetime.timedelta(1)
+INSTANCE_NAME = 'm1.small'
+
+
+def create_job(j_id, day, count, hours):
+    start = BASE_TIME + day * DAY
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': start + datetime.timedelta(0, hours * 3600),
+        'instancegroups': [{'instancetype': INSTANCE_NAME,
+                            'instancerequestcount': str(count)}]}
+
+
+JOB_FLOWS = [create_job('j-%d' % day, day, 2 + day % 3, 8 + 4 * (day % 4))
+            for day in range(12)]
+
+
+class TestBacktest(unittest.TestCase):
+
+    def test_make_windows(self):
+        windows = make_windows(JOB_FLOWS, 4 * DAY, 2 * DAY)
+        self.assertEqual(len(windows), 3)
+        self.assertEqual(windows[1], (BASE_TIME + 2 * DAY,
+                                    BASE_TIME + 6 * DAY,
+                                    BASE_TIME + 8 * DAY))
+        self.assertEqual(len(make_windows(JOB_FLOWS, 4 * DAY, 2 * DAY,
+                                        step=DAY)), 6)
+
+    def test_window_timeline(self):
+        """A window's timeline filtered out of the whole history's is the
+        same as one built from the window's jobs."""
+        history = IndexedHistory(JOB_FLOWS, EC2)
+        job_flows, timeline = history.window(BASE_TIME + 3 * DAY,
+                                            BASE_TIME + 6 * DAY)
+        self.assertEqual([job['jobflowid'] for job in job_flows],
+                        ['j-3', 'j-4', 'j-5'])
+        self.assertEqual(timeline,
+            Simulator(job_flows, None, EC2).sorted_job_event_timeline())
+
+    def test_backtest(self):
+        """Each window's pool is optimal for its train window and its savings
+        are worked out on its test window."""
+        windows = make_windows(JOB_FLOWS, 4 * DAY, 2 * DAY)
+        results = backtest(JOB_FLOWS, windows, EC2, processes=1)
+        self.assertEqual(len(results), len(windows))
+        for result, (train_start, test_start, test_end) in zip(results,
+                                                            windows):
+            self.assertEqual(result['test_start'], test_start)
+            train_jobs = [job for job in JOB_FLOWS
+                        if train_start <= job['startdatetime'] < test_start]
+            cold_pool = Optimizer(train_jobs, EC2, test_start - train_start)
+            self.assertEqual(result['pool'], cold_pool.run())
+            self.assertAlmostEqual(result['saved'],
+                                result['on_demand'] - result['cost'])
+
+        self.assertEqual(backtest(JOB_FLOWS, windows, EC2, processes=2),
+                        results)
+
+    def test_warm_start_carries_over_processes(self):
+        """Each window is warm started from the window before it, however
+        many processes the windows are tested in."""
+        # A year of hours on a light instance costs the same as a heavy one
+        # for a 1000 hour job, so a cold start and a warm start from a light
+        # instance settle on different pools.
+        tie_EC2 = copy.deepcopy(EC2)
+        tie_EC2.COST['Heavy Utilization'][INSTANCE_NAME] = {
+            'upfront': 100, 'hourly': 0.0}
+        tie_EC2.COST['Light Utilization'][INSTANCE_NAME] = {
+            'upfront': 37.5, 'hourly': 0.0625}
+        tie_EC2.COST['On Demand'][INSTANCE_NAME] = {
+            'upfront': 0, 'hourly': 0.25}
+        job_flows = [create_job('j-%d' % year, 365 * year, 1, hours)
+                    for year, hours in enumerate([500, 1000, 1000, 1000])]
+        windows = make_windows(job_flows, 365 * DAY, 365 * DAY)
+        self.assertEqual(len(windows), 2)
+
+        results = backtest(job_flows, windows, tie_EC2, processes=1)
+        train_start, test_start, _ = windows[1]
+        train_jobs = [job_flows[1]]
+        interval = test_start - train_start
+        cold_pool = Optimizer(train_jobs, tie_EC2, interval).run()
+        warm_pool = Optimizer(train_jobs, tie_EC2, interval).run(
+            initial_pool=results[0]['pool'])
+        self.assertNotEqual(warm_pool, cold_pool)
+        self.assertEqual(results[1]['pool'], warm_pool)
+
+        for processes in (2, 3):
+            self.assertEqual(backtest(job_flows, windows, tie_EC2,
+                                    processes=processes), results)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Tests for the synthetic workload generator and regression check used by
+the benchmarks."""
+import unittest
+
+from benchmarks.run import find_regressions
+from benchmarks.workload import generate_job_flows
+from benchmarks.workload import instance_types_from_prices
+
+INSTANCE_TYPES = instance_types_from_prices("tests/test_prices.yaml")
+
+
+class TestWorkload(unittest.TestCase):
+
+    def test_finite_instance_types(self):
+        """Instance types that can't be bought (infinite cost) are left
+        out."""
+        self.assertTrue('m1.small' in INSTANCE_TYPES)
+        self.assertFalse('cc1.4xlarge' in INSTANCE_TYPES)
+
+    def test_seeded(self):
+        """The same seed gives the same history, a different one doesn't."""
+        job_flows = generate_job_flows(500, INSTANCE_TYPES, seed=3)
+        self.assertEqual(len(job_flows), 500)
+        self.assertEqual(job_flows,
+                        generate_job_flows(500, INSTANCE_TYPES, seed=3))
+        self.assertNotEqual(job_flows,
+                            generate_job_flows(500, INSTANCE_TYPES, seed=4))
+
+    def test_sorted_with_unique_ids(self):
+        job_flows = generate_job_flows(500, INSTANCE_TYPES)
+        start_times = [job['startdatetime'] for job in job_flows]
+        self.assertEqual(start_times, sorted(start_times))
+        self.assertEqual(len(set(job['jobflowid'] for job in job_flows)), 500)
+        for job in job_flows:
+            self.assertTrue(job['startdatetime'] < job['enddatetime'])
+
+    def test_find_regressions(self):
+        baseline = {'version': 1, 'results': [
+            {'jobs': 10, 'stage': 'simulate', 'seconds': 1.0},
+            {'jobs': 10, 'stage': 'ingest', 'seconds': 1.0}]}
+        report = {'version': 1, 'results': [
+            {'jobs': 10, 'stage': 'simulate', 'seconds': 1.1},
+            {'jobs': 10, 'stage': 'ingest', 'seconds': 2.0}]}
+        regressions = find_regressions(baseline, report, 0.25)
+        self.assertEqual([r['stage'] for r in regressions], ['ingest'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Tests for bootstrapping the job flow history."""
+import datetime
+import random
+import unittest
+
+from emrio_lib.bootstrap import bootstrap
+from emrio_lib.bootstrap import HistoryBlocks
+from emrio_lib.bootstrap import percentile
+from emrio_lib.bootstrap import percentile_bands
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.job_handler import calculate_demand_hours
+from emrio_lib.simulate_jobs import Simulator
+
+EC2 = EC2Info("tests/test_prices.yaml")
+BASE_TIME = datetime.datetime(2012, 5, 1, 3)
+DAY = datetime.timedelta(1)
+INSTANCE_NAME = 'm1.small'
+
+
+def create_job(j_id, day, count, hours):
+    start = BASE_TIME + day * DAY
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': start + datetime.timedelta(0, hours * 3600),
+        'instancegroups': [{'instancetype': INSTANCE_NAME,
+                            'instancerequestcount': str(count)}]}
+
+
+# Some jobs run past the end of their day into the next block.
+JOB_FLOWS = [create_job('j-%d' % day, day, 2 + day % 4, 10 + 3 * (day % 5))
+            for day in range(10)]
+
+
+class TestHistoryBlocks(unittest.TestCase):
+
+    def test_resample(self):
+        """A resample's timeline and demand hours are the same as the ones
+        built from its jobs, and its jobs have unique ids."""
+        blocks = HistoryBlocks(JOB_FLOWS, DAY, EC2)
+        self.assertEqual(len(blocks.blocks), 10)
+        job_flows, timeline, demand_hours = blocks.resample(random.Random(3))
+
+        self.assertEqual(len(job_flows), 10)
+        self.assertEqual(len(set(job['jobflowid'] for job in job_flows)), 10)
+        expected = Simulator(job_flows, None, EC2).sorted_job_event_timeline()
+        self.assertEqual([(time, event_type, job['jobflowid'])
+                        for time, event_type, job in timeline],
+                        [(time, event_type, job['jobflowid'])
+                        for time, event_type, job in expected])
+        self.assertEqual(dict(demand_hours),
+                        dict(calculate_demand_hours(job_flows)))
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def test_results_dont_depend_on_processes(self):
+        serial = bootstrap(JOB_FLOWS, EC2, 3, seed=7, processes=1)
+        parallel = bootstrap(JOB_FLOWS, EC2, 3, seed=7, processes=2)
+        self.assertEqual(serial, parallel)
+
+        bands = percentile_bands(serial, EC2, percentiles=(0, 100))
+        savings = [saved for _, saved in serial]
+        self.assertEqual(bands['saved'], [min(savings), max(savings)])
+        for utilization_class in EC2.RESERVE_PRIORITIES:
+            low, high = bands['pools'][utilization_class][INSTANCE_NAME]
+            self.assertTrue(low <= high)
+
+    def test_owned_instances_are_kept(self):
+        """Like the report, every resample's pool keeps the owned
+        instances."""
+        light = EC2.RESERVE_PRIORITIES[-1]
+        owned = EC2.init_empty_reserve_pool()
+        owned[light][INSTANCE_NAME] = 9
+        results = bootstrap(JOB_FLOWS, EC2, 2, processes=1,
+                            pre_existing_pool=owned)
+        for pool, _ in results:
+            self.assertTrue(pool[light][INSTANCE_NAME] >= 9)
+        self.assertEqual(owned[light][INSTANCE_NAME], 9)
+        self.assertNotEqual(results, bootstrap(JOB_FLOWS, EC2, 2,
+                                            processes=1))
+
+    def test_percentile(self):
+        values = [1, 2, 3, 4, 5]
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 100), 5)
+        self.assertEqual(percentile(values, 12.5), 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Tests for compressed job flow history files."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytz
+
+from emrio_lib.compression import BZ2
+from emrio_lib.compression import compression_of
+from emrio_lib.compression import GZIP
+from emrio_lib.compression import open_history
+from emrio_lib.compression import XZ
+from emrio_lib.job_handler import load_job_flows_from_file
+from emrio_lib.jsonl_reader import read_job_flows
+
+TIMEZONE = pytz.timezone('US/Pacific')
+
+LINES = [json.dumps({
+    'jobflowid': 'j-%d' % i,
+    'startdatetime': '2012-05-%02dT10:00:00Z' % (1 + i % 28),
+    'enddatetime': '2012-05-%02dT12:00:00Z' % (1 + i % 28),
+    'instancegroups': [{'instancetype': 'm1.small',
+                        'instancerequestcount': str(1 + i % 4)}]}) + '\n'
+    for i in range(100)]
+
+
+def has_lzma():
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            return False
+    return True
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name):
+        filename = self.path(name)
+        with open_history(filename, 'w') as f:
+            for line in LINES:
+                f.write(line.encode('utf-8'))
+        return filename
+
+    def test_compression_of_new_files(self):
+        self.assertEqual(compression_of(self.path('history.json.gz')), GZIP)
+        self.assertEqual(compression_of(self.path('history.bz2')), BZ2)
+        self.assertEqual(compression_of(self.path('history.json')), None)
+
+    def test_compression_of_existing_files(self):
+        """The first bytes are what count, not the name."""
+        filename = self.write('history.json.gz')
+        renamed = self.path('history')
+        os.rename(filename, renamed)
+        self.assertEqual(compression_of(renamed), GZIP)
+
+        with open(self.path('plain.gz'), 'w') as f:
+            f.write(LINES[0])
+        self.assertEqual(compression_of(self.path('plain.gz')), None)
+
+    def check_round_trip(self, name, compression):
+        filename = self.write(name)
+        self.assertEqual(compression_of(filename), compression)
+        with open(filename, 'rb') as f:
+            self.assertNotEqual(f.read(len(LINES[0])), LINES[0])
+
+        expected = [json.loads(line) for line in LINES]
+        self.assertEqual(load_job_flows_from_file(filename), expected)
+        with open_history(self.path('history.json'), 'w') as f:
+            for line in LINES:
+                f.write(line)
+        plain = read_job_flows(self.path('history.json'), TIMEZONE,
+                            processes=1)
+        self.assertEqual(read_job_flows(filename, TIMEZONE, processes=1),
+                        plain)
+        self.assertEqual(read_job_flows(filename, TIMEZONE, processes=2,
+                                        min_parallel_bytes=0), plain)
+
+    def test_gzip(self):
+        self.check_round_trip('history.json.gz', GZIP)
+
+    def test_bz2(self):
+        self.check_round_trip('history.json.bz2', BZ2)
+
+    def test_xz(self):
+        if not has_lzma():
+            return
+        self.check_round_trip('history.json.xz', XZ)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,14 @@
 """Tests for the main EMRio module are here."""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.EMRio import build_report
+from emrio_lib.EMRio import output_to
 from emrio_lib.EMRio import read_optimal_instances
 
 EC2 = EC2Info("tests/test_prices.yaml")
@@ -20,3 +28,62 @@ class TestEMRio(unittest.TestCase):
 
         optimal_instances = read_optimal_instances(OPTIMIZED_FILE_NAME)
         self.assertEqual(optimal_instances, FILE_POOL)
+
+    def test_heavy_imports_are_lazy(self):
+        """Importing EMRio shouldn't import boto, matplotlib, pytz or yaml,
+        only the code paths that use them should."""
+        check = ("import sys; import emrio_lib.EMRio; "
+                "print ' '.join(m for m in ('boto', 'matplotlib', 'pytz', "
+                "'yaml') if m in sys.modules)")
+        output = subprocess.check_output([sys.executable, '-c', check])
+        self.assertEqual(output.strip(), '')
+
+    def test_approximate_rejects_optimized_pool(self):
+        """-o already gives the pool, so --approximate can't pick one."""
+        run = ("import sys; from emrio_lib.EMRio import main; "
+            "sys.argv = ['EMRio', '--approximate', '-o', %r]; main()" %
+            OPTIMIZED_FILE_NAME)
+        process = subprocess.Popen([sys.executable, '-c', run],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, error = process.communicate()
+        self.assertEqual(process.returncode, 2)
+        self.assertTrue('--approximate' in error)
+
+    def test_json_report(self):
+        """The report is JSON serializable and has the pools, hours and
+        costs."""
+        heavy = EC2.RESERVE_PRIORITIES[0]
+        pool = EC2.init_empty_reserve_pool()
+        pool[heavy][INSTANCE_NAME] = 2
+        owned = EC2.init_empty_reserve_pool()
+        owned[heavy][INSTANCE_NAME] = 1
+        log = EC2.init_empty_all_instance_types()
+        log[heavy][INSTANCE_NAME] = 1000
+        demand_log = EC2.demand_logged_hours({INSTANCE_NAME: 1000})
+
+        report = json.loads(json.dumps(build_report(log, pool, demand_log,
+            EC2, owned_reserved_instances=owned,
+            instrumentation={'stages': []})))
+        self.assertEqual(report['pools']['optimal'][heavy][INSTANCE_NAME], 2)
+        self.assertEqual(report['pools']['owned'][heavy][INSTANCE_NAME], 1)
+        self.assertEqual(
+            report['pools']['to_purchase'][heavy][INSTANCE_NAME], 1)
+        self.assertEqual(report['yearly_hours']['on_demand'][
+            EC2.on_demand_class()][INSTANCE_NAME], 1000)
+        self.assertEqual(report['cost']['saved'],
+            report['cost']['on_demand'] - report['cost']['optimized'])
+        self.assertEqual(report['instrumentation'], {'stages': []})
+
+    def test_output_to(self):
+        with output_to(None) as out:
+            self.assertTrue(out is sys.stdout)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'report.txt')
+            with output_to(filename) as out:
+                out.write('report\n')
+            self.assertTrue(out.closed)
+            with open(filename) as f:
+                self.assertEqual(f.read(), 'report\n')
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,74 @@
+"""Tests for scoring pools without optimizing."""
+import datetime
+import unittest
+
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.EMRio import simulate_job_flows
+from emrio_lib.evaluate import evaluate_pools
+
+EC2 = EC2Info("tests/test_prices.yaml")
+BASE_TIME = datetime.datetime(2012, 5, 20, 5)
+SMALL = 'm1.small'
+LARGE = 'm1.large'
+
+
+def create_job(j_id, instance_counts, start_hour, hours):
+    start = BASE_TIME + datetime.timedelta(0, start_hour * 3600)
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': start + datetime.timedelta(0, hours * 3600 + 900),
+        'instancegroups': [{'instancetype': instance_type,
+                            'instancerequestcount': str(count)}
+                        for instance_type, count in instance_counts]}
+
+
+JOB_FLOWS = [
+    create_job('j-1', [(SMALL, 5)], 0, 3),
+    create_job('j-2', [(SMALL, 3), (LARGE, 2)], 1, 5),
+    create_job('j-3', [(LARGE, 4)], 2, 2),
+    create_job('j-4', [(LARGE, 1)], 30, 1),
+    create_job('j-5', [(SMALL, 8)], 40, 10),
+]
+
+
+class TestEvaluatePools(unittest.TestCase):
+
+    def test_same_hours_as_full_simulation(self):
+        """Only simulating the jobs that use reserved instance types gives
+        the same hours as simulating all of them."""
+        heavy, medium = EC2.RESERVE_PRIORITIES[:2]
+        small_pool = EC2.init_empty_reserve_pool()
+        small_pool[heavy][SMALL] = 4
+        large_pool = EC2.init_empty_reserve_pool()
+        large_pool[medium][LARGE] = 3
+        large_pool[heavy][SMALL] = 0
+        mixed_pool = EC2.init_empty_reserve_pool()
+        mixed_pool[heavy][SMALL] = 2
+        mixed_pool[medium][LARGE] = 1
+        pools = [small_pool, large_pool, mixed_pool,
+                EC2.init_empty_reserve_pool()]
+
+        results = evaluate_pools(JOB_FLOWS, pools, EC2)
+        for pool, (logged_hours, demand_logged_hours) in zip(pools, results):
+            expected_hours, expected_demand_hours = simulate_job_flows(
+                JOB_FLOWS, pool, EC2)
+            for utilization in EC2.ALL_UTILIZATION_PRIORITIES:
+                for instance_type in (SMALL, LARGE):
+                    self.assertAlmostEqual(
+                        logged_hours[utilization][instance_type],
+                        expected_hours[utilization][instance_type])
+                    self.assertAlmostEqual(
+                        demand_logged_hours[utilization][instance_type],
+                        expected_demand_hours[utilization][instance_type])
+
+
+class TestSimulateJobFlows(unittest.TestCase):
+
+    def test_no_job_flows(self):
+        self.assertRaises(ValueError, simulate_job_flows, [],
+                        EC2.init_empty_reserve_pool(), EC2)
+
+
+if __name__ == '__main__':
+    unittest.main()
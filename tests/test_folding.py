@@ -0,0 +1,126 @@
+"""Tests for folding the job flow history onto a week or a day."""
+import datetime
+import unittest
+
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.folding import compare_with_simulation
+from emrio_lib.folding import FoldedOptimizer
+from emrio_lib.folding import FoldedProfile
+from emrio_lib.job_handler import calculate_demand_hours
+from emrio_lib.optimizer import convert_to_yearly_estimated_hours
+from emrio_lib.optimizer import Optimizer
+from emrio_lib.simulate_jobs import Simulator
+
+EC2 = EC2Info("tests/test_prices.yaml")
+BASE_TIME = datetime.datetime(2012, 5, 1, 3)
+DAY = datetime.timedelta(1)
+INSTANCE_NAME = 'm1.small'
+
+
+def create_job(j_id, start_hour, count, hours, instance_type=INSTANCE_NAME):
+    # timedeltas can't be multiplied by floats on Python 2.
+    start = BASE_TIME + datetime.timedelta(0, int(start_hour * 3600))
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': start + datetime.timedelta(0, int(hours * 3600)),
+        'instancegroups': [{'instancetype': instance_type,
+                            'instancerequestcount': str(count)}]}
+
+
+# Jobs that start on the hour and run for whole hours, over ten days.
+JOB_FLOWS = [create_job('j-%d' % i, 5 * i + (i % 3), 1 + i % 4, 2 + i % 7)
+            for i in range(48)]
+JOB_FLOWS.append(create_job('j-large', 30, 3, 20, instance_type='m1.large'))
+
+
+class TestFoldedProfile(unittest.TestCase):
+
+    def test_slots(self):
+        job_flows = [create_job('j1', 0, 2, 2), create_job('j2', 25, 3, 1),
+                    create_job('j3', 48, 2, 1)]
+        profile = FoldedProfile(job_flows, DAY)
+        self.assertEqual(profile.slots_per_period, 24)
+        self.assertEqual(profile.periods, 3)
+        slots = profile.slots[INSTANCE_NAME]
+        self.assertEqual(slots[0], {2: 2})
+        self.assertEqual(slots[1], {2: 1, 3: 1})
+        self.assertEqual(slots[2], {})
+
+    def test_hours_match_simulation_on_the_hour(self):
+        """When every job starts on the hour and runs for whole hours, the
+        folded hours are the simulator's."""
+        profile = FoldedProfile(JOB_FLOWS, 7 * DAY)
+        for count in (0, 2, 5):
+            pool = EC2.init_empty_reserve_pool()
+            for utilization_class in EC2.RESERVE_PRIORITIES:
+                pool[utilization_class][INSTANCE_NAME] = count
+                pool[utilization_class]['m1.large'] = 1
+            simulated = Simulator(JOB_FLOWS, pool, EC2).run()
+            folded = profile.logged_hours(pool, EC2)
+            for utilization_class in EC2.ALL_UTILIZATION_PRIORITIES:
+                self.assertEqual(
+                    folded[utilization_class],
+                    dict((instance_type, hours) for instance_type, hours in
+                        simulated[utilization_class].items() if hours))
+
+    def test_slot_usage(self):
+        """Each slot shows the average instances used in that hour of the
+        period, which differs between folding onto a day and a week."""
+        pool = EC2.init_empty_reserve_pool()
+        pool[EC2.RESERVE_PRIORITIES[0]][INSTANCE_NAME] = 2
+        day_profile = FoldedProfile(JOB_FLOWS, DAY)
+        day_usage = day_profile.slot_usage(pool, EC2)
+        self.assertEqual(len(day_usage), 24)
+        self.assertEqual(day_usage[0]['time'], '03:00')
+
+        week_usage = FoldedProfile(JOB_FLOWS, 7 * DAY).slot_usage(pool, EC2)
+        self.assertEqual(len(week_usage), 168)
+        self.assertEqual(week_usage[0]['time'], 'Tue 03:00')
+        self.assertNotEqual([slot['on_demand'] for slot in week_usage[:24]],
+                            [slot['on_demand'] for slot in day_usage])
+
+        # Every slot's use adds up to the hours logged over the history.
+        logged_hours = day_profile.logged_hours(pool, EC2)
+        on_demand = EC2.on_demand_class()
+        self.assertAlmostEqual(
+            sum(slot['on_demand'] for slot in day_usage) *
+            day_profile.periods,
+            sum(logged_hours[on_demand].values()))
+        self.assertAlmostEqual(
+            sum(slot['reserved'] for slot in day_usage) *
+            day_profile.periods,
+            sum(sum(logged_hours[utilization_class].values())
+                for utilization_class in EC2.RESERVE_PRIORITIES))
+
+    def test_demand_hours(self):
+        job_flows = JOB_FLOWS + [
+            create_job('j-partial', 3.5, 2, 1.25)]
+        folded = FoldedProfile(job_flows, DAY).logged_hours(
+            EC2.init_empty_reserve_pool(), EC2)
+        self.assertEqual(folded,
+            EC2.demand_logged_hours(calculate_demand_hours(job_flows)))
+
+
+class TestFoldedOptimizer(unittest.TestCase):
+
+    def test_same_pool_as_simulating(self):
+        profile = FoldedProfile(JOB_FLOWS, 7 * DAY)
+        folded_pool = FoldedOptimizer(JOB_FLOWS, profile, EC2).run()
+        self.assertEqual(folded_pool, Optimizer(JOB_FLOWS, EC2).run())
+
+        interval = (max(job['enddatetime'] for job in JOB_FLOWS) -
+                    min(job['startdatetime'] for job in JOB_FLOWS))
+        logged_hours = Simulator(JOB_FLOWS, folded_pool, EC2).run()
+        demand_logged_hours = EC2.demand_logged_hours(
+            calculate_demand_hours(JOB_FLOWS))
+        convert_to_yearly_estimated_hours(logged_hours, interval)
+        convert_to_yearly_estimated_hours(demand_logged_hours, interval)
+        comparison = compare_with_simulation(profile, folded_pool, EC2,
+            logged_hours, demand_logged_hours, interval)
+        self.assertEqual(comparison['folded_saved'], comparison['saved'])
+        self.assertEqual(comparison['error'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
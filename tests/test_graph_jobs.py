@@ -0,0 +1,105 @@
+"""Tests for the graph module. Only saving the graphs draws anything, so
+only those tests need matplotlib."""
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from array import array
+
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.graph_jobs import INDEX_FILENAME
+from emrio_lib.graph_jobs import MAX, MEAN
+from emrio_lib.graph_jobs import choose_bin_seconds
+from emrio_lib.graph_jobs import downsample
+from emrio_lib.graph_jobs import Grapher
+
+try:
+    import matplotlib
+except ImportError:
+    matplotlib = None
+
+EC2 = EC2Info("tests/test_prices.yaml")
+BASE_TIME = datetime.datetime(2012, 5, 10, 3)
+
+TIMES = array('d', [0, 10, 20, 3600, 3610, 7300])
+COLUMNS = [array('d', [1, 4, 2, 3, 3, 0]),
+            array('d', [2, 5, 2, 6, 4, 1])]
+
+
+class TestDownsample(unittest.TestCase):
+
+    def test_max_bins(self):
+        """Each hour bin should keep its largest value."""
+        times, columns = downsample(TIMES, COLUMNS, 3600, MAX)
+        self.assertEqual(times, [0, 3600, 7200])
+        self.assertEqual(columns, [[4, 3, 0], [5, 6, 1]])
+
+    def test_mean_bins(self):
+        times, columns = downsample(TIMES, COLUMNS, 3600, MEAN)
+        self.assertEqual(times, [0, 3600, 7200])
+        self.assertEqual(columns, [[7 / 3.0, 3, 0], [3, 5, 1]])
+
+    def test_empty_trace(self):
+        times, columns = downsample(array('d'), [array('d')], 60)
+        self.assertEqual(times, [])
+        self.assertEqual(columns, [[]])
+
+    def test_choose_bin_seconds(self):
+        """Short traces are left alone, long ones are bucketed into at most
+        max_points bins."""
+        self.assertEqual(choose_bin_seconds(TIMES, 10), None)
+        bin_seconds = choose_bin_seconds(TIMES, 2)
+        times, _ = downsample(TIMES, COLUMNS, bin_seconds)
+        self.assertTrue(len(times) <= 2)
+
+
+def create_job(j_id, hour, instance_type, count, hours):
+    start = BASE_TIME + datetime.timedelta(0, hour * 3600)
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': start + datetime.timedelta(0, hours * 3600),
+        'instancegroups': [{'instancetype': instance_type,
+                            'instancerequestcount': str(count)}]}
+
+
+@unittest.skipIf(matplotlib is None, "matplotlib isn't installed")
+class TestSaveGraphs(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_index_lists_every_image(self):
+        """The index lists every image written, however many processes
+        rendered them."""
+        job_flows = [create_job('j-1', 0, 'm1.small', 3, 5),
+                    create_job('j-2', 2, 'm1.large', 2, 4),
+                    create_job('j-3', 20, 'm1.small', 1, 8)]
+        pool = EC2.init_empty_reserve_pool()
+        pool[EC2.RESERVE_PRIORITIES[0]]['m1.small'] = 1
+        grapher = Grapher(job_flows, pool, EC2)
+
+        indexes = []
+        for processes in (1, 2):
+            directory = os.path.join(self.directory, str(processes))
+            index = grapher.save(directory, total_usage=True,
+                                instance_usage=True, processes=processes)
+            with open(os.path.join(directory, INDEX_FILENAME)) as f:
+                self.assertEqual(json.load(f), index)
+            images = sorted(filename for filename in os.listdir(directory)
+                            if filename != INDEX_FILENAME)
+            self.assertEqual(sorted(os.path.basename(entry['path'])
+                                    for entry in index), images)
+            self.assertEqual(len(images), 4)
+            indexes.append([(entry['instance_type'], entry['graph'],
+                            os.path.basename(entry['path']))
+                            for entry in index])
+        self.assertEqual(indexes[0], indexes[1])
+
+if __name__ == '__main__':
+    unittest.main()
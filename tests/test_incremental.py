@@ -0,0 +1,142 @@
+"""Tests for re-optimizing from a previous run's state."""
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.incremental import incremental_optimize
+from emrio_lib.incremental import load_state
+from emrio_lib.incremental import save_state
+from emrio_lib.incremental import update_job_hours
+from emrio_lib.optimizer import Optimizer
+from emrio_lib.optimizer import OptimizerStats
+
+EC2 = EC2Info("tests/test_prices.yaml")
+BASE_TIME = datetime.datetime(2012, 5, 1, 3)
+DAY = datetime.timedelta(1)
+SMALL = 'm1.small'
+LARGE = 'm1.large'
+
+
+def create_job(j_id, day, instance_counts, hours):
+    start = BASE_TIME + day * DAY
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': start + datetime.timedelta(0, hours * 3600),
+        'instancegroups': [{'instancetype': instance_type,
+                            'instancerequestcount': str(count)}
+                        for instance_type, count in instance_counts]}
+
+
+# The large jobs are the same every day, the small ones vary.
+JOB_FLOWS = []
+for day in range(12):
+    JOB_FLOWS.append(create_job('s-%d' % day, day,
+                                [(SMALL, 3 + day % 4)], 6 + 3 * (day % 5)))
+    JOB_FLOWS.append(create_job('l-%d' % day, day, [(LARGE, 2)], 23))
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_update_job_hours(self):
+        job_hours, changed = update_job_hours({}, JOB_FLOWS[:4])
+        self.assertEqual(job_hours, {SMALL: {'s-0': 18, 's-1': 36},
+                                    LARGE: {'l-0': 46, 'l-1': 46}})
+        self.assertEqual(changed, set([SMALL, LARGE]))
+
+        # Drop the first small job and add another small one.
+        job_flows = JOB_FLOWS[1:4] + [JOB_FLOWS[4]]
+        job_hours, changed = update_job_hours(job_hours, job_flows)
+        self.assertEqual(job_hours[SMALL], {'s-1': 36, 's-2': 60})
+        self.assertEqual(changed, set([SMALL]))
+
+    def test_same_pool_as_optimizer(self):
+        """Each run over a sliding window gives the same pool as optimizing
+        the window from scratch."""
+        state = None
+        for first_day in range(3):
+            window = [job for job in JOB_FLOWS if first_day * DAY <=
+                    job['startdatetime'] - BASE_TIME < (first_day + 9) * DAY]
+            pool, state = incremental_optimize(window, EC2, state=state)
+            self.assertEqual(pool, Optimizer(window, EC2).run())
+
+    def test_unchanged_job_flows_are_not_simulated(self):
+        pool, state = incremental_optimize(JOB_FLOWS, EC2, key=['prices'])
+        filename = os.path.join(self.directory, 'state')
+        save_state(filename, state)
+        stats = OptimizerStats()
+        same_pool, _ = incremental_optimize(JOB_FLOWS, EC2,
+            state=load_state(filename), key=['prices'], stats=stats)
+        self.assertEqual(same_pool, pool)
+        self.assertEqual(stats.simulations_run, 0)
+
+        # Different prices start over.
+        stats = OptimizerStats()
+        incremental_optimize(JOB_FLOWS, EC2, state=state,
+            key=['other prices'], stats=stats)
+        self.assertTrue(stats.simulations_run > 0)
+
+    def test_interval_change_rescales_hours(self):
+        """Instance types whose job flows didn't change aren't simulated
+        again when the interval changes, only rescaled."""
+        # The large jobs stay in the middle while the small ones slide.
+        middle = [job for job in JOB_FLOWS if job['jobflowid'] in
+                ('l-4', 'l-5', 'l-6')]
+        first = [job for job in JOB_FLOWS
+                if job['jobflowid'].startswith('s-')][:9] + middle
+        second = [job for job in JOB_FLOWS
+                if job['jobflowid'].startswith('s-')][1:12] + middle
+        _, state = incremental_optimize(first, EC2, key=['prices'])
+
+        stats = OptimizerStats()
+        pool, _ = incremental_optimize(second, EC2, state=state,
+            key=['prices'], stats=stats)
+        self.assertEqual(pool, Optimizer(second, EC2).run())
+
+        # Without the logged hours, the large jobs are simulated again.
+        state.logged_hours = {}
+        simulated_stats = OptimizerStats()
+        same_pool, _ = incremental_optimize(second, EC2, state=state,
+            key=['prices'], stats=simulated_stats)
+        self.assertEqual(same_pool, pool)
+        self.assertTrue(stats.simulations_run <
+                        simulated_stats.simulations_run)
+
+    def test_missing_state(self):
+        self.assertEqual(load_state(os.path.join(self.directory, 'nope')),
+                        None)
+
+    def test_state_round_trip(self):
+        """The state is saved as JSON and reads back the same."""
+        _, state = incremental_optimize(JOB_FLOWS, EC2, key=['prices'])
+        filename = os.path.join(self.directory, 'state')
+        save_state(filename, state)
+        with open(filename) as f:
+            self.assertEqual(json.load(f)['key'], ['prices'])
+        loaded = load_state(filename)
+        self.assertEqual(loaded.key, state.key)
+        self.assertEqual(loaded.interval, state.interval)
+        self.assertEqual(loaded.pool, state.pool)
+        self.assertEqual(loaded.job_hours, state.job_hours)
+        self.assertEqual(loaded.logged_hours, state.logged_hours)
+
+    def test_unreadable_state(self):
+        filename = os.path.join(self.directory, 'state')
+        for contents in ('not json', '[1, 2]'):
+            with open(filename, 'w') as f:
+                f.write(contents)
+            self.assertEqual(load_state(filename), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
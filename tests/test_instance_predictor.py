@@ -4,7 +4,11 @@ import datetime
 from unittest import TestCase
 
 from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.simulate_jobs import SimulationObserver
+from emrio_lib.simulate_jobs import SimulationRecorder
 from emrio_lib.simulate_jobs import Simulator
+from emrio_lib.simulate_jobs import START, LOG, END
+from emrio_lib.simulate_jobs import datetime_to_timestamp
 
 HEAVY_UTIL = "Heavy Utilization"
 MEDIUM_UTIL = "Medium Utilization"
@@ -178,5 +182,86 @@ class TestOptimizeFunctions(TestCase):
         except KeyError:
             self.assertTrue(True)
 
+    def test_simulator_stats(self):
+        """Three parallel two hour jobs: each has a START, a LOG and an END
+        event, and they all run at the same time."""
+        current_jobs = [
+            create_test_job(INSTANCE_NAME, BASE_INSTANCES, job_id,
+                end_time=STARTING_TIME + 2 * INTERVAL)
+            for job_id in ('j1', 'j2', 'j3')]
+        simulator = Simulator(current_jobs, HEAVY_POOL, EC2)
+        simulator.run()
+        stats = simulator.stats
+        self.assertEqual(stats.runs, 1)
+        self.assertEqual(stats.events, {START: 3, LOG: 3, END: 3})
+        self.assertEqual(stats.rearrange_instances_calls, 3)
+        # Every rearrangement removes and allocates the job again.
+        self.assertEqual(stats.allocate_job_calls, 6)
+        self.assertEqual(stats.remove_job_calls, 6)
+        self.assertEqual(stats.peak_heap_size, 9)
+        self.assertEqual(stats.peak_concurrent_jobs, 3)
+
+    def test_recorder_matches_observer(self):
+        """The array recorder should record the same stacked values and
+        times as the list based SimulationObserver."""
+        current_jobs = [
+            create_test_job(INSTANCE_NAME, BASE_INSTANCES, 'j1'),
+            create_test_job(INSTANCE_NAME, BASE_INSTANCES, 'j2',
+                end_time=STARTING_TIME + 3 * INTERVAL),
+            create_test_job('m1.large', 5, 'j3')]
+        event_times = {}
+        used_over_time = EC2.init_empty_all_instance_types()
+        recorder = SimulationRecorder(EC2)
+        simulator = Simulator(current_jobs, HEAVY_POOL, EC2)
+        simulator.attach_pool_use_observer(
+            SimulationObserver(event_times, used_over_time))
+        simulator.attach_pool_use_observer(recorder)
+        simulator.run()
+
+        self.assertEqual(recorder.recorded_instance_types(),
+            set([INSTANCE_NAME, 'm1.large']))
+        for instance_type in event_times:
+            self.assertEqual(list(recorder.event_times(instance_type)),
+                [datetime_to_timestamp(time)
+                    for time in event_times[instance_type]])
+            for utilization_class in EC2.ALL_UTILIZATION_PRIORITIES:
+                self.assertEqual(
+                    list(recorder.column(instance_type, utilization_class)),
+                    used_over_time[utilization_class][instance_type])
+
+    def test_observer_without_reserve(self):
+        """Observers only have to have an update method."""
+        class UpdateOnly(object):
+            def __init__(self):
+                self.updates = 0
+
+            def update(self, time, node_type, job, data, EC2):
+                self.updates += 1
+
+        observer = UpdateOnly()
+        simulator = Simulator([create_test_job(INSTANCE_NAME, 2, 'j1')],
+            HEAVY_POOL, EC2)
+        simulator.attach_log_hours_observer(observer)
+        simulator.run()
+        self.assertTrue(observer.updates > 0)
+
+    def test_recorder_filters(self):
+        """Only subscribed event types and instance types are recorded."""
+        current_jobs = [
+            create_test_job(INSTANCE_NAME, BASE_INSTANCES, 'j1',
+                end_time=STARTING_TIME + 3 * INTERVAL),
+            create_test_job('m1.large', 5, 'j2')]
+        recorder = SimulationRecorder(EC2, event_types=[START, END],
+            instance_types=[INSTANCE_NAME])
+        simulator = Simulator(current_jobs, HEAVY_POOL, EC2)
+        simulator.attach_log_hours_observer(recorder)
+        simulator.run()
+
+        self.assertEqual(recorder.recorded_instance_types(),
+            set([INSTANCE_NAME]))
+        # One START and one END, each recorded before and after.
+        self.assertEqual(len(recorder.event_times(INSTANCE_NAME)), 4)
+        self.assertEqual(len(recorder.event_times('m1.large')), 0)
+
 if __name__ == '__main__':
     unittest.main()
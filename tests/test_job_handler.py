@@ -4,8 +4,11 @@ from unittest import TestCase
 
 import pytz
 # Setup a mock EC2 since west coast can be changed in the future.
+from emrio_lib.job_handler import calculate_demand_hours
+from emrio_lib.job_handler import collapse_job_flows
 from emrio_lib.job_handler import no_date_filter, range_date_filter
 from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.simulate_jobs import Simulator
 
 TIMEZONE = pytz.timezone("US/Alaska")
 EC2 = EC2Info("tests/test_prices.yaml")
@@ -65,5 +68,66 @@ class TestJobHandlerFunctions(TestCase):
         job_flows = range_date_filter(job_flows, min_date, None, TIMEZONE)
         self.assertEqual(job_flows, job_flows_after)
 
+    def test_demand_hours_match_simulation(self):
+        """The on demand hours calculated without a simulation should be the
+        same as simulating with an empty pool, including partial hours and
+        jobs ending exactly on the hour."""
+        job_flows = [
+            create_test_job(INSTANCE_NAME, BASE_INSTANCES, 'j1'),
+            create_test_job(INSTANCE_NAME, 3, 'j2',
+                end_time=BASE_TIME + datetime.timedelta(0, 7201)),
+            create_test_job('m1.large', 7, 'j3',
+                end_time=BASE_TIME + datetime.timedelta(0, 60)),
+            create_test_job('m1.large', 2, 'j4',
+                end_time=BASE_TIME + datetime.timedelta(0, 3600, 5))]
+        simulated = Simulator(job_flows, EC2.init_empty_reserve_pool(),
+            EC2).run()
+        calculated = EC2.demand_logged_hours(calculate_demand_hours(job_flows))
+        self.assertEqual(calculated, simulated)
+        self.assertEqual(calculated[EC2.on_demand_class()],
+            {INSTANCE_NAME: BASE_INSTANCES + 3 * 3, 'm1.large': 7 + 2 * 2})
+
+    def test_collapse_job_flows(self):
+        """Identical job flows running at the same time collapse into one
+        and log the same hours, but not when another job flow of the same
+        instance type has an event at the same time."""
+        pool = EC2.init_empty_reserve_pool()
+        for utilization_class in EC2.RESERVE_PRIORITIES:
+            pool[utilization_class][INSTANCE_NAME] = 3
+        two_hours = BASE_TIME + 2 * INTERVAL
+        three_hours = BASE_TIME + 3 * INTERVAL
+        later = BASE_TIME + datetime.timedelta(0, 1800)
+        even_later = later + datetime.timedelta(0, 60)
+        job_flows = [
+            create_test_job(INSTANCE_NAME, 4, 'j1', end_time=two_hours),
+            create_test_job(INSTANCE_NAME, 4, 'j2', end_time=two_hours),
+            create_test_job(INSTANCE_NAME, 4, 'j3', end_time=two_hours),
+            create_test_job(INSTANCE_NAME, 2, 'j4', start_time=later),
+            create_test_job(INSTANCE_NAME, 2, 'j5', start_time=later),
+            create_test_job(INSTANCE_NAME, 1, 'j6', start_time=later,
+                end_time=three_hours + datetime.timedelta(0, 300)),
+            create_test_job('m1.large', 1, 'j7', start_time=even_later,
+                end_time=three_hours),
+            create_test_job(INSTANCE_NAME, 5, 'j8', start_time=even_later,
+                end_time=three_hours),
+            create_test_job(INSTANCE_NAME, 5, 'j9', start_time=even_later,
+                end_time=three_hours)]
+        collapsed = collapse_job_flows(job_flows)
+        self.assertEqual([job['jobflowid'] for job in collapsed],
+            ['j1', 'j4', 'j5', 'j6', 'j7', 'j8'])
+        self.assertEqual(collapsed[0]['multiplicity'], 3)
+        self.assertEqual(collapsed[0]['collapsedjobflowids'],
+            ['j1', 'j2', 'j3'])
+        self.assertEqual(collapsed[0]['instancegroups'],
+            create_test_instancegroup(INSTANCE_NAME, 12))
+        # j4 and j5 start when j6 does. j7 uses another instance type, so it
+        # doesn't keep j8 and j9 from collapsing.
+        self.assertEqual(collapsed[1], job_flows[3])
+        self.assertEqual(collapsed[5]['multiplicity'], 2)
+        self.assertEqual(Simulator(collapsed, pool, EC2).run(),
+            Simulator(job_flows, pool, EC2).run())
+        self.assertEqual(calculate_demand_hours(collapsed),
+            calculate_demand_hours(job_flows))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,118 @@
+"""Tests for the sorted start and end time index of job flows."""
+import datetime
+import random
+import unittest
+
+from emrio_lib.job_index import JobFlowIndex
+
+BASE_TIME = datetime.datetime(2012, 5, 1)
+INSTANCE_TYPES = ['m1.small', 'm1.large']
+
+
+def hours_after(hours):
+    # timedeltas can't be multiplied by floats on Python 2.
+    return BASE_TIME + datetime.timedelta(0, int(hours * 3600))
+
+
+def create_job(j_id, start_hour, hours, counts):
+    return {
+        'jobflowid': j_id,
+        'startdatetime': hours_after(start_hour),
+        'enddatetime': hours_after(start_hour + hours),
+        'instancegroups': [{'instancetype': instance_type,
+                            'instancerequestcount': str(count)}
+                        for instance_type, count in counts]}
+
+
+def random_job_flows(count, seed=0):
+    rng = random.Random(seed)
+    job_flows = []
+    for i in range(count):
+        counts = [(instance_type, rng.randint(1, 5)) for instance_type in
+                INSTANCE_TYPES if rng.random() < 0.7] or [('m1.small', 1)]
+        job_flows.append(create_job('j-%d' % i, rng.randint(0, 200),
+                                    rng.choice([0.5, 1, 3, 20, 90]), counts))
+    return job_flows
+
+
+JOB_FLOWS = random_job_flows(300)
+TIMES = [hours_after(hours) for hours in
+        [-1, 0, 0.5, 1, 3, 17, 100, 150.5, 200, 290, 400]]
+
+
+def running(job_flows, time):
+    return [job for job in job_flows
+            if job['startdatetime'] <= time < job['enddatetime']]
+
+
+class TestJobFlowIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = JobFlowIndex(JOB_FLOWS)
+
+    def test_bounds(self):
+        self.assertEqual(self.index.begin_time,
+                        min(job['startdatetime'] for job in JOB_FLOWS))
+        self.assertEqual(self.index.end_time,
+                        max(job['enddatetime'] for job in JOB_FLOWS))
+        self.assertEqual(self.index.interval(),
+                        self.index.end_time - self.index.begin_time)
+
+    def test_range(self):
+        for min_time in [None] + TIMES:
+            for max_time in [None] + TIMES:
+                expected = [job for job in self.index.job_flows
+                            if (min_time is None or
+                                job['startdatetime'] >= min_time) and
+                            (max_time is None or
+                                job['enddatetime'] <= max_time)]
+                self.assertEqual(self.index.range(min_time, max_time),
+                                expected)
+
+    def test_running_at(self):
+        for time in TIMES:
+            expected = running(self.index.job_flows, time)
+            self.assertEqual(self.index.running_at(time), expected)
+            self.assertEqual(self.index.count_running_at(time),
+                            len(expected))
+
+    def test_running_at_for_instance_type(self):
+        for time in TIMES:
+            self.assertEqual(
+                self.index.running_at(time, instance_type='m1.large'),
+                [job for job in running(self.index.job_flows, time)
+                if 'm1.large' in [instance['instancetype'] for instance in
+                                job['instancegroups']]])
+
+    def test_instances_running_at(self):
+        for time in TIMES:
+            expected = {}
+            for job in running(JOB_FLOWS, time):
+                for instance in job['instancegroups']:
+                    instance_type = instance['instancetype']
+                    expected[instance_type] = (
+                        expected.get(instance_type, 0) +
+                        int(instance['instancerequestcount']))
+            self.assertEqual(self.index.instances_running_at(time), expected)
+
+    def test_end_time_is_not_running(self):
+        job = create_job('j1', 0, 2, [('m1.small', 3)])
+        index = JobFlowIndex([job])
+        self.assertEqual(index.running_at(job['startdatetime']), [job])
+        self.assertEqual(index.running_at(job['enddatetime']), [])
+        self.assertEqual(index.instances_running_at(job['enddatetime']), {})
+
+    def test_empty(self):
+        index = JobFlowIndex([])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.begin_time, None)
+        self.assertEqual(index.end_time, None)
+        self.assertEqual(index.interval(), datetime.timedelta(0))
+        self.assertEqual(index.range(BASE_TIME, BASE_TIME), [])
+        self.assertEqual(index.running_at(BASE_TIME), [])
+        self.assertEqual(index.count_running_at(BASE_TIME), 0)
+        self.assertEqual(index.instances_running_at(BASE_TIME), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""Tests for the SQLite job flow store."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from emrio_lib.job_store import is_job_flow_store
+from emrio_lib.job_store import JobFlowStore
+
+
+def create_job(j_id, start, end, count=2, instance_type='m1.small'):
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': end,
+        'instancegroups': [
+            {'instancetype': 'm1.small', 'instancerequestcount': '1'},
+            {'instancetype': instance_type,
+            'instancerequestcount': str(count)}]}
+
+
+JOB_FLOWS = [
+    create_job('j-1', '2012-05-01T10:00:00Z', '2012-05-01T12:00:00Z'),
+    create_job('j-2', '2012-05-03T10:00:00.5Z', '2012-05-04T01:00:00Z',
+            instance_type='m1.large'),
+    create_job('j-3', '2012-05-05T23:00:00Z', '2012-05-06T02:00:00Z'),
+    create_job('j-4', '2012-05-07T00:00:00Z', None),
+]
+
+
+class TestJobFlowStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'history.db')
+        self.store = JobFlowStore(self.filename)
+        self.store.upsert(JOB_FLOWS)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_query_everything(self):
+        job_flows = self.store.query()
+        self.assertEqual([job['jobflowid'] for job in job_flows],
+                        ['j-1', 'j-2', 'j-3', 'j-4'])
+        self.assertEqual(job_flows[1]['instancegroups'],
+                        JOB_FLOWS[1]['instancegroups'])
+        self.assertEqual(job_flows[1]['startdatetime'],
+                        '2012-05-03T10:00:00.500000Z')
+        self.assertEqual(job_flows[3]['enddatetime'], None)
+
+    def test_query_days(self):
+        """Like range_date_filter, job flows have to start on or after the
+        min day and end on or before the max day."""
+        self.assertEqual([job['jobflowid'] for job in
+                        self.store.query('2012/05/02', '2012/05/06')],
+                        ['j-2'])
+        self.assertEqual([job['jobflowid'] for job in
+                        self.store.query(min_day='2012/05/03')],
+                        ['j-2', 'j-3', 'j-4'])
+        self.assertEqual([job['jobflowid'] for job in
+                        self.store.query(max_day='2012/05/07')],
+                        ['j-1', 'j-2', 'j-3'])
+
+    def test_upsert_replaces(self):
+        updated = create_job('j-4', '2012-05-07T00:00:00Z',
+                            '2012-05-07T05:00:00Z', count=7)
+        updated['instancegroups'].pop(0)
+        self.store.upsert([updated])
+        self.assertEqual(len(self.store), 4)
+        job = self.store.query(min_day='2012/05/07')[0]
+        self.assertEqual(job['enddatetime'], '2012-05-07T05:00:00.000000Z')
+        self.assertEqual(job['instancegroups'], updated['instancegroups'])
+
+    def test_is_job_flow_store(self):
+        self.assertTrue(is_job_flow_store(self.filename))
+        self.assertTrue(is_job_flow_store(
+            os.path.join(self.directory, 'new.sqlite')))
+
+        json_filename = os.path.join(self.directory, 'history.db.json')
+        with open(json_filename, 'w') as f:
+            f.write('{}\n')
+        self.assertFalse(is_job_flow_store(json_filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
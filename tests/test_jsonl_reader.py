@@ -0,0 +1,134 @@
+"""Tests for reading one job flow per line history files in parallel."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytz
+
+from emrio_lib.job_handler import convert_dates
+from emrio_lib.job_handler import load_job_flows_from_file
+from emrio_lib.job_handler import no_date_filter
+from emrio_lib.jsonl_reader import chunk_ranges
+from emrio_lib.jsonl_reader import line_offsets
+from emrio_lib.jsonl_reader import offsets_path
+from emrio_lib.jsonl_reader import read_job_flows
+
+TIMEZONE = pytz.timezone('US/Pacific')
+
+
+def create_job(j_id, start, end, groups):
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': end,
+        'instancegroups': [{'instancetype': instance_type,
+                            'instancerequestcount': str(count)}
+                        for instance_type, count in groups]}
+
+
+JOB_FLOWS = [
+    create_job('j-%d' % i, '2012-05-%02dT10:00:00Z' % (1 + i % 28),
+            '2012-05-%02dT12:30:00.5Z' % (1 + i % 28),
+            [('m1.small', 1 + i % 5), ('m1.large', i % 3)][:1 + i % 2])
+    for i in range(200)]
+JOB_FLOWS.insert(7, create_job('j-unfinished', '2012-05-03T10:00:00Z', None,
+                            [('m1.small', 2)]))
+
+
+class TestReadJobFlows(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'history.json')
+        with open(self.filename, 'w') as f:
+            for job in JOB_FLOWS:
+                f.write(json.dumps(job) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def expected(self):
+        return convert_dates(no_date_filter(
+            load_job_flows_from_file(self.filename)), TIMEZONE)
+
+    def test_same_as_loading_and_converting(self):
+        self.assertEqual(read_job_flows(self.filename, TIMEZONE, processes=1),
+                        self.expected())
+
+    def test_parallel(self):
+        self.assertEqual(read_job_flows(self.filename, TIMEZONE, processes=3,
+                                        min_parallel_bytes=0),
+                        self.expected())
+
+    def test_line_offsets_are_saved(self):
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        offsets_dir = os.path.join(self.directory, 'cache')
+        os.mkdir(offsets_dir)
+        offsets = line_offsets(self.filename, data, offsets_dir=offsets_dir)
+        self.assertEqual(len(offsets), len(JOB_FLOWS) + 1)
+        self.assertEqual(offsets[-1], len(data))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                        ['cache', 'history.json'])
+        self.assertTrue(os.path.exists(offsets_path(offsets_dir,
+                                                    self.filename)))
+        # The saved offsets are used without looking at the file.
+        self.assertEqual(line_offsets(self.filename, None,
+                                    offsets_dir=offsets_dir), offsets)
+
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(JOB_FLOWS[0]) + '\n')
+        self.assertEqual(len(read_job_flows(self.filename, TIMEZONE,
+                                            processes=1,
+                                            offsets_dir=offsets_dir)),
+                        len(self.expected()))
+
+    def test_unreadable_line_offsets_are_ignored(self):
+        offsets_dir = self.directory
+        with open(offsets_path(offsets_dir, self.filename), 'wb') as f:
+            f.write('not offsets')
+        self.assertEqual(read_job_flows(self.filename, TIMEZONE, processes=1,
+                                        offsets_dir=offsets_dir),
+                        self.expected())
+
+    def test_chunk_ranges(self):
+        offsets = [0, 10, 20, 30, 40]
+        self.assertEqual(chunk_ranges(offsets, 2), [(0, 20), (20, 40)])
+        self.assertEqual(chunk_ranges(offsets, 3),
+                        [(0, 10), (10, 20), (20, 40)])
+        self.assertEqual(chunk_ranges(offsets, 10),
+                        [(0, 10), (10, 20), (20, 30), (30, 40)])
+
+    def test_not_one_job_per_line(self):
+        with open(self.filename, 'w') as f:
+            f.write(json.dumps(JOB_FLOWS[:3], indent=2))
+        self.assertRaises(ValueError, read_job_flows, self.filename,
+                        TIMEZONE, processes=1)
+
+    def test_missing_keys(self):
+        """Job flows without an id or instance groups without a type are
+        read, like the old loader reads them."""
+        job = create_job('j-1', '2012-05-01T10:00:00Z', '2012-05-01T12:00:00Z',
+                        [('m1.small', 2)])
+        del job['jobflowid']
+        del job['instancegroups'][0]['instancetype']
+        with open(self.filename, 'w') as f:
+            f.write(json.dumps(job) + '\n')
+        job_flows = read_job_flows(self.filename, TIMEZONE, processes=1)
+        self.assertEqual(len(job_flows), 1)
+        self.assertEqual(job_flows[0].get('jobflowid'), None)
+        self.assertEqual(job_flows[0]['instancegroups'],
+            [{'instancetype': None, 'instancerequestcount': '2'}])
+
+    def test_not_an_object_per_line(self):
+        for line in ['[]', '"j-1"', '3']:
+            with open(self.filename, 'w') as f:
+                f.write(json.dumps(JOB_FLOWS[0]) + '\n' + line + '\n')
+            self.assertRaises(ValueError, read_job_flows, self.filename,
+                            TIMEZONE, processes=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
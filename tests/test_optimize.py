@@ -225,6 +225,71 @@ class TestOptimizeFunctions(TestCase):
         for util in optimized:
             self.assertEquals(optimized[util], empty_type)
 
+    def test_demand_hours_skip_hopeless_types(self):
+        """Given demand hours, instance types that can't save money are
+        skipped, and the result is the same as without them."""
+        # A single hour long job in a month is never worth reserving.
+        end_time = BASETIME + DEMAND_INTERVAL
+        interval = DAY_INCREMENT * 30
+        current_jobs = create_parallel_jobs(1, end_time=end_time)
+        demand_hours = {INSTANCE_NAME: BASE_INSTANCES}
+        optimizer = Optimizer(current_jobs, EC2, interval,
+            demand_hours=demand_hours)
+        self.assertFalse(optimizer.could_save_money(INSTANCE_NAME))
+        self.assertEqual(optimizer.run(),
+            Optimizer(current_jobs, EC2, interval).run())
+
+        # Long running jobs are worth reserving so they still get optimized.
+        current_jobs = create_parallel_jobs(JOB_AMOUNT)
+        demand_hours = {INSTANCE_NAME: 23 * JOB_AMOUNT * BASE_INSTANCES}
+        optimizer = Optimizer(current_jobs, EC2, DAY_INCREMENT,
+            demand_hours=demand_hours)
+        self.assertTrue(optimizer.could_save_money(INSTANCE_NAME))
+
+    def test_warm_start(self):
+        """Starting from a pool near the optimum finds the same optimum with
+        fewer simulations, whether the pool has too many or too few
+        instances."""
+        end_time = BASETIME + MEDIUM_INTERVAL
+        current_jobs = create_parallel_jobs(JOB_AMOUNT)
+        current_jobs.extend(create_parallel_jobs(JOB_AMOUNT, end_time=end_time,
+                                                start_count=JOB_AMOUNT))
+        cold = Optimizer(current_jobs, EC2, DAY_INCREMENT)
+        optimal = cold.run()
+
+        initial_pool = copy.deepcopy(optimal)
+        initial_pool[HEAVY_UTIL][INSTANCE_NAME] -= 3
+        initial_pool[MEDIUM_UTIL][INSTANCE_NAME] += 4
+        initial_pool[LIGHT_UTIL][INSTANCE_NAME] += 2
+        warm = Optimizer(current_jobs, EC2, DAY_INCREMENT)
+        self.assertEqual(warm.run(initial_pool=initial_pool), optimal)
+        self.assertTrue(warm.stats.simulations_run <
+                        cold.stats.simulations_run)
+
+    def test_warm_start_keeps_pre_existing_pool(self):
+        """Warm starting never removes instances that are already owned."""
+        current_jobs = create_parallel_jobs(JOB_AMOUNT)
+        owned = EC2.init_empty_reserve_pool()
+        owned[LIGHT_UTIL][INSTANCE_NAME] = 3
+        initial_pool = EC2.init_empty_reserve_pool()
+        initial_pool[LIGHT_UTIL][INSTANCE_NAME] = 5
+        initial_pool[HEAVY_UTIL][INSTANCE_NAME] = JOB_AMOUNT * BASE_INSTANCES
+        optimized = Optimizer(current_jobs, EC2, DAY_INCREMENT).run(
+            pre_existing_pool=owned, initial_pool=initial_pool)
+        self.assertEqual(optimized[LIGHT_UTIL][INSTANCE_NAME], 3)
+
+    def test_optimizer_stats(self):
+        """The optimizer counts its simulations and iterations."""
+        current_jobs = create_parallel_jobs(JOB_AMOUNT)
+        optimizer = Optimizer(current_jobs, EC2, DAY_INCREMENT)
+        optimizer.run()
+        stats = optimizer.stats
+        # One iteration per instance bought plus the one that stops it.
+        self.assertEqual(stats.iterations,
+            {INSTANCE_NAME: JOB_AMOUNT * BASE_INSTANCES + 1})
+        self.assertEqual(stats.simulator.runs, stats.simulations_run)
+        self.assertEqual(stats.cache_hits, 0)
+
     def test_interval_converter_two_months(self):
         """If using 2 months worth of data, it should multiply all the values
         by 6 to get a yearly prediction
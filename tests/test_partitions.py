@@ -0,0 +1,121 @@
+"""Tests for job flow histories partitioned by day or week."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from emrio_lib.job_store import day_to_time
+from emrio_lib.partitions import DAY
+from emrio_lib.partitions import is_partitioned_history
+from emrio_lib.partitions import manifest_path
+from emrio_lib.partitions import PartitionedHistory
+from emrio_lib.partitions import UNDATED
+from emrio_lib.partitions import WEEK
+
+
+def create_job(j_id, start, end, count=2):
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': end,
+        'instancegroups': [{'instancetype': 'm1.small',
+                            'instancerequestcount': str(count)}]}
+
+
+JOB_FLOWS = [
+    create_job('j-1', '2012-05-01T10:00:00Z', '2012-05-01T12:00:00Z'),
+    # Runs for four days.
+    create_job('j-2', '2012-05-01T23:00:00.5Z', '2012-05-05T01:00:00Z'),
+    create_job('j-3', '2012-05-03T10:00:00Z', '2012-05-03T11:00:00Z'),
+    create_job('j-4', '2012-05-05T23:00:00Z', '2012-05-06T02:00:00Z'),
+    create_job('j-5', '2012-05-08T00:00:00Z', None),
+    create_job('j-6', None, None),
+]
+
+
+class TestPartitionedHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), 'history')
+        self.history = PartitionedHistory(self.directory, period=DAY)
+        self.history.upsert(JOB_FLOWS)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.directory))
+
+    def job_ids(self, job_flows):
+        return [job['jobflowid'] for job in job_flows]
+
+    def test_manifest(self):
+        self.assertTrue(is_partitioned_history(self.directory))
+        with open(manifest_path(self.directory)) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['period'], DAY)
+        self.assertEqual(sorted(manifest['partitions']),
+            ['2012-05-01', '2012-05-03', '2012-05-05', '2012-05-08',
+            UNDATED])
+        partition = manifest['partitions']['2012-05-01']
+        self.assertEqual(partition['rows'], 2)
+        self.assertEqual(partition['min_start'], '2012-05-01T10:00:00.000000Z')
+        self.assertEqual(partition['max_end'], '2012-05-05T01:00:00.000000Z')
+        self.assertEqual(len(PartitionedHistory(self.directory)),
+                        len(JOB_FLOWS))
+
+    def test_query_everything(self):
+        self.assertEqual(sorted(self.job_ids(self.history.query())),
+                        sorted(self.job_ids(JOB_FLOWS)))
+
+    def test_query_days(self):
+        """Like range_date_filter, job flows have to start on or after the
+        min day and end on or before the max day."""
+        for min_day, max_day, expected in [
+                ('2012/05/01', '2012/05/04', ['j-1', 'j-3']),
+                ('2012/05/01', '2012/05/06', ['j-1', 'j-2', 'j-3']),
+                ('2012/05/02', None, ['j-3', 'j-4', 'j-5']),
+                (None, '2012/05/02', ['j-1'])]:
+            self.assertEqual(
+                self.job_ids(self.history.query(min_day, max_day)), expected)
+
+    def test_only_overlapping_partitions_are_read(self):
+        # j-2 runs over the 3rd, but its partition is the 1st's.
+        self.assertEqual(self.history.overlapping_partitions(
+            day_to_time('2012/05/03'), day_to_time('2012/05/07')),
+            ['2012-05-03', '2012-05-05'])
+        # Nothing on the 5th ends by the 6th.
+        self.assertEqual(self.history.overlapping_partitions(
+            day_to_time('2012/05/03'), day_to_time('2012/05/06')),
+            ['2012-05-03'])
+        self.assertEqual(self.history.overlapping_partitions(
+            None, day_to_time('2012/05/02')), ['2012-05-01'])
+        self.assertEqual(self.history.overlapping_partitions(
+            day_to_time('2012/05/02'), day_to_time('2012/05/03')), [])
+
+    def test_upsert_replaces(self):
+        started = create_job('j-6', '2012-05-03T01:00:00Z',
+                            '2012-05-03T02:00:00Z')
+        finished = create_job('j-5', '2012-05-08T00:00:00Z',
+                            '2012-05-08T03:00:00Z', count=4)
+        history = PartitionedHistory(self.directory)
+        history.upsert([started, finished])
+        self.assertEqual(len(history), len(JOB_FLOWS))
+        self.assertEqual(history.partitions[UNDATED]['rows'], 0)
+        job_flows = dict((job['jobflowid'], job) for job in history.query())
+        self.assertEqual(job_flows['j-6'], started)
+        self.assertEqual(job_flows['j-5'], finished)
+
+    def test_weeks(self):
+        directory = os.path.join(os.path.dirname(self.directory), 'weekly')
+        history = PartitionedHistory(directory, period=WEEK)
+        history.upsert(JOB_FLOWS)
+        # 2012-04-30 and 2012-05-07 are Mondays.
+        self.assertEqual(sorted(history.partitions),
+                        ['2012-04-30', '2012-05-07', UNDATED])
+
+    def test_period_mismatch(self):
+        self.assertRaises(ValueError, PartitionedHistory, self.directory,
+                        period=WEEK)
+
+
+if __name__ == '__main__':
+    unittest.main()
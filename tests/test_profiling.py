@@ -0,0 +1,66 @@
+"""Tests for the per-stage profiler behind --profile."""
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from emrio_lib.profiling import peak_rss_kb
+from emrio_lib.profiling import StageProfiler
+
+
+class TestStageProfiler(unittest.TestCase):
+
+    def test_disabled_records_nothing(self):
+        profiler = StageProfiler()
+        with profiler.stage('optimize'):
+            pass
+        self.assertEqual(profiler.stages, [])
+
+    def test_records_stages_in_order(self):
+        profiler = StageProfiler(enabled=True)
+        with profiler.stage('fetch'):
+            pass
+        with profiler.stage('optimize'):
+            sum(xrange(10000))
+        self.assertEqual([stage['stage'] for stage in profiler.stages],
+                        ['fetch', 'optimize'])
+        for stage in profiler.stages:
+            self.assertTrue(stage['wall_seconds'] >= 0)
+
+        out = StringIO()
+        profiler.report(out)
+        self.assertTrue('optimize' in out.getvalue())
+
+    def test_peak_memory_growth(self):
+        """Each stage records how much it raised the process' peak memory,
+        which is nothing for a stage after a bigger one."""
+        if peak_rss_kb() is None:
+            return
+        profiler = StageProfiler(enabled=True)
+        with profiler.stage('load'):
+            # Bigger than the peak so far, whatever ran before.
+            data = ' ' * ((peak_rss_kb() + 16 * 1024) * 1024)
+            del data
+        with profiler.stage('report'):
+            pass
+        load, report = profiler.stages
+        self.assertTrue(load['peak_rss_growth_kb'] > 0)
+        self.assertEqual(report['peak_rss_growth_kb'], 0)
+        self.assertEqual(report['peak_rss_kb'], load['peak_rss_kb'])
+
+    def test_profile_dir(self):
+        """Every stage gets a pstats file when given a directory."""
+        directory = tempfile.mkdtemp()
+        try:
+            profiler = StageProfiler(profile_dir=directory)
+            with profiler.stage('simulate'):
+                pass
+            self.assertTrue(profiler.enabled)
+            self.assertTrue(os.path.exists(
+                os.path.join(directory, 'simulate.pstats')))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""Tests for emrio serve."""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+
+import pytz
+
+from emrio_lib.server import EMRioServer
+from emrio_lib.server import JobFlowHistory
+
+TIMEZONE = pytz.timezone("US/Alaska")
+PRICES = "tests/test_prices.yaml"
+INSTANCE_NAME = 'm1.small'
+
+
+def job_line(j_id, day, count=10, hours=20):
+    job = {'jobflowid': j_id,
+        'startdatetime': '2012-05-%02dT00:00:00Z' % day,
+        'enddatetime': '2012-05-%02dT%02d:00:00Z' % (day, hours),
+        'instancegroups': [{'instancetype': INSTANCE_NAME,
+                            'instancerequestcount': str(count)}]}
+    return json.dumps(job) + '\n'
+
+
+class TestJobFlowHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'history.json')
+        with open(self.filename, 'w') as f:
+            f.write(job_line('j-1', 1) + job_line('j-2', 2))
+        self.history = JobFlowHistory(self.filename, TIMEZONE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_appended_lines_are_read(self):
+        """New jobs appended to the file are added with their demand hours,
+        and a partly written line is left for later."""
+        self.assertEqual(self.history.demand_hours[INSTANCE_NAME], 400)
+        with open(self.filename, 'a') as f:
+            f.write(job_line('j-3', 3) + job_line('j-4', 4)[:20])
+        self.assertTrue(self.history.refresh())
+        self.assertEqual(len(self.history.job_flows()), 3)
+        self.assertEqual(self.history.demand_hours[INSTANCE_NAME], 600)
+
+        with open(self.filename, 'a') as f:
+            f.write(job_line('j-4', 4)[20:])
+        self.history.refresh()
+        self.assertEqual([job['jobflowid'] for job in
+                        self.history.job_flows()], ['j-1', 'j-2', 'j-3', 'j-4'])
+        self.assertFalse(self.history.refresh())
+
+    def test_rewritten_file_is_reloaded(self):
+        """A rewritten file is read again from scratch, so jobs that were
+        removed are dropped."""
+        with open(self.filename, 'w') as f:
+            f.write(job_line('j-9', 9, count=1) + job_line('j-8', 8) +
+                    job_line('j-7', 7))
+        self.history.refresh()
+        self.assertEqual(sorted(self.history.jobs_by_id),
+                        ['j-7', 'j-8', 'j-9'])
+        self.assertEqual(self.history.demand_hours[INSTANCE_NAME], 420)
+
+
+class TestEMRioServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        filename = os.path.join(self.directory, 'history.json')
+        with open(filename, 'w') as f:
+            for day in range(1, 29):
+                f.write(job_line('j-%d' % day, day, count=day))
+        history = JobFlowHistory(filename, TIMEZONE)
+        self.server = EMRioServer(('127.0.0.1', 0), history, PRICES)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def post(self, path, request):
+        response = urllib2.urlopen(self.url + path, json.dumps(request))
+        return json.loads(response.read())
+
+    def test_status(self):
+        status = json.loads(urllib2.urlopen(self.url + '/status').read())
+        self.assertEqual(status['job_flows'], 28)
+
+    def test_report_matches_evaluating_the_optimal_pool(self):
+        """/report optimizes, and evaluating the pool it found gives the
+        same report."""
+        report = self.post('/report', {})
+        optimal = report['pools']['optimal']
+        self.assertTrue(any(optimal[utilization_class].get(INSTANCE_NAME)
+                            for utilization_class in optimal))
+        self.assertEqual(self.post('/optimize', {})['pool'], optimal)
+        self.assertEqual(self.post('/evaluate', {'pool': optimal}), report)
+
+    def test_date_range(self):
+        """An empty pool costs the same as on demand, and the date range
+        limits the hours (fewer instances ran in the first week)."""
+        report = self.post('/evaluate', {'min_day': '2012/05/01',
+                                        'max_day': '2012/05/08'})
+        all_report = self.post('/evaluate', {})
+        self.assertEqual(report['cost']['optimized'],
+                        report['cost']['on_demand'])
+        self.assertTrue(report['cost']['on_demand'] <
+                        all_report['cost']['on_demand'])
+
+    def assert_bad_request(self, path, request):
+        try:
+            self.post(path, request)
+        except urllib2.HTTPError, ex:
+            self.assertEqual(ex.code, 400)
+            self.assertTrue('error' in json.loads(ex.read()))
+        else:
+            self.fail("Expected a 400 response")
+
+    def test_bad_request(self):
+        self.assert_bad_request('/evaluate',
+                                {'pool': {'No Such Utilization': {}}})
+
+    def test_bad_pool_count(self):
+        self.assert_bad_request('/evaluate',
+            {'pool': {'Heavy Utilization': {INSTANCE_NAME: [1]}}})
+
+    def test_changed_price_file_is_read_again(self):
+        prices = os.path.join(self.directory, 'prices.yaml')
+        shutil.copy(PRICES, prices)
+        self.server.ec2_info(prices)
+        self.assertTrue(self.server.ec2_info(prices) is
+                        self.server.ec2_info(prices))
+        with open(PRICES) as f:
+            cheaper = f.read().replace('m1.small: {upfront: 69,',
+                                    'm1.small: {upfront: 1,')
+        with open(prices, 'w') as f:
+            f.write(cheaper)
+        mtime = os.path.getmtime(prices) + 10
+        os.utime(prices, (mtime, mtime))
+        EC2 = self.server.ec2_info(prices)
+        self.assertEqual(EC2.COST['Light Utilization'][INSTANCE_NAME]
+                        ['upfront'], 1)
+        self.assertEqual(len(self.server.ec2_infos), 1)
+
+    def test_bad_price_file(self):
+        self.assert_bad_request('/optimize', {'instance_costs':
+            os.path.join(self.directory, 'history.json')})
+        self.assert_bad_request('/optimize', {'instance_costs':
+            os.path.join(self.directory, 'no_such_prices.yaml')})
+
+
+if __name__ == '__main__':
+    unittest.main()
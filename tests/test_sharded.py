@@ -0,0 +1,108 @@
+"""Tests for simulating time shards of the job flows in parallel."""
+import datetime
+import unittest
+
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.sharded import shard_tasks
+from emrio_lib.sharded import ShardedSimulator
+from emrio_lib.simulate_jobs import Simulator
+
+EC2 = EC2Info("tests/test_prices.yaml")
+BASE_TIME = datetime.datetime(2012, 5, 1, 3)
+INSTANCE_NAME = 'm1.small'
+
+
+def create_job(j_id, start_minutes, count, hours):
+    start = BASE_TIME + datetime.timedelta(0, start_minutes * 60)
+    return {
+        'jobflowid': j_id,
+        'startdatetime': start,
+        'enddatetime': start + datetime.timedelta(0, hours * 3600 + 60),
+        'instancegroups': [{'instancetype': INSTANCE_NAME,
+                            'instancerequestcount': str(count)}]}
+
+
+# Overlapping jobs of different sizes, so they compete for the pool.
+JOB_FLOWS = [create_job('j-%d' % i, 97 * i + 13 * (i % 7), 1 + i % 5,
+                        1 + (7 * i) % 11)
+            for i in range(60)]
+
+
+def make_pool(count):
+    pool = EC2.init_empty_reserve_pool()
+    for utilization_class in EC2.RESERVE_PRIORITIES:
+        pool[utilization_class][INSTANCE_NAME] = count
+    return pool
+
+
+def without_zeros(logged_hours):
+    return dict((utilization_class, dict(
+                    (instance_type, hours)
+                    for instance_type, hours in logged_hours[
+                        utilization_class].items() if hours))
+                for utilization_class in logged_hours)
+
+
+class TestShardTasks(unittest.TestCase):
+
+    def test_shards_cover_the_timeline(self):
+        timeline = Simulator(JOB_FLOWS, None,
+                            EC2).sorted_job_event_timeline()
+        tasks = shard_tasks(timeline, 4, datetime.timedelta(0, 3600))
+        self.assertEqual(len(tasks), 4)
+        self.assertEqual(tasks[0][:2], ([], []))
+        self.assertEqual([event for _, _, events in tasks
+                        for event in events], timeline)
+
+        # Seeded jobs started before the overlap and ended after it started.
+        seed_jobs, settle_events, events = tasks[2]
+        self.assertTrue(seed_jobs)
+        settle_start = settle_events[0][0]
+        for job in seed_jobs:
+            self.assertTrue(job['startdatetime'] < settle_start)
+            self.assertTrue(job['enddatetime'] >= settle_start)
+
+    def test_empty_shards_are_left_out(self):
+        # Events at 0, 60 and 61 minutes.
+        timeline = Simulator(JOB_FLOWS[:1], None,
+                            EC2).sorted_job_event_timeline()
+        tasks = shard_tasks(timeline, 50, datetime.timedelta(0, 3600))
+        self.assertEqual([len(events) for _, _, events in tasks], [1, 2])
+
+
+class TestShardedSimulator(unittest.TestCase):
+
+    def assert_matches_serial(self, pool, **kwargs):
+        expected = Simulator(JOB_FLOWS, pool, EC2).run()
+        simulator = ShardedSimulator(JOB_FLOWS, pool, EC2, **kwargs)
+        self.assertEqual(without_zeros(simulator.run()),
+                        without_zeros(expected))
+        return simulator
+
+    def test_matches_serial(self):
+        for count in (0, 3, 8, 40):
+            for shards in (1, 2, 5, 20):
+                self.assert_matches_serial(make_pool(count), shards=shards,
+                                        processes=1)
+
+    def test_matches_serial_in_processes(self):
+        self.assert_matches_serial(make_pool(5), shards=4, processes=2)
+
+    def test_wrong_seeds_are_simulated_again(self):
+        """Without an overlap to settle in, some shards start from the
+        wrong allocations, but the hours still match."""
+        simulator = self.assert_matches_serial(
+            make_pool(4), shards=10, overlap=datetime.timedelta(0),
+            checkpoints=1, processes=1)
+        self.assertTrue(simulator.resimulated_events > 0)
+
+    def test_counts_every_event(self):
+        simulator = self.assert_matches_serial(make_pool(3), shards=1,
+                                            processes=1)
+        serial = Simulator(JOB_FLOWS, make_pool(3), EC2)
+        serial.run()
+        self.assertEqual(simulator.stats.events, serial.stats.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
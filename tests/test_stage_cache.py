@@ -0,0 +1,129 @@
+"""Tests for the stage cache used to skip pipeline stages whose inputs
+haven't changed."""
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pytz
+
+from emrio_lib.ec2_cost import EC2Info
+from emrio_lib.EMRio import simulate_job_flows
+from emrio_lib.stage_cache import ENTRY_SUFFIX
+from emrio_lib.stage_cache import hash_file
+from emrio_lib.stage_cache import StageCache
+from emrio_lib.stage_cache import pool_items
+
+HEAVY_UTIL = "Heavy Utilization"
+MEDIUM_UTIL = "Medium Utilization"
+LIGHT_UTIL = "Light Utilization"
+PRICES = 'tests/test_prices.yaml'
+BASE_TIME = datetime.datetime(2012, 5, 20, 5)
+
+
+class TestStageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        cache = StageCache(self.directory)
+        key = cache.key('optimize', 'history', ['a', 1])
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, {'pool': [1, 2, 3]})
+        self.assertEqual(cache.get(key), {'pool': [1, 2, 3]})
+
+    def test_round_trip_job_flows(self):
+        """The history stage's job flows keep their dates and timezones."""
+        cache = StageCache(self.directory)
+        timezone = pytz.timezone('US/Pacific')
+        job_flows = [{
+            'jobflowid': 'j-1',
+            'startdatetime': BASE_TIME.replace(tzinfo=timezone),
+            'enddatetime': BASE_TIME + datetime.timedelta(0, 90.5),
+            'instancegroups': [{'instancetype': 'm1.small',
+                                'instancerequestcount': '2'}]}]
+        cache.put('history', [job_flows, {'m1.small': 4.0}])
+        self.assertEqual(cache.get('history'), [job_flows, {'m1.small': 4.0}])
+        with open(os.path.join(self.directory,
+                            'history' + ENTRY_SUFFIX)) as f:
+            self.assertTrue('US/Pacific' in f.read())
+
+    def test_unreadable_entry_is_a_miss(self):
+        cache = StageCache(self.directory)
+        path = os.path.join(self.directory, 'broken' + ENTRY_SUFFIX)
+        with open(path, 'w') as f:
+            f.write('{"pool": ')
+        self.assertEqual(cache.get('broken'), None)
+        self.assertFalse(os.path.exists(path))
+
+    def test_keys_depend_on_every_part(self):
+        cache = StageCache(self.directory)
+        self.assertEqual(cache.key('history', 'abc', None),
+                        cache.key('history', 'abc', None))
+        self.assertNotEqual(cache.key('history', 'abc', None),
+                            cache.key('history', 'abc', '2012/05/20'))
+
+    def test_evicts_least_recently_used(self):
+        """Once the cache is too big, the entry that was read least recently
+        is the one that goes."""
+        value = 'x' * 1000
+        cache = StageCache(self.directory, max_bytes=2500)
+        cache.put('old', value)
+        cache.put('new', value)
+        # Make 'old' the most recently used entry.
+        old_time = time.time() - 100
+        os.utime(os.path.join(self.directory, 'new' + ENTRY_SUFFIX),
+                (old_time, old_time))
+        cache.get('old')
+        cache.put('newest', value)
+
+        self.assertEqual(cache.get('new'), None)
+        self.assertEqual(cache.get('old'), value)
+        self.assertEqual(cache.get('newest'), value)
+
+    def test_pool_items_skip_zeros(self):
+        pool = {HEAVY_UTIL: {'m1.small': 2, 'm1.large': 0},
+                MEDIUM_UTIL: {'m1.small': 1}}
+        self.assertEqual(pool_items(pool),
+            [[HEAVY_UTIL, 'm1.small', 2], [MEDIUM_UTIL, 'm1.small', 1]])
+
+    def test_simulated_hours_depend_on_prices(self):
+        """The reserve priorities in the price file decide which reserved
+        instances are used first, so they can't share simulated hours."""
+        light_first = os.path.join(self.directory, 'light_first.yaml')
+        with open(PRICES) as f:
+            prices = f.read()
+        with open(light_first, 'w') as f:
+            f.write(prices.replace(
+                'reserve_priorities: [*heavy_util, *medium_util, *light_util]',
+                'reserve_priorities: [*light_util, *heavy_util, *medium_util]'))
+        job_flows = [{
+            'jobflowid': 'j-1',
+            'startdatetime': BASE_TIME,
+            'enddatetime': BASE_TIME + datetime.timedelta(0, 3 * 3600),
+            'instancegroups': [{'instancetype': 'm1.small',
+                                'instancerequestcount': '1'}]}]
+        cache = StageCache(os.path.join(self.directory, 'cache'))
+
+        hours = {}
+        for filename in (PRICES, light_first):
+            EC2 = EC2Info(filename)
+            pool = EC2.init_empty_reserve_pool()
+            pool[HEAVY_UTIL]['m1.small'] = 1
+            pool[LIGHT_UTIL]['m1.small'] = 1
+            hours[filename], _ = simulate_job_flows(job_flows, pool, EC2,
+                stage_cache=cache, history_key='history',
+                prices_key=hash_file(filename))
+        self.assertTrue(hours[PRICES][HEAVY_UTIL]['m1.small'] > 0)
+        self.assertEqual(hours[PRICES][LIGHT_UTIL]['m1.small'], 0)
+        self.assertEqual(hours[light_first][HEAVY_UTIL]['m1.small'], 0)
+        self.assertTrue(hours[light_first][LIGHT_UTIL]['m1.small'] > 0)
+
+if __name__ == '__main__':
+    unittest.main()